@@ -26,6 +26,42 @@ ARUCO_DICT = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
 PARAMS = aruco.DetectorParameters()
 DETECTOR = aruco.ArucoDetector(ARUCO_DICT, PARAMS)
 
+# --- DETECÇÃO EM PIRÂMIDE (resolução reduzida) ---
+# Os marcadores de 6 cm são grandes na imagem nas distâncias que importam, então
+# a detecção pode rodar em 1/2 ou 1/4 da resolução. Os cantos encontrados são
+# reescalados e refinados em resolução cheia (subpixel) antes do solvePnP.
+ESCALA_DETECCAO = 1                 # 1 = resolução cheia, 2 = metade, 4 = um quarto
+SUBPIX_CRITERIO = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+
+# --- RASTREIO POR JANELAS (ROI) ---
+# Quando ativo, a detecção roda apenas em janelas ao redor da posição prevista
+# de cada marcador já conhecido; o frame inteiro é varrido periodicamente ou
+# quando algum marcador rastreado é perdido.
+RASTREIO_ATIVO = False
+RASTREIO_MARGEM = 0.6               # Expansão da caixa prevista (fração do lado) em cada direção
+RASTREIO_JANELA_MIN_PX = 48         # Lado mínimo da janela de busca
+RASTREIO_INTERVALO_VARREDURA = 15   # Varredura completa a cada N frames (procura marcadores novos)
+RASTREIO_PERIMETRO_MIN = 0.5        # minMarkerPerimeterRate na janela: o marcador ocupa boa parte dela
+
+# Detector das janelas: o perímetro mínimo é relativo ao tamanho da imagem, então
+# na janela recortada ele precisa ser bem maior para descartar candidatos pequenos.
+PARAMS_JANELA = aruco.DetectorParameters()
+PARAMS_JANELA.minMarkerPerimeterRate = RASTREIO_PERIMETRO_MIN
+DETECTOR_JANELA = aruco.ArucoDetector(ARUCO_DICT, PARAMS_JANELA)
+
+# --- FILTRO TEMPORAL (KALMAN POR MARCADOR) ---
+# Filtro de velocidade constante sobre (dist_ponta, tx_cm) de cada marcador.
+# Suaviza as medidas que chegam à FSM e permite rodar a detecção completa só a
+# cada DETECCAO_A_CADA_N ciclos: nos ciclos intermediários a FSM recebe a pose
+# prevista. O passo de tempo é o ciclo do loop (determinístico no replay).
+FILTRO_ATIVO = False
+DETECCAO_A_CADA_N = 3               # 1 = detecta em todo frame (filtro só suaviza)
+FILTRO_MAX_PERDAS = 6               # Ciclos sem medida antes de descartar o marcador
+FILTRO_R_DIST = 0.01 ** 2           # Variância da medida de dist_ponta (m²)
+FILTRO_R_TX = 0.5 ** 2              # Variância da medida de tx_cm (cm²)
+FILTRO_Q_DIST = 0.005 ** 2          # Ruído de processo (aceleração) em dist_ponta
+FILTRO_Q_TX = 0.3 ** 2              # Ruído de processo (aceleração) em tx_cm
+
 # =============================================================================
 # CÂMERA CALIBRAÇÃO (Matriz K)
 # =============================================================================
@@ -37,6 +73,33 @@ CAM_MATRIX = np.array([
 
 DIST_COEFFS = np.zeros((5, 1))
 
+# =============================================================================
+# POSE: CONSTANTES E BUFFERS PRÉ-ALOCADOS
+# =============================================================================
+# Pontos 3D reais do marcador (no sistema de coordenadas do marcador), na ordem
+# dos cantos do ArUco (exigida pelo SOLVEPNP_IPPE_SQUARE).
+_HALF = MARKER_SIZE / 2
+OBJ_POINTS = np.array([
+    [-_HALF, _HALF, 0],
+    [_HALF, _HALF, 0],
+    [_HALF, -_HALF, 0],
+    [-_HALF, -_HALF, 0]
+], dtype=np.float32)
+
+# Resultado compacto de calcular_pose_aruco (um registro por marcador)
+POSE_DTYPE = np.dtype([
+    ("id", np.int32),
+    ("dist_ponta", np.float64),     # Distância de navegação efetiva em metros.
+    ("tx_cm", np.float64),          # Desvio lateral em cm (X negativo = esquerda, X positivo = direita).
+    ("rvec", np.float64, (3,)),
+    ("tvec", np.float64, (3,)),
+])
+SEM_POSES = np.empty(0, dtype=POSE_DTYPE)
+
+# Buffers de trabalho do solvePnP (crescem se aparecerem mais marcadores)
+_BUF_RVEC = np.empty((8, 3), dtype=np.float64)
+_BUF_TVEC = np.empty((8, 3), dtype=np.float64)
+
 logger.info("ARUCO_NAV: modulo inicializado")
 
 # =============================================================================
@@ -50,71 +113,338 @@ EM_CORRECAO = False             # Flag para indicar que o robô está executando
 ULTIMO_ARUCO_GIRADO = None      # ID do marcador que acionou o último giro de 180 graus.
 AGUARDANDO_NOVO_ARUCO = False   # Trava para evitar giros múltiplos no mesmo marcador.
 
-LAST_DIST_LOG = {}              # Log para registrar a última distância e evitar logs repetitivos.
+# Última distância logada (cm) por ID do dicionário, para evitar logs repetitivos.
+SEM_LOG = np.iinfo(np.int32).min
+LAST_DIST_LOG = np.full(250, SEM_LOG, dtype=np.int32)
+
+# Estado do rastreio: id -> {"bbox": [x0, y0, x1, y1], "vel": [dx, dy]} (pixels)
+RASTREIO = {}
+FRAMES_DESDE_VARREDURA = 0
+
+# Estado do filtro: id -> {"kf": cv2.KalmanFilter, "perdas": int, "rvec", "tvec"}
+FILTROS = {}
+CICLO_ARUCO = 0
+
+
+def resetar_estado():
+    """Volta a FSM ao estado inicial (usado no replay para execuções determinísticas)."""
+    global FAIXA_ATUAL, POSICAO_X_CM, EM_CORRECAO
+    global ULTIMO_ARUCO_GIRADO, AGUARDANDO_NOVO_ARUCO, CICLO_ARUCO
+
+    FAIXA_ATUAL = 0
+    POSICAO_X_CM = 0
+    EM_CORRECAO = False
+    ULTIMO_ARUCO_GIRADO = None
+    AGUARDANDO_NOVO_ARUCO = False
+    LAST_DIST_LOG.fill(SEM_LOG)
+    RASTREIO.clear()
+    FILTROS.clear()
+    CICLO_ARUCO = 0
 
 # =============================================================================
-# DETECÇÃO E MEDIÇÕES (solvePnP)
+# DETECÇÃO (FRAME INTEIRO OU RASTREIO POR JANELAS)
 # =============================================================================
-def calcular_pose_aruco(frame):
+def _refinar_cantos(gray, corners, escala):
     """
-    Detecta marcadores ArUco no frame, calcula a pose 3D (rvec, tvec) de cada um,
-    e estima a distância de navegação (dist_ponta) e o desvio lateral (tx_cm).
+    Leva os cantos detectados na imagem reduzida para a resolução cheia e os
+    refina com cornerSubPix (janela proporcional à escala).
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    corners, ids, rejected = DETECTOR.detectMarkers(gray)
-
+    pts = np.concatenate(corners).reshape(-1, 1, 2).astype(np.float32)
+    # Centro do pixel: (x + 0.5) * escala - 0.5
+    pts = (pts + 0.5) * escala - 0.5
+    janela = escala + 1
+    cv2.cornerSubPix(gray, pts, (janela, janela), (-1, -1), SUBPIX_CRITERIO)
+    return tuple(pts.reshape(-1, 1, 4, 2))
+
+
+def _detectar_completo(gray):
+    if ESCALA_DETECCAO <= 1:
+        corners, ids, _ = DETECTOR.detectMarkers(gray)
+        return corners, ids
+
+    reduzido = cv2.resize(
+        gray, None, fx=1.0 / ESCALA_DETECCAO, fy=1.0 / ESCALA_DETECCAO,
+        interpolation=cv2.INTER_AREA
+    )
+    corners, ids, _ = DETECTOR.detectMarkers(reduzido)
     if ids is None:
-        return []
+        return corners, ids
+    return _refinar_cantos(gray, corners, ESCALA_DETECCAO), ids
 
-    ids = ids.flatten()
-    half = MARKER_SIZE / 2
 
-    # Definição dos pontos 3D reais do marcador (no sistema de coordenadas do marcador).
-    obj_points = np.array([
-        [-half, half, 0],
-        [half, half, 0],
-        [half, -half, 0],
-        [-half, -half, 0]
-    ], dtype=np.float32)
+def _janela_prevista(estado, largura, altura):
+    """Caixa do último frame deslocada pela velocidade e expandida pela margem."""
+    x0, y0, x1, y1 = estado["bbox"]
+    dx, dy = estado["vel"]
+    lado = max(x1 - x0, y1 - y0)
+    margem = max(lado * RASTREIO_MARGEM, (RASTREIO_JANELA_MIN_PX - lado) / 2, 0)
 
-    arucos = []
+    x0 = int(max(x0 + dx - margem, 0))
+    y0 = int(max(y0 + dy - margem, 0))
+    x1 = int(min(x1 + dx + margem, largura))
+    y1 = int(min(y1 + dy + margem, altura))
+    return x0, y0, x1, y1
 
-    for i, marker_id in enumerate(ids):
+
+def _detectar_rastreado(gray):
+    """
+    Procura cada marcador conhecido apenas na sua janela prevista.
+
+    Retorna (corners, ids) no mesmo formato de detectMarkers, ou None se o
+    rastreio foi perdido (algum marcador não reapareceu na sua janela).
+    """
+    altura, largura = gray.shape[:2]
+    corners, ids = [], []
+
+    for marker_id, estado in RASTREIO.items():
+        if marker_id in ids:
+            continue  # já encontrado na janela de outro marcador
+
+        x0, y0, x1, y1 = _janela_prevista(estado, largura, altura)
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+
+        c_jan, ids_jan, _ = DETECTOR_JANELA.detectMarkers(gray[y0:y1, x0:x1])
+        if ids_jan is None:
+            return None
+
+        offset = np.array([x0, y0], dtype=np.float32)
+        for c, i in zip(c_jan, ids_jan.flatten()):
+            if i not in ids:
+                corners.append(c + offset)
+                ids.append(i)
+
+        if marker_id not in ids:
+            return None
+
+    if not ids:
+        return None
+    return tuple(corners), np.array(ids, dtype=np.int32).reshape(-1, 1)
+
+
+def _atualizar_rastreio(corners, ids):
+    """Recalcula caixa e velocidade de cada marcador detectado neste frame."""
+    novos = {}
+    if ids is not None:
+        for c, marker_id in zip(corners, ids.flatten()):
+            pts = c.reshape(-1, 2)
+            bbox = np.array([pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max()])
+            anterior = RASTREIO.get(int(marker_id))
+            if anterior is not None:
+                vel = ((bbox[:2] + bbox[2:]) - (anterior["bbox"][:2] + anterior["bbox"][2:])) / 2
+            else:
+                vel = np.zeros(2)
+            novos[int(marker_id)] = {"bbox": bbox, "vel": vel}
+
+    RASTREIO.clear()
+    RASTREIO.update(novos)
+
+
+def detectar_marcadores(gray):
+    """
+    Detecta marcadores no frame em tons de cinza.
+
+    Com RASTREIO_ATIVO, busca apenas nas janelas previstas e faz a varredura
+    completa a cada RASTREIO_INTERVALO_VARREDURA frames, quando não há
+    marcadores rastreados ou quando o rastreio é perdido.
+    """
+    global FRAMES_DESDE_VARREDURA
+
+    if not RASTREIO_ATIVO:
+        return _detectar_completo(gray)
+
+    resultado = None
+    if RASTREIO and FRAMES_DESDE_VARREDURA < RASTREIO_INTERVALO_VARREDURA:
+        resultado = _detectar_rastreado(gray)
+
+    if resultado is None:
+        resultado = _detectar_completo(gray)
+        FRAMES_DESDE_VARREDURA = 0
+    else:
+        FRAMES_DESDE_VARREDURA += 1
+
+    corners, ids = resultado
+    _atualizar_rastreio(corners, ids)
+    return corners, ids
+
+# =============================================================================
+# DETECÇÃO E MEDIÇÕES (solvePnP)
+# =============================================================================
+def estimar_poses(corners, ids):
+    """
+    Calcula a pose de todos os marcadores detectados e devolve um array
+    estruturado (POSE_DTYPE) com id, dist_ponta, tx_cm, rvec e tvec.
+
+    O solvePnP (IPPE_SQUARE) continua sendo chamado por marcador, mas sobre
+    constantes pré-calculadas (OBJ_POINTS) e buffers reutilizados; a conversão
+    para dist_ponta / tx_cm é feita de uma vez para todos os marcadores.
+    """
+    global _BUF_RVEC, _BUF_TVEC
+
+    n = len(ids)
+    if n > len(_BUF_TVEC):
+        _BUF_RVEC = np.empty((n, 3), dtype=np.float64)
+        _BUF_TVEC = np.empty((n, 3), dtype=np.float64)
+
+    validos = np.zeros(n, dtype=bool)
+    for i in range(n):
         # cv2.solvePnP: Calcula a rotação (rvec) e translação (tvec) do marcador em relação à câmera.
         ok, rvec, tvec = cv2.solvePnP(
-            obj_points,
+            OBJ_POINTS,
             corners[i][0],
             CAM_MATRIX,
             DIST_COEFFS,
             flags=cv2.SOLVEPNP_IPPE_SQUARE
         )
-        if not ok:
+        if ok:
+            _BUF_RVEC[i] = rvec[:, 0]
+            _BUF_TVEC[i] = tvec[:, 0]
+            validos[i] = True
+
+    m = int(validos.sum())
+    poses = np.empty(m, dtype=POSE_DTYPE)
+    if m == 0:
+        return poses
+
+    tvecs = _BUF_TVEC[:n][validos]
+    poses["id"] = ids[validos]
+    # Distância Z (tvec[2]) é a profundidade. Subtraímos a distância da câmera à ponta do robô.
+    poses["dist_ponta"] = tvecs[:, 2] - CAMERA_TO_NOTE_FRONT
+    # Distância X (tvec[0]) é o desvio lateral. Convertida para cm.
+    poses["tx_cm"] = tvecs[:, 0] * 100
+    poses["tvec"] = tvecs
+    poses["rvec"] = _BUF_RVEC[:n][validos]
+    return poses
+
+
+def _logar_distancias(poses):
+    """Loga a distância apenas dos marcadores cuja distância (cm) mudou."""
+    if EM_CORRECAO or len(poses) == 0:
+        return
+
+    dist_cm = (poses["dist_ponta"] * 100).astype(np.int32)
+    ids = poses["id"]
+    for i in np.flatnonzero(LAST_DIST_LOG[ids] != dist_cm):
+        logger.info(
+            f"ARUCO {ids[i]} | dist={poses['dist_ponta'][i]:.2f}m | desvio={poses['tx_cm'][i]:.1f}cm"
+        )
+    LAST_DIST_LOG[ids] = dist_cm
+
+
+# =============================================================================
+# FILTRO DE KALMAN (VELOCIDADE CONSTANTE) POR MARCADOR
+# =============================================================================
+def _criar_filtro(dist_ponta, tx_cm):
+    """Filtro 4 estados [dist, tx, v_dist, v_tx], 2 medidas [dist, tx], dt = 1 ciclo."""
+    kf = cv2.KalmanFilter(4, 2)
+    kf.transitionMatrix = np.array([
+        [1, 0, 1, 0],
+        [0, 1, 0, 1],
+        [0, 0, 1, 0],
+        [0, 0, 0, 1]
+    ], dtype=np.float32)
+    kf.measurementMatrix = np.eye(2, 4, dtype=np.float32)
+
+    # Ruído de processo de aceleração branca discretizada (dt = 1)
+    q = np.zeros((4, 4), dtype=np.float32)
+    for eixo, var in ((0, FILTRO_Q_DIST), (1, FILTRO_Q_TX)):
+        q[eixo, eixo] = var / 4
+        q[eixo, eixo + 2] = q[eixo + 2, eixo] = var / 2
+        q[eixo + 2, eixo + 2] = var
+    kf.processNoiseCov = q
+    kf.measurementNoiseCov = np.diag([FILTRO_R_DIST, FILTRO_R_TX]).astype(np.float32)
+
+    kf.statePost = np.array([[dist_ponta], [tx_cm], [0], [0]], dtype=np.float32)
+    kf.errorCovPost = np.diag([FILTRO_R_DIST, FILTRO_R_TX, FILTRO_R_DIST, FILTRO_R_TX]).astype(np.float32)
+    return kf
+
+
+def _poses_filtradas():
+    """Monta o array de poses a partir do estado atual dos filtros (ordenado por id)."""
+    ids = sorted(FILTROS)
+    poses = np.empty(len(ids), dtype=POSE_DTYPE)
+    for i, marker_id in enumerate(ids):
+        f = FILTROS[marker_id]
+        estado = f["kf"].statePost
+        poses[i] = (marker_id, estado[0, 0], estado[1, 0], f["rvec"], f["tvec"])
+    return poses
+
+
+def filtrar_poses(medidas):
+    """
+    Avança todos os filtros um ciclo e incorpora as medidas deste frame.
+
+    medidas: array POSE_DTYPE da detecção, ou None nos ciclos sem detecção
+    (apenas predição). Marcadores sem medida por mais de FILTRO_MAX_PERDAS
+    ciclos de detecção são descartados.
+    """
+    # predict() também copia a predição para statePost (vale se não houver correct)
+    for f in FILTROS.values():
+        f["kf"].predict()
+
+    if medidas is None:
+        return _poses_filtradas()
+
+    vistos = set()
+    for m in medidas:
+        marker_id = int(m["id"])
+        vistos.add(marker_id)
+        f = FILTROS.get(marker_id)
+        if f is None:
+            FILTROS[marker_id] = {
+                "kf": _criar_filtro(m["dist_ponta"], m["tx_cm"]),
+                "perdas": 0, "rvec": m["rvec"], "tvec": m["tvec"]
+            }
             continue
+        f["kf"].correct(np.array([[m["dist_ponta"]], [m["tx_cm"]]], dtype=np.float32))
+        f["perdas"] = 0
+        f["rvec"], f["tvec"] = m["rvec"], m["tvec"]
 
-        # Distância Z (tvec[2]) é a profundidade. Subtraímos a distância da câmera à ponta do robô.
-        dist_ponta = float(tvec[2]) - CAMERA_TO_NOTE_FRONT
-        # Distância X (tvec[0]) é o desvio lateral. Convertida para cm.
-        tx_cm = float(tvec[0]) * 100
-
-        dist_cm = int(dist_ponta * 100)
-        
-        # Loga a distância apenas se ela mudou e se não estiver em correção.
-        if LAST_DIST_LOG.get(marker_id) != dist_cm and not EM_CORRECAO:
-            logger.info(
-                f"ARUCO {marker_id} | dist={dist_ponta:.2f}m | desvio={tx_cm:.1f}cm"
-            )
-            LAST_DIST_LOG[marker_id] = dist_cm
-
-        arucos.append({
-            "id": int(marker_id),
-            "dist_ponta": dist_ponta,       # Distância de navegação efetiva em metros.
-            "tx_cm": tx_cm                  # Desvio lateral em cm (X negativo = esquerda, X positivo = direita).
-        })
+    for marker_id in list(FILTROS):
+        if marker_id not in vistos:
+            FILTROS[marker_id]["perdas"] += DETECCAO_A_CADA_N
+            if FILTROS[marker_id]["perdas"] > FILTRO_MAX_PERDAS:
+                del FILTROS[marker_id]
 
-        # Desenha o sistema de eixos 3D (Rvec, Tvec) no frame para visualização
-        cv2.drawFrameAxes(frame, CAM_MATRIX, DIST_COEFFS, rvec, tvec, 0.05)
+    return _poses_filtradas()
+
+
+def calcular_pose_aruco(frame, desenhar=True):
+    """
+    Detecta marcadores ArUco no frame, calcula a pose 3D (rvec, tvec) de cada um,
+    e estima a distância de navegação (dist_ponta) e o desvio lateral (tx_cm).
+
+    Retorna um array estruturado (POSE_DTYPE); cada registro é acessado como
+    antes: a["id"], a["dist_ponta"], a["tx_cm"].
+    Com desenhar=False (modo headless) os eixos e marcadores não são desenhados.
+
+    Com FILTRO_ATIVO, a detecção roda a cada DETECCAO_A_CADA_N chamadas e o
+    resultado é a pose filtrada (Kalman) de cada marcador; nas chamadas
+    intermediárias nada é detectado e a pose prevista é devolvida.
+    """
+    global CICLO_ARUCO
 
-    aruco.drawDetectedMarkers(frame, corners, ids)
+    if FILTRO_ATIVO:
+        CICLO_ARUCO += 1
+        if FILTROS and CICLO_ARUCO % DETECCAO_A_CADA_N != 0:
+            return filtrar_poses(None)
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    corners, ids = detectar_marcadores(gray)
+
+    if ids is None:
+        return filtrar_poses(SEM_POSES) if FILTRO_ATIVO else SEM_POSES
+
+    arucos = estimar_poses(corners, ids.flatten())
+    _logar_distancias(arucos)
+    if FILTRO_ATIVO:
+        arucos = filtrar_poses(arucos)
+
+    if desenhar:
+        # Desenha o sistema de eixos 3D (Rvec, Tvec) no frame para visualização
+        for a in arucos:
+            cv2.drawFrameAxes(frame, CAM_MATRIX, DIST_COEFFS, a["rvec"], a["tvec"], 0.05)
+        aruco.drawDetectedMarkers(frame, corners, ids)
     return arucos
 
 # =============================================================================
@@ -149,7 +479,7 @@ def logica_planejamento_corte(arucos, _fase_dummy=None):
     if EM_CORRECAO:
         logger.info("ARUCO: correção lateral concluída – alinhado")
         EM_CORRECAO = False
-        LAST_DIST_LOG.clear() 
+        LAST_DIST_LOG.fill(SEM_LOG)
 
     # --------------------------------------------------
     # 2. TRAVA DE GIRO (Média prioridade)
@@ -0,0 +1,77 @@
+# bench_aruco_escala.py
+# Precisão x tempo da detecção ArUco em pirâmide (ESCALA_DETECCAO = 1, 2, 4).
+#
+# Uso (no Raspberry Pi, com gravações do dataColector):
+#   python3 bench_aruco_escala.py /home/cone/cone_interface/recordings --escalas 1 2 4
+#
+# A escala 1 (resolução cheia) é a referência. Para as demais, relata a taxa de
+# marcadores reencontrados, o erro de dist_ponta / tx_cm e o tempo por frame.
+
+import argparse
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import aruco_nav
+from bench_line_detector import ler_frames
+
+
+def medir_escala(frames, escala):
+    """Roda calcular_pose_aruco em todos os frames; retorna (poses por frame, tempos ms)."""
+    aruco_nav.ESCALA_DETECCAO = escala
+    aruco_nav.RASTREIO_ATIVO = False
+    poses, tempos = [], []
+    for frame in frames:
+        t0 = time.perf_counter()
+        arucos = aruco_nav.calcular_pose_aruco(frame, desenhar=False)
+        tempos.append((time.perf_counter() - t0) * 1000)
+        poses.append({a["id"]: (a["dist_ponta"], a["tx_cm"]) for a in arucos})
+    return poses, np.array(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da detecção ArUco em pirâmide")
+    parser.add_argument("caminhos", nargs="+", help="vídeos, imagens ou diretórios de gravações")
+    parser.add_argument("--max-frames", type=int, default=500)
+    parser.add_argument("--escalas", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    frames = list(ler_frames(args.caminhos, args.max_frames))
+    if not frames:
+        print("Nenhum frame lido.")
+        return 1
+
+    ref, t_ref = medir_escala(frames, 1)
+    total_ref = sum(len(p) for p in ref)
+
+    print(f"Plataforma: {platform.machine()} | OpenCV {cv2.__version__}")
+    print(f"Frames: {len(frames)} | marcadores na referência: {total_ref}")
+    print(f"{'escala':>6} {'p50 ms':>8} {'speedup':>8} {'recall':>7} "
+          f"{'err dist p95 mm':>16} {'err tx p95 cm':>14}")
+
+    for escala in args.escalas:
+        poses, tempos = (ref, t_ref) if escala == 1 else medir_escala(frames, escala)
+
+        achados, err_dist, err_tx = 0, [], []
+        for p_ref, p in zip(ref, poses):
+            for marker_id, (dist, tx) in p_ref.items():
+                if marker_id in p:
+                    achados += 1
+                    err_dist.append(abs(p[marker_id][0] - dist) * 1000)
+                    err_tx.append(abs(p[marker_id][1] - tx))
+
+        recall = achados / total_ref * 100 if total_ref else 0.0
+        e_dist = np.percentile(err_dist, 95) if err_dist else 0.0
+        e_tx = np.percentile(err_tx, 95) if err_tx else 0.0
+        print(f"{escala:>6} {np.median(tempos):>8.2f} {np.median(t_ref) / np.median(tempos):>7.2f}x "
+              f"{recall:>6.1f}% {e_dist:>16.1f} {e_tx:>14.2f}")
+
+    aruco_nav.ESCALA_DETECCAO = 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
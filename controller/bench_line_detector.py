@@ -0,0 +1,210 @@
+# bench_line_detector.py
+# Equivalência e benchmark: detectar_limite (contornos) x detectar_limite_rapido (LUT + run-length).
+#
+# Uso (no Raspberry Pi, com gravações do dataColector):
+#   python3 bench_line_detector.py /home/cone/cone_interface/recordings --max-frames 2000
+#
+# Antes do benchmark roda verificar_equivalencia() (asserts, sem gravações):
+#   1. LUT_BRANCO == cv2.inRange no HSV para todas as 2^24 cores BGR;
+#   2. cenas sintéticas com linha em posição conhecida (inclusive blobs separados
+#      que ocupam as mesmas rows): cy_roi igual (± escala) e mesma zona nos dois
+#      detectores; só com ruído, o rápido devolve 0.
+# Depois, para cada frame gravado a ROI (line_detector.ROI_*) é passada aos dois
+# detectores. Relata diferença de cy_roi, concordância de zona (S / D / seguro) e
+# tempo por frame; sai com código 1 se a concordância de zona ficar abaixo de --min-zona.
+
+import argparse
+import os
+import platform
+import sys
+import time
+from glob import glob
+
+import cv2
+import numpy as np
+
+import line_detector
+from line_detector import (
+    detectar_limite, detectar_limite_rapido,
+    LIMIAR_PARADA_CRITICA, LIMIAR_REDUCAO_VEL, LOWER_WHITE, UPPER_WHITE, LUT_BRANCO,
+    ROI_Y_START, ROI_Y_END, ROI_X_START, ROI_X_END
+)
+
+EXTENSOES = (".mp4", ".h264", ".avi", ".jpg", ".png")
+
+
+def zona(cy_roi):
+    """Mesma classificação de logica_limite_linha, sem estado/log."""
+    if cy_roi > LIMIAR_PARADA_CRITICA:
+        return "S"
+    if cy_roi > LIMIAR_REDUCAO_VEL:
+        return "D"
+    return "-"
+
+
+def cena_sintetica(rng, faixas=(), ruido=0, manchas=()):
+    """
+    ROI de "grama" (verde escuro com textura) com faixas brancas.
+    faixas: (y_topo_esq, y_topo_dir, espessura) - linha reta, pode ser inclinada.
+    ruido: nº de pixels brancos isolados espalhados (reflexos/flores).
+    manchas: retângulos brancos (y0, y1, x0, x1), ex.: papel ou pedra no gramado.
+    """
+    h, w = ROI_Y_END - ROI_Y_START, ROI_X_END - ROI_X_START
+    roi = np.empty((h, w, 3), dtype=np.uint8)
+    roi[..., 0] = rng.integers(10, 60, (h, w))
+    roi[..., 1] = rng.integers(60, 170, (h, w))
+    roi[..., 2] = rng.integers(10, 70, (h, w))
+    for y_esq, y_dir, espessura in faixas:
+        for x in range(w):
+            y0 = int(round(y_esq + (y_dir - y_esq) * x / (w - 1)))
+            # Branco levemente tingido (S <= 20 no HSV, como LOWER/UPPER_WHITE)
+            roi[max(y0, 0):max(y0 + espessura, 0), x] = rng.integers(200, 256) - rng.integers(0, 9, 3)
+    for y0, y1, x0, x1 in manchas:
+        roi[y0:y1, x0:x1] = 235
+    if ruido:
+        ys, xs = rng.integers(0, h, ruido), rng.integers(0, w, ruido)
+        roi[ys, xs] = 255
+    return roi
+
+
+def verificar_equivalencia(escala):
+    """Asserts de equivalência entre os detectores; levanta AssertionError na primeira falha."""
+    # 1. Máscara: todas as cores BGR em uma imagem 4096x4096
+    cores = np.arange(1 << 24, dtype=np.uint32)
+    todas = np.stack([(cores >> 16) & 0xFF, (cores >> 8) & 0xFF, cores & 0xFF], axis=-1)
+    todas = todas.astype(np.uint8).reshape(4096, 4096, 3)
+    ref = cv2.inRange(cv2.cvtColor(todas, cv2.COLOR_BGR2HSV), LOWER_WHITE, UPPER_WHITE) > 0
+    maximo, minimo = todas.max(axis=2).astype(np.uint16), todas.min(axis=2)
+    lut = LUT_BRANCO[(maximo << 8) | minimo] > 0
+    assert np.array_equal(ref, lut), f"LUT_BRANCO difere do inRange em {np.count_nonzero(ref != lut)} cores"
+    del todas, ref, lut
+
+    # 2. Cenas com resposta conhecida (sem linha, horizontais, inclinadas, com ruído)
+    rng = np.random.default_rng(0)
+    cenas = [((), 0, ()), ((), 300, ())]
+    for y in (20, 120, 200, 240, 300, 330, 355):
+        cenas.append((((y, y, 12),), 0, ()))
+        cenas.append((((y - 40, y, 16),), 200, ()))
+        cenas.append((((y, y - 60, 10), (y - 150, y - 150, 6)), 100, ()))
+    # Blobs separados na horizontal mas com rows em comum: não podem virar um só
+    cenas.append(((), 0, ((150, 250, 0, 400), (240, 330, 500, 560))))
+    cenas.append((((60, 60, 20),), 50, ((70, 200, 600, 630),)))
+    for faixas, ruido, manchas in cenas:
+        roi = cena_sintetica(rng, faixas, ruido, manchas)
+        cy_ref, _ = detectar_limite(roi.copy(), desenhar=False)
+        cy_rap, _ = detectar_limite_rapido(roi.copy(), desenhar=False)
+        descricao = f"faixas={faixas} ruido={ruido} manchas={manchas}: contorno={cy_ref} rapido={cy_rap}"
+        if not faixas and not manchas:
+            # Só ruído: o contorno pega o maior ponto isolado; o filtro de tamanho deve descartar
+            assert cy_rap == 0, f"ruído aceito como linha ({descricao})"
+            assert ruido or cy_ref == 0, f"linha falsa sem faixa ({descricao})"
+            continue
+        assert abs(int(cy_ref) - int(cy_rap)) <= escala, f"cy_roi fora de ±{escala}px ({descricao})"
+        assert zona(cy_ref) == zona(cy_rap) or \
+            min(abs(int(cy_ref) - lim) for lim in (LIMIAR_REDUCAO_VEL, LIMIAR_PARADA_CRITICA)) <= escala, \
+            f"zona diferente longe dos limiares ({descricao})"
+    return len(cenas)
+
+
+def listar_arquivos(caminhos):
+    arquivos = []
+    for c in caminhos:
+        if os.path.isdir(c):
+            arquivos.extend(sorted(
+                f for f in glob(os.path.join(c, "*")) if f.lower().endswith(EXTENSOES)
+            ))
+        else:
+            arquivos.append(c)
+    return arquivos
+
+
+def ler_frames(caminhos, max_frames):
+    for caminho in listar_arquivos(caminhos):
+        if max_frames <= 0:
+            return
+        if caminho.lower().endswith((".jpg", ".png")):
+            frame = cv2.imread(caminho)
+            if frame is not None:
+                max_frames -= 1
+                yield frame
+            continue
+
+        cap = cv2.VideoCapture(caminho)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            max_frames -= 1
+            if max_frames <= 0:
+                cap.release()
+                return
+        cap.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalência e benchmark dos detectores de linha")
+    parser.add_argument("caminhos", nargs="+", help="vídeos, imagens ou diretórios de gravações")
+    parser.add_argument("--max-frames", type=int, default=1000)
+    parser.add_argument("--escala", type=int, default=line_detector.ESCALA_RAPIDO,
+                        help="ESCALA_RAPIDO a testar")
+    parser.add_argument("--min-zona", type=float, default=99.0,
+                        help="concordância de zona mínima (%%) nos frames gravados")
+    args = parser.parse_args()
+
+    line_detector.ESCALA_RAPIDO = args.escala
+    # A tolerância natural é o passo da amostragem
+    tolerancia = args.escala
+
+    try:
+        n_cenas = verificar_equivalencia(args.escala)
+    except AssertionError as e:
+        print(f"FALHA na verificação de equivalência: {e}")
+        return 1
+    print(f"Verificação de equivalência ok (LUT em 2^24 cores, {n_cenas} cenas sintéticas)")
+
+    t_contorno, t_rapido, diffs = [], [], []
+    zonas_iguais = 0
+
+    for frame in ler_frames(args.caminhos, args.max_frames):
+        roi = np.ascontiguousarray(frame[ROI_Y_START:ROI_Y_END, ROI_X_START:ROI_X_END])
+
+        t0 = time.perf_counter()
+        cy_ref, _ = detectar_limite(roi, desenhar=False)
+        t1 = time.perf_counter()
+        cy_rap, _ = detectar_limite_rapido(roi, desenhar=False)
+        t2 = time.perf_counter()
+
+        t_contorno.append((t1 - t0) * 1000)
+        t_rapido.append((t2 - t1) * 1000)
+        diffs.append(abs(int(cy_ref) - int(cy_rap)))
+        zonas_iguais += zona(cy_ref) == zona(cy_rap)
+
+    n = len(diffs)
+    if not n:
+        print("Nenhum frame lido.")
+        return 1
+
+    diffs = np.array(diffs)
+    ref_ms, rap_ms = np.median(t_contorno), np.median(t_rapido)
+
+    print(f"Plataforma: {platform.machine()} | OpenCV {cv2.__version__} | NumPy {np.__version__}")
+    print(f"Frames: {n} | ROI {ROI_X_END - ROI_X_START}x{ROI_Y_END - ROI_Y_START} | escala={args.escala}")
+    print("--- Equivalência ---")
+    print(f"cy_roi dentro de ±{tolerancia}px : {np.mean(diffs <= tolerancia) * 100:.2f}%")
+    print(f"diferença p50/p95/max      : {np.percentile(diffs, 50):.0f} / "
+          f"{np.percentile(diffs, 95):.0f} / {diffs.max()} px")
+    print(f"mesma zona (S/D/seguro)    : {zonas_iguais / n * 100:.2f}%")
+    print("--- Tempo por frame (p50) ---")
+    print(f"contorno : {ref_ms:.3f} ms")
+    print(f"rapido   : {rap_ms:.3f} ms")
+    print(f"speedup  : {ref_ms / rap_ms:.2f}x")
+
+    if zonas_iguais / n * 100 < args.min_zona:
+        print(f"FALHA: concordância de zona abaixo de {args.min_zona}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# captura.py
+# Estágio de captura em thread própria: mantém SEMPRE o frame mais recente
+# (slot "latest-wins") para que o loop de controle nunca processe frames atrasados.
+
+import cv2
+import logging
+import threading
+import time
+
+logger = logging.getLogger("captura")
+
+
+class CapturaCamera:
+    """
+    Lê a câmera continuamente em uma thread dedicada e guarda apenas o último frame.
+
+    Se o loop de controle demorar mais que um frame para processar, os frames
+    intermediários são descartados (e contados) em vez de se acumularem no buffer
+    interno do OpenCV. Cada frame é marcado com o instante de captura
+    (time.monotonic()), permitindo medir a idade do frame no momento da decisão.
+    """
+    def __init__(self, fonte=0):
+        self.fonte = fonte
+        self.cap = None
+        self.thread = None
+        self.stop_evt = threading.Event()
+        self.cond = threading.Condition()
+
+        # Slot "latest-wins"
+        self._frame = None
+        self._t_captura = 0.0
+        self._seq = 0                   # Número do último frame capturado
+        self._seq_lido = 0              # Número do último frame entregue ao consumidor
+        self._ativo = False
+
+        # Contadores
+        self.frames_capturados = 0
+        self.frames_descartados = 0     # Frames sobrescritos antes de serem lidos
+
+    def iniciar(self):
+        """Abre a câmera e inicia a thread de captura. Retorna False se falhar."""
+        self.cap = cv2.VideoCapture(self.fonte)
+        if not self.cap.isOpened():
+            logger.critical(f"CAPTURA: erro ao abrir câmera {self.fonte}")
+            return False
+
+        # Buffer mínimo no driver: o descarte de frames velhos é feito aqui.
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.stop_evt.clear()
+        self._ativo = True
+        self.thread = threading.Thread(target=self._loop_captura, daemon=True)
+        self.thread.start()
+        logger.info(f"CAPTURA: thread de captura iniciada (fonte={self.fonte})")
+        return True
+
+    def _loop_captura(self):
+        while not self.stop_evt.is_set():
+            ret, frame = self.cap.read()
+            t_captura = time.monotonic()
+
+            if not ret:
+                logger.error("CAPTURA: falha na leitura da câmera, encerrando captura")
+                break
+
+            with self.cond:
+                # O frame anterior ainda não foi consumido => será descartado.
+                if self._seq > self._seq_lido:
+                    self.frames_descartados += 1
+                self._frame = frame
+                self._t_captura = t_captura
+                self._seq += 1
+                self.frames_capturados += 1
+                self.cond.notify_all()
+
+        with self.cond:
+            self._ativo = False
+            self.cond.notify_all()
+
+    def ler(self, timeout=1.0):
+        """
+        Bloqueia até existir um frame mais novo que o último entregue.
+
+        Retorna: (ok, frame, t_captura)
+            ok=False se a captura terminou ou se nenhum frame chegou dentro do timeout.
+        """
+        with self.cond:
+            novo = self.cond.wait_for(
+                lambda: self._seq > self._seq_lido or not self._ativo,
+                timeout=timeout
+            )
+            if not novo or self._seq == self._seq_lido:
+                return False, None, 0.0
+
+            self._seq_lido = self._seq
+            return True, self._frame, self._t_captura
+
+    def parar(self):
+        """Encerra a thread e libera a câmera."""
+        self.stop_evt.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        if self.cap:
+            self.cap.release()
+            self.cap = None
+        logger.info(
+            f"CAPTURA: encerrada | capturados={self.frames_capturados} "
+            f"descartados={self.frames_descartados}"
+        )
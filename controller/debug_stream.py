@@ -0,0 +1,138 @@
+# debug_stream.py
+# Stream MJPEG de depuração (HTTP) com taxa limitada.
+# No robô de campo não há monitor: o overlay só é desenhado e codificado
+# quando existe pelo menos um cliente conectado, e no máximo a DEBUG_FPS.
+
+import cv2
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("debug_stream")
+
+BOUNDARY = "frame"
+
+
+class _MjpegHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stream = self.server.stream
+        if self.path not in ("/", "/stream.mjpg"):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+        self.end_headers()
+
+        stream._cliente_conectou()
+        ultimo_seq = 0
+        try:
+            while stream.ativo:
+                seq, jpeg = stream._aguardar_jpeg(ultimo_seq, timeout=1.0)
+                if jpeg is None:
+                    continue
+                ultimo_seq = seq
+                self.wfile.write(
+                    f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(jpeg)}\r\n\r\n".encode("ascii")
+                )
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            stream._cliente_desconectou()
+
+    def log_message(self, format, *args):
+        # Silencia o log padrão do http.server (uma linha por requisição)
+        pass
+
+
+class DebugStream:
+    """
+    Servidor MJPEG em thread própria.
+
+    O loop de controle pergunta quer_frame() a cada ciclo; só quando a resposta
+    é True ele desenha o overlay e chama publicar(frame). A codificação JPEG é
+    feita pela thread do cliente (uma vez por frame publicado), fora do loop.
+    """
+    def __init__(self, porta=8081, fps=2.0, qualidade=70):
+        self.porta = porta
+        self.intervalo_s = 1.0 / fps
+        self.qualidade = qualidade
+
+        self.server = None
+        self.thread = None
+        self.ativo = False
+        self.clientes = 0
+
+        self.cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._t_ultimo = 0.0
+
+    def iniciar(self):
+        self.server = ThreadingHTTPServer(("0.0.0.0", self.porta), _MjpegHandler)
+        self.server.daemon_threads = True
+        self.server.stream = self
+        self.ativo = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"DEBUG_STREAM: MJPEG em http://0.0.0.0:{self.porta}/ (max {1/self.intervalo_s:.1f} fps)")
+
+    def parar(self):
+        self.ativo = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        logger.info("DEBUG_STREAM: encerrado")
+
+    def quer_frame(self):
+        """True se há cliente conectado e o intervalo mínimo entre frames já passou."""
+        return self.clientes > 0 and time.monotonic() - self._t_ultimo >= self.intervalo_s
+
+    def publicar(self, frame):
+        """Entrega um frame já anotado. O frame não deve ser alterado depois."""
+        self._t_ultimo = time.monotonic()
+        with self.cond:
+            self._frame = frame
+            self._seq += 1
+            self.cond.notify_all()
+
+    def _aguardar_jpeg(self, ultimo_seq, timeout):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self._seq > ultimo_seq or not self.ativo, timeout):
+                return ultimo_seq, None
+            if not self.ativo:
+                return ultimo_seq, None
+            if self._jpeg_seq == self._seq:
+                return self._jpeg_seq, self._jpeg
+            seq, frame = self._seq, self._frame
+
+        # Codifica fora do lock para não travar publicar() no loop de controle.
+        # Com vários clientes o último a codificar apenas sobrescreve o cache.
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.qualidade])
+        if not ok:
+            return ultimo_seq, None
+        jpeg = buf.tobytes()
+        with self.cond:
+            if seq > self._jpeg_seq:
+                self._jpeg, self._jpeg_seq = jpeg, seq
+        return seq, jpeg
+
+    def _cliente_conectou(self):
+        with self.cond:
+            self.clientes += 1
+        logger.info(f"DEBUG_STREAM: cliente conectado (total={self.clientes})")
+
+    def _cliente_desconectou(self):
+        with self.cond:
+            self.clientes -= 1
+        logger.info(f"DEBUG_STREAM: cliente desconectado (total={self.clientes})")
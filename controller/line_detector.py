@@ -12,6 +12,14 @@ import time
 # 1. CONFIGURAÇÕES E CONSTANTES GLOBAIS
 # ==============================================================================
 
+# Região de interesse (ROI) do frame passada ao detector, em pixels do frame 640x480.
+# Fica aqui, e não no main_controller, para os benches importarem sem efeitos
+# colaterais (o main_controller configura o logging e abre o .log ao ser importado).
+ROI_Y_START = 100
+ROI_Y_END = 480
+ROI_X_START = 0
+ROI_X_END = 640
+
 # Configuração da cor branca (Espaço de Cores HSV)
 # Baixo brilho (V) e baixa saturação (S) para capturar a cor branca.
 LOWER_WHITE = np.array([0, 0, 180])
@@ -28,6 +36,13 @@ LIMIAR_REDUCAO_VEL = 235
 # Calibrado para ~10 cm (360px)
 LIMIAR_PARADA_CRITICA = 360
 
+# --- DETECTOR RÁPIDO (sem contornos) ---
+# Fator de redução da ROI (1 = resolução cheia). 2 => processa 1/4 dos pixels.
+ESCALA_RAPIDO = 2
+# Filtro de tamanho mínimo de blob (substitui a escolha do maior contorno), na ROI reduzida:
+MIN_TRECHO_PIXELS = 3           # Trecho horizontal contínuo de branco mínimo (run-length) para contar
+MIN_PIXELS_BLOB = 40            # Área mínima do blob (trechos conectados) para ser a linha
+
 # Variáveis globais para rastrear o estado e histórico de log
 GLOBAL_LAST_LOGGED_STATUS = 'INICIO' 
 GLOBAL_LAST_Y_DETECTED = 0 
@@ -36,17 +51,27 @@ GLOBAL_TIME_LAST_DETECTED = time.time()
 logger = logging.getLogger("line")
 
 
+def resetar_estado():
+    """Volta o histórico da linha ao estado inicial (usado no replay)."""
+    global GLOBAL_LAST_LOGGED_STATUS, GLOBAL_LAST_Y_DETECTED, GLOBAL_TIME_LAST_DETECTED
+
+    GLOBAL_LAST_LOGGED_STATUS = 'INICIO'
+    GLOBAL_LAST_Y_DETECTED = 0
+    GLOBAL_TIME_LAST_DETECTED = time.time()
+
+
 # ==============================================================================
 # 2. FUNÇÕES DE SUPORTE E LÓGICA
 # ==============================================================================
 
-def detectar_limite(frame):
+def detectar_limite(frame, desenhar=True):
     """
     Processa o frame para detectar a linha branca e retorna a coordenada Y
     do ponto mais próximo (cy_roi) e a imagem processada (mask).
     
     Args:
         frame (np.array): A imagem de entrada (BGR) - já deve ser a ROI.
+        desenhar (bool): Se False (modo headless), não desenha contorno/ponto no frame.
 
     Retorna: (cy_roi, mask_frame)
     """
@@ -68,15 +93,145 @@ def detectar_limite(frame):
         y_coords = largest_contour[:, 0, 1]
         cy_roi = np.max(y_coords) 
         
-        # Opcional: Desenha o contorno para visualização
-        cv2.drawContours(frame, [largest_contour], -1, (0, 255, 255), 2)
-        # Marca o ponto crítico no centro da tela, na coordenada Y detectada
-        center_x = frame.shape[1] // 2
-        cv2.circle(frame, (center_x, cy_roi), 5, (0, 0, 255), -1) 
+        if desenhar:
+            # Opcional: Desenha o contorno para visualização
+            cv2.drawContours(frame, [largest_contour], -1, (0, 255, 255), 2)
+            # Marca o ponto crítico no centro da tela, na coordenada Y detectada
+            center_x = frame.shape[1] // 2
+            cv2.circle(frame, (center_x, int(cy_roi)), 5, (0, 0, 255), -1)
         
     return cy_roi, frame
 
 
+def _gerar_lut_branco():
+    """
+    Pré-calcula a tabela "é branco?" indexada por (max(B,G,R) << 8) | min(B,G,R).
+
+    No HSV do OpenCV (8 bits), V = max e S = round(255 * (max - min) / max).
+    Como LOWER_WHITE/UPPER_WHITE aceitam qualquer H, a decisão depende apenas
+    de (max, min), então a tabela reproduz exatamente o cv2.inRange do HSV.
+    """
+    v = np.arange(256, dtype=np.int32)[:, None]
+    m = np.arange(256, dtype=np.int32)[None, :]
+    s = np.zeros((256, 256), dtype=np.int32)
+    np.divide(255 * (v - m) * 2 + v, 2 * v, out=s, where=v > 0, casting="unsafe")
+    branco = (
+        (v >= LOWER_WHITE[2]) & (v <= UPPER_WHITE[2]) &
+        (s >= LOWER_WHITE[1]) & (s <= UPPER_WHITE[1]) &
+        (m <= v)
+    )
+    return branco.astype(np.uint8).ravel()
+
+
+LUT_BRANCO = _gerar_lut_branco()
+
+
+def _maior_blob(rows, inicios, fins):
+    """
+    Componentes conexos (vizinhança-8, como no findContours) sobre os trechos
+    run-length: trechos de rows vizinhas só se juntam se as colunas se tocam.
+    Os trechos vêm em ordem de row e x; fins é exclusivo.
+
+    Retorna a última row do maior blob, ou None se ele tiver menos de
+    MIN_PIXELS_BLOB pixels.
+    """
+    rows, inicios, fins = rows.tolist(), inicios.tolist(), fins.tolist()
+    pai = list(range(len(rows)))
+
+    def raiz(i):
+        while pai[i] != i:
+            pai[i] = pai[pai[i]]
+            i = pai[i]
+        return i
+
+    ant_ini = ant_fim = 0       # trechos [ant_ini, ant_fim) da row anterior
+    atual = 0
+    while atual < len(rows):
+        fim_row = atual
+        while fim_row < len(rows) and rows[fim_row] == rows[atual]:
+            fim_row += 1
+        if ant_fim > ant_ini and rows[ant_ini] == rows[atual] - 1:
+            # Varredura dupla: avança o trecho que termina primeiro
+            i, j = ant_ini, atual
+            while i < ant_fim and j < fim_row:
+                if inicios[j] <= fins[i] and inicios[i] <= fins[j]:
+                    ri, rj = raiz(i), raiz(j)
+                    if ri != rj:
+                        pai[rj] = ri
+                if fins[i] < fins[j]:
+                    i += 1
+                else:
+                    j += 1
+        ant_ini, ant_fim, atual = atual, fim_row, fim_row
+
+    areas, ultima_row = {}, {}
+    for k, row in enumerate(rows):
+        r = raiz(k)
+        areas[r] = areas.get(r, 0) + fins[k] - inicios[k]
+        ultima_row[r] = row         # rows crescentes: fica a maior
+    maior = max(areas, key=areas.get)
+    return ultima_row[maior] if areas[maior] >= MIN_PIXELS_BLOB else None
+
+
+def detectar_limite_rapido(frame, desenhar=True):
+    """
+    Versão sem contornos do detectar_limite, a uma fração do custo.
+
+    A ROI é reduzida por ESCALA_RAPIDO (amostragem direta) e classificada como
+    branco/não-branco pela LUT_BRANCO. No lugar do findContours, cada row é
+    codificada em trechos contínuos de branco (run-length); trechos menores que
+    MIN_TRECHO_PIXELS são ruído. Trechos de rows vizinhas que se tocam formam
+    um blob (_maior_blob); como no detectar_limite, vale o maior blob, desde que
+    tenha pelo menos MIN_PIXELS_BLOB pixels. cy_roi é a última row desse blob,
+    em coordenadas da ROI original (resolução cheia).
+
+    Difere do detectar_limite pela amostragem (± ESCALA_RAPIDO px), pelo
+    tamanho medido em pixels (e não pela área do contorno) e por descartar
+    ruído isolado; bench_line_detector.py confere a equivalência.
+
+    Args:
+        frame (np.array): A imagem de entrada (BGR) - já deve ser a ROI.
+        desenhar (bool): Se False (modo headless), não desenha no frame.
+
+    Retorna: (cy_roi, frame)
+    """
+    reduzido = frame[::ESCALA_RAPIDO, ::ESCALA_RAPIDO]
+    b, g, r = reduzido[..., 0], reduzido[..., 1], reduzido[..., 2]
+    maximo = np.maximum(np.maximum(b, g), r)
+    minimo = np.minimum(np.minimum(b, g), r)
+
+    indice = maximo.astype(np.uint16)
+    indice <<= 8
+    indice |= minimo
+    mascara = LUT_BRANCO[indice]
+
+    # Só rows com pixels brancos suficientes podem ter um trecho válido
+    por_linha = mascara.sum(axis=1, dtype=np.int32)
+    candidatas = np.flatnonzero(por_linha >= MIN_TRECHO_PIXELS)
+
+    cy_roi = 0
+    if candidatas.size:
+        # Run-length por row: +1 no início e -1 logo após o fim de cada trecho branco.
+        # nonzero percorre em ordem de row e x, então início e fim se alternam.
+        bordas = np.diff(mascara[candidatas].view(np.int8), axis=1, prepend=0, append=0)
+        row_borda, x_borda = np.nonzero(bordas)
+        inicios, fins = x_borda[0::2], x_borda[1::2]
+        validos = fins - inicios >= MIN_TRECHO_PIXELS
+
+        if validos.any():
+            ultima = _maior_blob(candidatas[row_borda[0::2][validos]], inicios[validos], fins[validos])
+            if ultima is not None:
+                # Maior Y (mais próximo do robô), convertido para a ROI original
+                cy_roi = ultima * ESCALA_RAPIDO + ESCALA_RAPIDO - 1
+
+    if cy_roi and desenhar:
+        center_x = frame.shape[1] // 2
+        cv2.line(frame, (0, cy_roi), (frame.shape[1] - 1, cy_roi), (0, 255, 255), 2)
+        cv2.circle(frame, (center_x, cy_roi), 5, (0, 0, 255), -1)
+
+    return cy_roi, frame
+
+
 def logica_limite_linha(cy_roi):
     """
     Decide o comando de segurança com base na proximidade da linha (cy_roi).
@@ -1,11 +1,24 @@
 # main_controller.py
 # Controle híbrido: ArUco (navegação) + Linha (segurança)
 
+import argparse
+import csv
 import cv2
 import logging
+import os
+import time
+from glob import glob
 
-from line_detector import detectar_limite, logica_limite_linha
+import line_detector
+import aruco_nav
+from captura import CapturaCamera
+from debug_stream import DebugStream
+from metricas import MetricasLoop
+from paralelo import ExecutorParalelo
+from line_detector import detectar_limite, detectar_limite_rapido, logica_limite_linha
+from line_detector import ROI_Y_START, ROI_Y_END, ROI_X_START, ROI_X_END
 from aruco_nav import calcular_pose_aruco, logica_planejamento_corte
+import serial_comm
 from serial_comm import inicializar_serial, enviar_comando_stm, fechar_serial
 
 # =============================================================================
@@ -45,82 +58,365 @@ logging.info("MAIN: sistema de controle híbrido iniciado")
 # CONFIGURAÇÕES
 # =============================================================================
 CAMERA_INDEX = 0
-ROI_Y_START = 100
-ROI_Y_END = 480
-ROI_X_START = 0
-ROI_X_END = 640
+# ROI_Y_START/ROI_Y_END/ROI_X_START/ROI_X_END: definidos em line_detector.py
+
+TIMEOUT_FRAME_S = 1.0           # Tempo máximo de espera por um frame novo antes de encerrar
+
+# Métricas de latência por etapa (tecla 'm' na janela força o resumo)
+METRICAS_JANELA = 300           # Nº de amostras na janela móvel de cada etapa
+METRICAS_ARQUIVO = "metricas_controle.json"  # .json ou .csv (None desativa a exportação)
+METRICAS_INTERVALO_S = 10.0     # Intervalo da exportação periódica
+
+# Detector da linha: "contorno" (original, findContours) ou "rapido" (LUT + run-length)
+DETECTOR_LINHA = "contorno"
+DETECTORES_LINHA = {
+    "contorno": detectar_limite,
+    "rapido": detectar_limite_rapido,
+}
+
+# Execução paralela de linha (thread do loop) e ArUco (thread trabalhadora)
+PARALELO = False
+PRAZO_FRAME_MS = 40.0           # Prazo da navegação por frame; a segurança nunca espera além disso
+
+# Modo headless (robô de campo, sem monitor): nenhuma anotação no caminho crítico
+HEADLESS = False
+# Stream MJPEG de depuração (só desenha/codifica com cliente conectado)
+DEBUG_STREAM = False
+DEBUG_STREAM_PORTA = 8081
+DEBUG_STREAM_FPS = 2.0
+
+# Replay offline de gravações do dataColector
+REPLAY_EXTENSOES = (".mp4", ".h264")
+REPLAY_JANELA_METRICAS = 100000 # Janela grande: percentis sobre o vídeo inteiro
+
+# =============================================================================
+# PIPELINE POR FRAME (compartilhado entre câmera ao vivo e replay)
+# =============================================================================
+def arbitrar_comando(comando_barreira, comando_aruco):
+    """
+    Arbitragem de prioridade: a segurança da linha anula a navegação ArUco,
+    exceto os giros de 180 graus (L/R) durante a desaceleração.
+    """
+    if comando_barreira == "S":
+        return "S"
+    if comando_barreira == "D":
+        if comando_aruco in ("L", "R"):
+            return comando_aruco
+        return "D"
+    return comando_aruco
+
+
+def etapa_linha(frame, metricas, desenhar=True, copiar_roi=False):
+    """Estágio de segurança: ROI -> detector da linha -> comando de barreira."""
+    with metricas.medir("roi"):
+        frame_roi = frame[ROI_Y_START:ROI_Y_END, ROI_X_START:ROI_X_END]
+        if copiar_roi:
+            frame_roi = frame_roi.copy()
+    with metricas.medir("detectar_limite"):
+        cy_roi, frame_roi_proc = DETECTORES_LINHA[DETECTOR_LINHA](frame_roi, desenhar=desenhar)
+    with metricas.medir("logica_limite_linha"):
+        comando_barreira, status_barreira, cor_barreira = logica_limite_linha(cy_roi)
+
+    return {
+        "cy_roi": int(cy_roi),
+        "frame_roi_proc": frame_roi_proc,
+        "comando_barreira": comando_barreira,
+        "status_barreira": status_barreira,
+        "cor_barreira": cor_barreira,
+    }
+
+
+def etapa_aruco(frame, metricas, desenhar=True):
+    """Estágio de navegação: pose dos marcadores -> FSM de planejamento."""
+    with metricas.medir("calcular_pose_aruco"):
+        arucos = calcular_pose_aruco(frame, desenhar=desenhar)
+    with metricas.medir("logica_planejamento_corte"):
+        comando_aruco = logica_planejamento_corte(arucos)
+
+    return {"arucos": arucos, "comando_aruco": comando_aruco, "frame_aruco": frame}
+
+
+def processar_frame(frame, metricas, desenhar=True):
+    """
+    Executa linha (segurança) + ArUco (navegação) + arbitragem sobre um frame,
+    em sequência. Com desenhar=False os detectores não anotam o frame (modo headless).
+
+    Retorna um dict com os resultados intermediários e o comando final.
+    """
+    # --------------------------------------------------
+    # LINE DETECTOR (SEGURANÇA)
+    # --------------------------------------------------
+    r = etapa_linha(frame, metricas, desenhar)
+
+    # --------------------------------------------------
+    # ARUCO (NAVEGAÇÃO)
+    # --------------------------------------------------
+    r.update(etapa_aruco(frame, metricas, desenhar))
+
+    # --------------------------------------------------
+    # ARBITRAGEM DE PRIORIDADE
+    # --------------------------------------------------
+    with metricas.medir("arbitragem"):
+        r["comando_final"] = arbitrar_comando(r["comando_barreira"], r["comando_aruco"])
+
+    return r
+
+
+def criar_executor_paralelo(metricas):
+    """Executor que roda linha e ArUco ao mesmo tempo, com prazo PRAZO_FRAME_MS."""
+    return ExecutorParalelo(
+        etapa_linha=lambda frame, desenhar, copiar_roi=False: etapa_linha(frame, metricas, desenhar, copiar_roi),
+        etapa_aruco=lambda frame, desenhar: etapa_aruco(frame, metricas, desenhar),
+        arbitrar=arbitrar_comando,
+        prazo_ms=PRAZO_FRAME_MS
+    )
+
+def desenhar_overlay(frame, r, idade_ms, descartados, fps):
+    """Escreve os comandos e o estado do loop sobre o frame (apenas visualização)."""
+    frame[ROI_Y_START:ROI_Y_END, ROI_X_START:ROI_X_END] = r["frame_roi_proc"]
+
+    cv2.putText(frame, f"ARUCO CMD: {r['comando_aruco']}", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    cv2.putText(frame, f"SEGURANCA: {r['status_barreira']}", (10, 60),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, r["cor_barreira"], 2)
+    cv2.putText(frame, f"FINAL: {r['comando_final']}", (10, 90),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
+    cv2.putText(frame, f"IDADE FRAME: {idade_ms:.0f}ms | DESCARTADOS: {descartados} | FPS: {fps:.1f}",
+                (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
 
 # =============================================================================
 # MAIN LOOP
 # =============================================================================
-def main_loop_controle():
+def main_loop_controle(headless=HEADLESS, debug_stream=DEBUG_STREAM, paralelo=PARALELO):
+    """
+    Loop de controle ao vivo.
+
+    headless=True: sem janela, sem putText/imshow/waitKey e sem desenhos nos
+    detectores. Encerrar com Ctrl+C.
+    debug_stream=True: publica o frame anotado via MJPEG (DEBUG_STREAM_PORTA),
+    desenhando apenas quando há cliente e no máximo a DEBUG_STREAM_FPS.
+    paralelo=True: linha e ArUco rodam ao mesmo tempo (ExecutorParalelo).
+    """
     serial_ok = inicializar_serial()
 
-    cap = cv2.VideoCapture(CAMERA_INDEX)
-    if not cap.isOpened():
+    # Captura em thread própria: o loop sempre recebe o frame mais recente
+    captura = CapturaCamera(CAMERA_INDEX)
+    if not captura.iniciar():
         logging.critical("MAIN: erro ao abrir câmera")
         return
 
-    logging.info("MAIN: loop de controle iniciado")
+    metricas = MetricasLoop(
+        janela=METRICAS_JANELA,
+        arquivo=METRICAS_ARQUIVO,
+        intervalo_s=METRICAS_INTERVALO_S
+    )
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    executor = criar_executor_paralelo(metricas) if paralelo else None
 
-        # --------------------------------------------------
-        # LINE DETECTOR (SEGURANÇA)
-        # --------------------------------------------------
-        frame_roi = frame[ROI_Y_START:ROI_Y_END, ROI_X_START:ROI_X_END]
-        cy_roi, frame_roi_proc = detectar_limite(frame_roi)
-        comando_barreira, status_barreira, cor_barreira = logica_limite_linha(cy_roi)
+    stream = None
+    if debug_stream:
+        stream = DebugStream(porta=DEBUG_STREAM_PORTA, fps=DEBUG_STREAM_FPS)
+        stream.iniciar()
 
-        # --------------------------------------------------
-        # ARUCO (NAVEGAÇÃO)
-        # --------------------------------------------------
-        arucos = calcular_pose_aruco(frame)
-        comando_aruco = logica_planejamento_corte(arucos)
+    logging.info(f"MAIN: loop de controle iniciado (headless={headless})")
+
+    try:
+        while True:
+            with metricas.medir("grab"):
+                ret, frame, t_captura = captura.ler(timeout=TIMEOUT_FRAME_S)
+            if not ret:
+                logging.error("MAIN: nenhum frame novo da câmera, encerrando loop")
+                break
 
-        # --------------------------------------------------
-        # ARBITRAGEM DE PRIORIDADE
-        # --------------------------------------------------
-        comando_final = comando_aruco
+            # Só anota o frame se alguém vai vê-lo neste ciclo
+            publicar_debug = stream is not None and stream.quer_frame()
+            desenhar = not headless or publicar_debug
 
-        if comando_barreira == "S":
-            comando_final = "S"
-        elif comando_barreira == "D":
-            if comando_aruco in ("L", "R"):
-                comando_final = comando_aruco
+            if executor:
+                r = executor.processar(frame, desenhar=desenhar)
             else:
-                comando_final = "D"
-
-        # --------------------------------------------------
-        # SERIAL
-        # --------------------------------------------------
-        if serial_ok:
-            enviar_comando_stm(comando_final)
-
-        # --------------------------------------------------
-        # VISUALIZAÇÃO
-        # --------------------------------------------------
-        frame[ROI_Y_START:ROI_Y_END, ROI_X_START:ROI_X_END] = frame_roi_proc
-
-        cv2.putText(frame, f"ARUCO CMD: {comando_aruco}", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        cv2.putText(frame, f"SEGURANCA: {status_barreira}", (10, 60),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, cor_barreira, 2)
-        cv2.putText(frame, f"FINAL: {comando_final}", (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
-
-        cv2.imshow("Controle Híbrido", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
+                r = processar_frame(frame, metricas, desenhar=desenhar)
+
+            # --------------------------------------------------
+            # SERIAL
+            # --------------------------------------------------
+            if serial_ok:
+                with metricas.medir("serial"):
+                    enviar_comando_stm(r["comando_final"])
+
+            idade_ms = (time.monotonic() - t_captura) * 1000
+            metricas.registrar("idade_frame", idade_ms)
+
+            # --------------------------------------------------
+            # VISUALIZAÇÃO
+            # --------------------------------------------------
+            tecla = 0xFF
+            if desenhar:
+                with metricas.medir("overlay"):
+                    desenhar_overlay(frame, r, idade_ms, captura.frames_descartados, metricas.fps())
+
+            if publicar_debug:
+                stream.publicar(frame)
+
+            if not headless:
+                with metricas.medir("imshow"):
+                    cv2.imshow("Controle Híbrido", frame)
+                    tecla = cv2.waitKey(1) & 0xFF
+
+            metricas.fim_ciclo()
+
+            if tecla == ord("q"):
+                break
+            if tecla == ord("m"):
+                # Métricas sob demanda: loga o resumo e grava o arquivo imediatamente
+                metricas.log_resumo()
+                metricas.exportar()
+    except KeyboardInterrupt:
+        logging.info("MAIN: interrompido pelo usuário")
+
+    captura.parar()
+    if executor:
+        executor.encerrar()
+    if stream:
+        stream.parar()
+    if not headless:
+        cv2.destroyAllWindows()
     fechar_serial()
+    metricas.exportar()
+    metricas.log_resumo()
     logging.info("MAIN: sistema encerrado")
 
+# =============================================================================
+# REPLAY OFFLINE (BENCHMARK)
+# =============================================================================
+def listar_videos_replay(caminhos):
+    """Expande diretórios em arquivos .mp4/.h264 (ordem alfabética, determinística)."""
+    videos = []
+    for c in caminhos:
+        if os.path.isdir(c):
+            videos.extend(sorted(
+                f for f in glob(os.path.join(c, "*"))
+                if f.endswith(REPLAY_EXTENSOES)
+            ))
+        else:
+            videos.append(c)
+    return videos
+
+
+def executar_replay(caminhos, arquivo_trace, arquivo_metricas=None):
+    """
+    Alimenta vídeos gravados no mesmo pipeline linha/ArUco/arbitragem, o mais
+    rápido possível, sem janela e sem serial.
+
+    Cada frame gera uma linha no trace CSV (arquivo, frame, cy_roi, ids,
+    comando_barreira, comando_aruco, comando_final). O trace não contém
+    tempos, então duas execuções sobre os mesmos vídeos produzem o mesmo arquivo.
+    Os tempos vão para o log e, opcionalmente, para arquivo_metricas.
+
+    Retorna o resumo de métricas (inclui o FPS de processamento).
+    """
+    videos = listar_videos_replay(caminhos)
+    if not videos:
+        logging.critical("REPLAY: nenhum vídeo encontrado")
+        return None
+
+    metricas = MetricasLoop(janela=REPLAY_JANELA_METRICAS)
+    total_frames = 0
+    t0 = time.perf_counter()
+
+    with open(arquivo_trace, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "arquivo", "frame", "cy_roi", "aruco_ids",
+            "comando_barreira", "comando_aruco", "comando_final"
+        ])
+
+        for video in videos:
+            cap = cv2.VideoCapture(video)
+            if not cap.isOpened():
+                logging.error(f"REPLAY: erro ao abrir {video}")
+                continue
+
+            # Cada vídeo começa com a FSM zerada (resultado independe da ordem)
+            line_detector.resetar_estado()
+            aruco_nav.resetar_estado()
+
+            logging.info(f"REPLAY: processando {video}")
+            n = 0
+            while True:
+                with metricas.medir("grab"):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+
+                r = processar_frame(frame, metricas, desenhar=False)
+                metricas.fim_ciclo()
+
+                writer.writerow([
+                    os.path.basename(video), n, r["cy_roi"],
+                    ";".join(str(a["id"]) for a in r["arucos"]),
+                    r["comando_barreira"] or "-", r["comando_aruco"], r["comando_final"]
+                ])
+                n += 1
+
+            cap.release()
+            total_frames += n
+
+    duracao = time.perf_counter() - t0
+    resumo = metricas.resumo()
+    resumo["frames"] = total_frames
+    resumo["fps"] = round(total_frames / duracao, 2) if duracao > 0 else 0.0
+
+    logging.info(
+        f"REPLAY: {total_frames} frames de {len(videos)} vídeo(s) em {duracao:.2f}s "
+        f"({resumo['fps']} FPS) | trace={arquivo_trace}"
+    )
+    metricas.log_resumo()
+    if arquivo_metricas:
+        metricas.exportar(arquivo_metricas)
+
+    return resumo
+
 # =============================================================================
 if __name__ == "__main__":
-    main_loop_controle()
+    parser = argparse.ArgumentParser(description="Controle híbrido ArUco + linha")
+    parser.add_argument("--replay", nargs="+", metavar="VIDEO",
+                        help="processa vídeos gravados (.mp4/.h264 ou diretórios) em vez da câmera")
+    parser.add_argument("--trace", default="replay_trace.csv",
+                        help="arquivo CSV com os comandos por frame (modo replay)")
+    parser.add_argument("--metricas", default=None,
+                        help="arquivo .json/.csv com as métricas do replay")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS,
+                        help="sem janela nem anotações (robô de campo)")
+    parser.add_argument("--debug-stream", action="store_true", default=DEBUG_STREAM,
+                        help=f"stream MJPEG de depuração na porta {DEBUG_STREAM_PORTA}")
+    parser.add_argument("--detector-linha", choices=sorted(DETECTORES_LINHA), default=DETECTOR_LINHA,
+                        help="motor de detecção da linha branca")
+    parser.add_argument("--paralelo", action="store_true", default=PARALELO,
+                        help="executa linha e ArUco em paralelo com prazo por frame")
+    parser.add_argument("--aruco-rastreio", action="store_true", default=aruco_nav.RASTREIO_ATIVO,
+                        help="detecta ArUco só em janelas ao redor das posições previstas")
+    parser.add_argument("--aruco-escala", type=int, choices=(1, 2, 4), default=aruco_nav.ESCALA_DETECCAO,
+                        help="detecta ArUco em 1/N da resolução e refina os cantos em resolução cheia")
+    parser.add_argument("--aruco-filtro", action="store_true", default=aruco_nav.FILTRO_ATIVO,
+                        help="filtra a pose de cada marcador (Kalman) e detecta só a cada N frames")
+    parser.add_argument("--aruco-a-cada", type=int, default=aruco_nav.DETECCAO_A_CADA_N,
+                        help="com --aruco-filtro, roda a detecção completa a cada N frames")
+    parser.add_argument("--serial-mux", metavar="SOCKET", default=serial_comm.MUX_SOCKET,
+                        help="fala com o STM32 pelo serial_mux.py (socket Unix) em vez de abrir a porta")
+    args = parser.parse_args()
+
+    DETECTOR_LINHA = args.detector_linha
+    aruco_nav.RASTREIO_ATIVO = args.aruco_rastreio
+    aruco_nav.ESCALA_DETECCAO = args.aruco_escala
+    aruco_nav.FILTRO_ATIVO = args.aruco_filtro
+    aruco_nav.DETECCAO_A_CADA_N = max(args.aruco_a_cada, 1)
+    if args.serial_mux:
+        serial_comm.MUX_SOCKET = args.serial_mux
+        serial_comm.SIMULATION_MODE = False
+
+    if args.replay:
+        executar_replay(args.replay, args.trace, args.metricas)
+    else:
+        main_loop_controle(headless=args.headless, debug_stream=args.debug_stream,
+                           paralelo=args.paralelo)
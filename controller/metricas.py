@@ -0,0 +1,143 @@
+# metricas.py
+# Instrumentação de latência por etapa do loop de controle híbrido.
+# Mantém janelas móveis de tempos (ms) e calcula p50/p95/p99 e FPS do loop.
+
+import csv
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger("metricas")
+
+# Percentis reportados para cada etapa
+PERCENTIS = (50, 95, 99)
+
+
+class MetricasLoop:
+    """
+    Coleta tempos de cada etapa do loop (grab, roi, detectar_limite, ...) em
+    janelas móveis de tamanho fixo e exporta um resumo periódico em JSON ou CSV.
+
+    Uso:
+        with metricas.medir("detectar_limite"):
+            cy_roi, roi = detectar_limite(roi)
+        ...
+        metricas.fim_ciclo()
+
+    registrar/medir podem ser chamados de outras threads (o estágio ArUco do
+    ExecutorParalelo roda em uma trabalhadora); resumo() lê sob o mesmo lock.
+    """
+    def __init__(self, janela=300, arquivo=None, intervalo_s=10.0):
+        self.janela = janela
+        self.arquivo = arquivo              # .json ou .csv (None => sem exportação periódica)
+        self.intervalo_s = intervalo_s
+
+        self.tempos = {}                    # etapa -> deque de ms (ordem de inserção = ordem do loop)
+        self.ciclos = deque(maxlen=janela)  # duração de cada ciclo completo (ms)
+        self.total_ciclos = 0
+        self._lock = threading.Lock()
+
+        self._t_inicio_ciclo = time.perf_counter()
+        self._t_ultima_exportacao = time.monotonic()
+
+    @contextmanager
+    def medir(self, etapa):
+        """Cronometra o bloco e registra o tempo na etapa indicada."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(etapa, (time.perf_counter() - t0) * 1000)
+
+    def registrar(self, etapa, ms):
+        """Registra um tempo (ms) medido externamente."""
+        with self._lock:
+            tempos = self.tempos.get(etapa)
+            if tempos is None:
+                tempos = self.tempos[etapa] = deque(maxlen=self.janela)
+            tempos.append(ms)
+
+    def fim_ciclo(self):
+        """Fecha o ciclo atual (tempo total do loop) e exporta se o intervalo venceu."""
+        agora = time.perf_counter()
+        with self._lock:
+            self.ciclos.append((agora - self._t_inicio_ciclo) * 1000)
+        self._t_inicio_ciclo = agora
+        self.total_ciclos += 1
+
+        if self.arquivo and time.monotonic() - self._t_ultima_exportacao >= self.intervalo_s:
+            self.exportar()
+
+    @staticmethod
+    def _estatisticas(valores):
+        arr = np.fromiter(valores, dtype=np.float64, count=len(valores))
+        p = np.percentile(arr, PERCENTIS)
+        stats = {f"p{q}": round(float(v), 3) for q, v in zip(PERCENTIS, p)}
+        stats["media"] = round(float(arr.mean()), 3)
+        stats["max"] = round(float(arr.max()), 3)
+        stats["n"] = int(arr.size)
+        return stats
+
+    def fps(self):
+        """FPS médio do loop na janela atual."""
+        with self._lock:
+            ciclos = list(self.ciclos)
+        if not ciclos:
+            return 0.0
+        media_ms = sum(ciclos) / len(ciclos)
+        return 1000.0 / media_ms if media_ms > 0 else 0.0
+
+    def resumo(self):
+        """Retorna um dicionário com FPS e percentis de cada etapa (sob demanda)."""
+        # Cópia sob o lock; os percentis são calculados fora dele
+        with self._lock:
+            copia = {etapa: list(tempos) for etapa, tempos in self.tempos.items() if tempos}
+            ciclos = list(self.ciclos)
+        etapas = {etapa: self._estatisticas(tempos) for etapa, tempos in copia.items()}
+        if ciclos:
+            etapas["ciclo"] = self._estatisticas(ciclos)
+
+        return {
+            "timestamp": time.time(),
+            "ciclos": self.total_ciclos,
+            "fps": round(self.fps(), 2),
+            "etapas": etapas,
+        }
+
+    def exportar(self, arquivo=None):
+        """Grava o resumo atual em JSON (padrão) ou CSV, conforme a extensão."""
+        arquivo = arquivo or self.arquivo
+        self._t_ultima_exportacao = time.monotonic()
+        if not arquivo:
+            return
+
+        resumo = self.resumo()
+        try:
+            if arquivo.endswith(".csv"):
+                colunas = ["etapa", *(f"p{q}" for q in PERCENTIS), "media", "max", "n"]
+                with open(arquivo, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["fps", resumo["fps"], "ciclos", resumo["ciclos"]])
+                    writer.writerow(colunas)
+                    for etapa, stats in resumo["etapas"].items():
+                        writer.writerow([etapa, *(stats[c] for c in colunas[1:])])
+            else:
+                with open(arquivo, "w", encoding="utf-8") as f:
+                    json.dump(resumo, f, indent=2)
+        except OSError as e:
+            logger.error(f"METRICAS: erro ao exportar para {arquivo}: {e}")
+
+    def log_resumo(self):
+        """Escreve no log uma linha por etapa com p50/p95/p99."""
+        resumo = self.resumo()
+        logger.info(f"METRICAS: fps={resumo['fps']} ciclos={resumo['ciclos']}")
+        for etapa, s in resumo["etapas"].items():
+            logger.info(
+                f"METRICAS: {etapa:<28} p50={s['p50']:.2f}ms "
+                f"p95={s['p95']:.2f}ms p99={s['p99']:.2f}ms"
+            )
@@ -0,0 +1,119 @@
+# paralelo.py
+# Execução paralela dos estágios de segurança (linha) e navegação (ArUco).
+#
+# Os dois estágios são independentes: a linha usa só a ROI e o ArUco usa o
+# frame inteiro. O ArUco roda em uma thread trabalhadora (cvtColor,
+# detectMarkers e solvePnP liberam o GIL), enquanto a linha roda na thread do
+# loop. Sem desenho o frame é compartilhado por referência (só leitura, sem
+# cópia nem pickling); com desenho o ArUco anota uma cópia, já que o loop segue
+# lendo e anotando o frame (ROI, overlay, stream) enquanto a trabalhadora pode
+# ainda estar rodando. A navegação tem um prazo por frame: se não terminar a
+# tempo, o veredito de segurança é entregue mesmo assim.
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+logger = logging.getLogger("paralelo")
+
+# Comandos de giro são eventos únicos da FSM: nunca podem ser perdidos nem repetidos
+COMANDOS_GIRO = ("L", "R")
+
+
+class ExecutorParalelo:
+    """
+    Junta linha + ArUco sob um prazo por frame.
+
+    etapa_linha(frame, desenhar) -> dict com cy_roi, comando_barreira, ...
+    etapa_aruco(frame, desenhar) -> dict com arucos, comando_aruco e frame_aruco
+                                    (o frame recebido, anotado quando desenhar)
+    arbitrar(comando_barreira, comando_aruco) -> comando_final
+
+    Regras quando a navegação atrasa:
+      - Enquanto um cálculo de ArUco está em andamento, nenhum outro é
+        enfileirado (o frame seguinte usa o resultado que estiver pronto).
+      - Um resultado que chega depois do prazo é entregue no ciclo seguinte;
+        se for um giro (L/R) ele tem prioridade sobre o resultado novo.
+      - Sem resultado disponível, repete o último comando de navegação
+        (giros viram "F" para não serem repetidos).
+    """
+    def __init__(self, etapa_linha, etapa_aruco, arbitrar, prazo_ms=40.0):
+        self.etapa_linha = etapa_linha
+        self.etapa_aruco = etapa_aruco
+        self.arbitrar = arbitrar
+        self.prazo_s = prazo_ms / 1000.0
+
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aruco")
+        self.pendente = None
+        self.ultimo_comando_nav = "F"
+
+        # Contadores
+        self.prazos_perdidos = 0
+        self.resultados_atrasados = 0
+
+    def processar(self, frame, desenhar=True):
+        """Executa os dois estágios em paralelo e devolve o mesmo dict de processar_frame."""
+        limite = time.perf_counter() + self.prazo_s
+
+        # Resultado do ciclo anterior que terminou depois do prazo
+        atrasado = None
+        if self.pendente is not None and self.pendente.done():
+            atrasado = self._resultado(self.pendente)
+            self.pendente = None
+            if atrasado is not None:
+                self.resultados_atrasados += 1
+
+        deste_frame = self.pendente is None
+        if deste_frame:
+            self.pendente = self.pool.submit(self.etapa_aruco, frame.copy() if desenhar else frame, desenhar)
+
+        # Segurança na thread do loop. Com desenho ativo a linha anota uma cópia
+        # da ROI (colada de volta no overlay), já que o frame recebe os desenhos do ArUco.
+        r = self.etapa_linha(frame, desenhar, copiar_roi=desenhar)
+
+        novo = None
+        try:
+            novo = self.pendente.result(timeout=max(limite - time.perf_counter(), 0))
+            self.pendente = None
+        except TimeoutError:
+            self.prazos_perdidos += 1
+        except Exception as e:
+            logger.error(f"PARALELO: erro no estágio ArUco: {e}")
+            self.pendente = None
+
+        if atrasado is not None and atrasado["comando_aruco"] in COMANDOS_GIRO:
+            nav = atrasado
+        elif novo is not None:
+            nav = novo
+        elif atrasado is not None:
+            nav = atrasado
+        else:
+            nav = {"arucos": [], "comando_aruco": self.ultimo_comando_nav}
+
+        # Desenhos do ArUco só valem se o cálculo foi sobre este frame (e já terminou)
+        frame_aruco = nav.pop("frame_aruco", None)
+        if desenhar and deste_frame and nav is novo and frame_aruco is not None:
+            frame[...] = frame_aruco
+
+        comando_aruco = nav["comando_aruco"]
+        self.ultimo_comando_nav = "F" if comando_aruco in COMANDOS_GIRO else comando_aruco
+
+        r.update(nav)
+        r["nav_no_prazo"] = novo is not None
+        r["comando_final"] = self.arbitrar(r["comando_barreira"], comando_aruco)
+        return r
+
+    @staticmethod
+    def _resultado(futuro):
+        try:
+            return futuro.result()
+        except Exception as e:
+            logger.error(f"PARALELO: erro no estágio ArUco: {e}")
+            return None
+
+    def encerrar(self):
+        self.pool.shutdown(wait=True)
+        logger.info(
+            f"PARALELO: encerrado | prazos perdidos={self.prazos_perdidos} "
+            f"resultados atrasados={self.resultados_atrasados}"
+        )
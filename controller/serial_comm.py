@@ -1,7 +1,12 @@
 # serial_comm.py
 import serial
 import logging
+import threading
 import time
+from collections import deque
+
+from stm_protocolo import codificar_quadro, TIPO_CMD
+from serial_mux import ClienteMux
 
 logger = logging.getLogger("serial")
 
@@ -11,55 +16,247 @@ logger = logging.getLogger("serial")
 SIMULATION_MODE = True
 # ====================================================================
 
-SERIAL_PORT = '/dev/ttyACM0' 
+SERIAL_PORT = '/dev/ttyACM0'
 BAUD_RATE = 115200
+WRITE_TIMEOUT = 0.5             # Escrita travada (USB-UART) não segura a thread para sempre
+
+# "ascii": uma linha por comando ("F\n"). "binario": quadros com SEQ e CRC
+# (ver stm_protocolo.py); o firmware precisa estar no mesmo modo.
+PROTOCOLO = "ascii"
+
+# Com o serial_mux rodando (dono da porta, compartilhada com o dataColector),
+# o controller conecta no socket dele em vez de abrir SERIAL_PORT. Comandos
+# deste cliente têm prioridade de navegação. None = abre a porta diretamente.
+MUX_SOCKET = None               # ex.: "/tmp/cone_stm.sock"
+
+# Escritor em background: o loop de controle nunca bloqueia na porta serial.
+# Comandos iguais ao último enviado só são repetidos como keepalive.
+KEEPALIVE_S = 0.5               # Reenvio do último comando (None desativa)
+JANELA_LATENCIA = 200           # Amostras de latência guardadas para estatística
+
+# Classes de comando, em ordem de prioridade de envio. Cada classe tem um slot
+# "latest-wins"; um comando novo descarta os pendentes de classes de menor
+# prioridade (mais antigos e já superados), nunca os de maior prioridade.
+#   seguranca: S/D do detector de linha
+#   evento: giros de 180 graus (L/R), eventos únicos da FSM que não podem se perder
+#   navegacao: F, l, r
+CLASSES_COMANDO = ("seguranca", "evento", "navegacao")
+COMANDOS_SEGURANCA = ("S", "D")
+COMANDOS_EVENTO = ("L", "R")
+
+ser = None
+
+# Estado do escritor (protegido por _cond)
+_cond = threading.Condition()
+_thread = None
+_ativo = False
+_slots = {classe: None for classe in CLASSES_COMANDO}   # classe -> (comando, t_enfileirado)
+_ultimo_enviado = None
+_em_envio = None                # Comando que o escritor está escrevendo agora (fora do lock)
+_t_ultimo_envio = 0.0
+_seq = 0                        # Sequência dos quadros binários (só a thread do escritor usa)
+
+# Estatísticas
+_stats = {"enviados": 0, "keepalives": 0, "coalescidos": 0, "erros": 0}
+_latencias_ms = deque(maxlen=JANELA_LATENCIA)
 
-ser = None 
 
 def inicializar_serial():
     """Tenta inicializar a comunicação serial com simulação."""
     global ser
-    
+
     if SIMULATION_MODE:
         logger.info("SERIAL: MODO DE SIMULAÇÃO ATIVO. Comunicação serial ignorada.")
+        _iniciar_escritor()
         return True # Retorna True para não bloquear o main_controller
-        
+
+    if MUX_SOCKET:
+        try:
+            ser = ClienteMux(MUX_SOCKET, nome="controller", classe="navegacao", telemetria=False)
+        except OSError as e:
+            logger.critical(f"SERIAL: ERRO ao conectar no serial_mux em {MUX_SOCKET}: {e}")
+            return False
+        logger.info(f"SERIAL: Comunicação via serial_mux em {MUX_SOCKET} (prioridade de navegação).")
+        _iniciar_escritor()
+        return True
+
     try:
         # Se não estiver em simulação, tenta abrir a porta real (como antes)
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
-        time.sleep(2) 
-        logger.info(f"SERIAL: Comunicação REAL inicializada em {SERIAL_PORT}.")
+        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1, write_timeout=WRITE_TIMEOUT)
+        time.sleep(2)
+        logger.info(f"SERIAL: Comunicação REAL inicializada em {SERIAL_PORT} (protocolo {PROTOCOLO}).")
+        _iniciar_escritor()
         return True
     except serial.SerialException as e:
         # Se falhar no modo real, registra o CRITICAL e retorna False
         logger.critical(f"SERIAL: ERRO ao abrir a porta {SERIAL_PORT}. Verifique a porta/cabo: {e}")
         return False
 
-def enviar_comando_stm(comando: str):
-    """Envia o comando de 1 caractere ('F', 'S', 'R', 'L') para o STM32."""
+
+def _iniciar_escritor():
+    global _thread, _ativo
+    _ativo = True
+    _thread = threading.Thread(target=_loop_escritor, name="serial-writer", daemon=True)
+    _thread.start()
+
+
+def _escrever(comando: str):
+    """Escrita efetiva (executada apenas pela thread do escritor)."""
     if SIMULATION_MODE:
         # No modo de simulação, apenas registra o comando que seria enviado
         logger.debug(f"SERIAL SIMULADA: Comando a ser enviado -> {comando}")
-        return
-        
-    global ser
-    if ser and ser.is_open and comando:
+        return True
+
+    global _seq
+    if ser and ser.is_open:
         try:
-            ser.write(comando.encode('utf-8') + b'\n') 
+            # O mux sempre recebe texto; ele aplica o protocolo da porta
+            if PROTOCOLO == "binario" and not MUX_SOCKET:
+                ser.write(codificar_quadro(TIPO_CMD, _seq, comando.encode('ascii')))
+                _seq = (_seq + 1) & 0xFF
+            else:
+                ser.write(comando.encode('utf-8') + b'\n')
             logger.debug(f"SERIAL REAL: Enviado comando -> {comando}")
+            return True
         except Exception as e:
             logger.error(f"SERIAL REAL: Erro ao escrever na porta serial: {e}")
+    return False
+
+
+def _classe_comando(comando):
+    if comando in COMANDOS_SEGURANCA:
+        return "seguranca"
+    if comando in COMANDOS_EVENTO:
+        return "evento"
+    return "navegacao"
+
+
+def _keepalive_vencido():
+    return (KEEPALIVE_S is not None and _ultimo_enviado is not None
+            and time.monotonic() - _t_ultimo_envio >= KEEPALIVE_S)
+
+
+def _loop_escritor():
+    global _ultimo_enviado, _em_envio, _t_ultimo_envio
+
+    while True:
+        with _cond:
+            _cond.wait_for(
+                lambda: not _ativo or any(_slots.values()) or _keepalive_vencido(),
+                timeout=KEEPALIVE_S
+            )
+            if not _ativo:
+                return
+
+            keepalive = False
+            pendente = next((c for c in CLASSES_COMANDO if _slots[c]), None)
+            if pendente:
+                comando, t_fila = _slots[pendente]
+                _slots[pendente] = None
+            elif _keepalive_vencido():
+                comando, t_fila = _ultimo_enviado, time.monotonic()
+                keepalive = True
+            else:
+                continue
+            _em_envio = comando
+
+        # Escrita fora do lock: o loop de controle continua enfileirando
+        ok = _escrever(comando)
+        agora = time.monotonic()
+
+        with _cond:
+            _em_envio = None
+            _t_ultimo_envio = agora
+            if ok:
+                _ultimo_enviado = comando
+                _stats["keepalives" if keepalive else "enviados"] += 1
+                if not keepalive:
+                    _latencias_ms.append((agora - t_fila) * 1000)
+            else:
+                _stats["erros"] += 1
+
+
+def enviar_comando_stm(comando: str):
+    """
+    Enfileira o comando de 1 caractere ('F', 'S', 'R', 'L', ...) para o STM32.
+
+    Não bloqueia: a escrita é feita pela thread do escritor. Só comandos
+    diferentes do último enviado geram escrita imediata; repetições viram
+    keepalive (a cada KEEPALIVE_S); a comparação é com o comando em escrita,
+    se houver, senão com o último enviado. S/D nunca são tratados como
+    repetição, são enviados antes dos demais e, como os giros L/R, nunca são
+    descartados por um comando de navegação.
+    """
+    if not comando:
+        return
+
+    with _cond:
+        if not _ativo:
+            return
+
+        classe = _classe_comando(comando)
+        atual = _slots[classe]
+        if atual and atual[0] == comando:
+            return
+
+        # Pendentes de menor prioridade são mais antigos que este comando: superados
+        for outra in CLASSES_COMANDO[CLASSES_COMANDO.index(classe) + 1:]:
+            if _slots[outra]:
+                _slots[outra] = None
+                _stats["coalescidos"] += 1
+
+        if atual:
+            # Mesmo slot: o mais novo vence, mantendo o instante original na fila
+            _slots[classe] = (comando, atual[1])
+            _stats["coalescidos"] += 1
+        elif (classe != "seguranca" and not any(_slots.values())
+              and comando == (_em_envio if _em_envio is not None else _ultimo_enviado)):
+            return  # Repetição do que está/foi para a porta: fica por conta do keepalive
+        else:
+            _slots[classe] = (comando, time.monotonic())
+
+        _cond.notify()
+
+
+def estatisticas_serial():
+    """Profundidade da fila, contadores e latência de escrita (ms) do escritor."""
+    with _cond:
+        profundidade = sum(1 for slot in _slots.values() if slot)
+        latencias = sorted(_latencias_ms)
+        stats = dict(_stats)
+
+    stats["profundidade_fila"] = profundidade
+    if latencias:
+        n = len(latencias)
+        stats["latencia_p50_ms"] = round(latencias[n // 2], 3)
+        stats["latencia_p95_ms"] = round(latencias[min(int(n * 0.95), n - 1)], 3)
+        stats["latencia_max_ms"] = round(latencias[-1], 3)
+    return stats
+
+
+def _parar_escritor():
+    global _ativo, _thread
+    with _cond:
+        _ativo = False
+        _cond.notify_all()
+    if _thread:
+        _thread.join(timeout=WRITE_TIMEOUT + 1)
+        _thread = None
+
 
 def fechar_serial():
     """Fecha a conexão serial."""
+    _parar_escritor()
+    logger.info(f"SERIAL: estatísticas do escritor -> {estatisticas_serial()}")
+
     if SIMULATION_MODE:
         logger.info("SERIAL: Comunicação de simulação encerrada.")
         return
-        
+
     global ser
     if ser and ser.is_open:
         try:
             ser.close()
             logger.info("SERIAL: Comunicação real encerrada.")
         except:
-             pass
\ No newline at end of file
+             pass
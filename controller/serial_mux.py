@@ -0,0 +1,432 @@
+# serial_mux.py
+# Multiplexador da serial do STM32: um único processo é dono da porta e a
+# compartilha por um socket Unix com o controller (serial_comm.py) e com o
+# dataColector (StmSerialBridge).
+#
+# Uso:
+#   python3 serial_mux.py --porta /dev/ttyACM0 --socket /tmp/cone_stm.sock
+#   Controller:   MUX_SOCKET = "/tmp/cone_stm.sock" em serial_comm.py (ou --serial-mux)
+#   dataColector: STM_MUX=/tmp/cone_stm.sock uvicorn ...
+#
+#   Teste sem hardware: python3 stm_emulador.py -> --porta /dev/pts/N
+#
+# Protocolo no socket (texto, uma linha por mensagem):
+#   cliente -> mux:  "!HELLO <nome> <classe> [sem_telemetria]"
+#                                               classe: navegacao | ui
+#                    "!STATS"                   estatísticas em uma linha "MUX,{json}"
+#                    "<comando>"                repassado ao STM (ON, OFF, F, S, ...)
+#   mux -> cliente:  cada linha recebida do STM (STAT, LOG, OK ON, ...), sempre em
+#                    texto; no modo binário os quadros são convertidos para o
+#                    mesmo formato do modo ASCII.
+# Comandos de clientes "navegacao" são escritos antes dos de clientes "ui".
+# A telemetria vai para todos os clientes; cliente que não lê tem a saída
+# descartada (contabilizada) em vez de atrasar os demais.
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+import termios
+import time
+from collections import deque
+
+import serial
+
+from stm_protocolo import (
+    DecodificadorQuadros, codificar_quadro,
+    STAT_STRUCT, TIPO_CMD, TIPO_STAT
+)
+
+logger = logging.getLogger("serial_mux")
+
+SERIAL_PORT = '/dev/ttyACM0'
+BAUD_RATE = 115200
+PROTOCOLO = "ascii"                 # Protocolo no fio com o STM (os clientes sempre usam texto)
+SOCKET_PATH = "/tmp/cone_stm.sock"
+
+CLASSES = ("navegacao", "ui")       # Ordem de prioridade de escrita
+SAIDA_MAX_BYTES = 64 * 1024         # Buffer de saída por cliente antes de descartar telemetria
+REABRIR_S = 1.0                     # Nova tentativa de abrir a porta após erro
+LOG_STATS_S = 60.0
+JANELA_LATENCIA = 200
+
+
+class ClienteConectado:
+    """Estado de um cliente do socket no lado do mux."""
+    def __init__(self, sock, endereco_id):
+        self.sock = sock
+        self.nome = f"cliente{endereco_id}"
+        self.classe = "ui"
+        self.telemetria = True          # False: só escreve (o controller não lê a porta)
+        self.entrada = bytearray()
+        self.saida = bytearray()
+
+        self.comandos = 0
+        self.linhas_enviadas = 0
+        self.linhas_descartadas = 0
+        self.latencias_ms = deque(maxlen=JANELA_LATENCIA)   # recebido no socket -> escrito na porta
+
+    def estatisticas(self):
+        lat = sorted(self.latencias_ms)
+        stats = {
+            "classe": self.classe,
+            "comandos": self.comandos,
+            "linhas_enviadas": self.linhas_enviadas,
+            "linhas_descartadas": self.linhas_descartadas,
+            "saida_pendente": len(self.saida),
+        }
+        if lat:
+            n = len(lat)
+            stats["latencia_p50_ms"] = round(lat[n // 2], 3)
+            stats["latencia_p95_ms"] = round(lat[min(int(n * 0.95), n - 1)], 3)
+            stats["latencia_max_ms"] = round(lat[-1], 3)
+        return stats
+
+
+class SerialMux:
+    """Loop único (selectors) com a porta serial, o socket de escuta e os clientes."""
+    def __init__(self, porta, baud, protocolo, caminho_socket):
+        self.porta = porta
+        self.baud = baud
+        self.protocolo = protocolo
+        self.caminho_socket = caminho_socket
+
+        self.sel = selectors.DefaultSelector()
+        self.ser = None
+        self.t_proxima_abertura = 0.0
+        self.linha_serial = bytearray()
+        self.decodificador = DecodificadorQuadros()
+        self.seq = 0
+        # A porta é aberta com O_NONBLOCK: o que o os.write não aceitar fica aqui
+        # e sai no EVENT_WRITE, sem travar o loop (e a telemetria dos clientes)
+        self.saida_serial = bytearray()
+        self.em_transito = deque()  # [cliente, t_recebido, bytes que faltam escrever]
+
+        self.clientes = {}          # socket -> ClienteConectado
+        self.filas = {classe: deque() for classe in CLASSES}   # (cliente, comando, t_recebido)
+        self.n_clientes_total = 0
+        self.erros_serial = 0
+
+    # ---------- porta serial ----------
+    def _abrir_serial(self):
+        try:
+            self.ser = serial.Serial(self.porta, self.baud, timeout=0, write_timeout=0)
+        except (serial.SerialException, OSError) as e:
+            if self.erros_serial == 0:
+                logger.error(f"MUX: não abriu {self.porta}: {e} (tentando a cada {REABRIR_S} s)")
+            self.erros_serial += 1
+            self.t_proxima_abertura = time.monotonic() + REABRIR_S
+            return
+        self.sel.register(self.ser.fileno(), selectors.EVENT_READ, "serial")
+        logger.info(f"MUX: porta {self.porta} aberta @ {self.baud} (protocolo {self.protocolo})")
+
+    def _fechar_serial(self, motivo):
+        logger.error(f"MUX: porta {self.porta} perdida: {motivo}")
+        try:
+            self.sel.unregister(self.ser.fileno())
+        except (KeyError, ValueError):
+            pass
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self.ser = None
+        self.saida_serial.clear()
+        self.em_transito.clear()
+        self.erros_serial += 1
+        self.t_proxima_abertura = time.monotonic() + REABRIR_S
+
+    def _ler_serial(self):
+        try:
+            dados = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self._fechar_serial(e)
+            return
+        if not dados:
+            return
+
+        if self.protocolo == "binario":
+            linhas = []
+            for tipo, _seq, payload in self.decodificador.alimentar(dados):
+                if tipo == TIPO_STAT and len(payload) == STAT_STRUCT.size:
+                    linhas.append("STAT,ms={},en={},arr={},ccr={}".format(*STAT_STRUCT.unpack(payload)))
+                else:
+                    linhas.append(payload.decode("utf-8", errors="ignore").strip())
+            bloco = "".join(f"{linha}\n" for linha in linhas if linha).encode("utf-8")
+        else:
+            self.linha_serial += dados
+            fim = self.linha_serial.rfind(b"\n")
+            if fim < 0:
+                return
+            bloco = bytes(self.linha_serial[:fim + 1])
+            del self.linha_serial[:fim + 1]
+
+        if bloco:
+            self._difundir(bloco)
+
+    def _escrever_comandos(self):
+        """
+        Navegação primeiro (toda a fila); depois no máximo um comando de UI por volta do loop.
+        Só monta novos quadros com a saída da porta vazia: assim um comando de
+        navegação nunca espera atrás de comandos de UI já enfileirados no mux.
+        """
+        if self.ser is None:
+            # Sem porta: comandos de navegação ficariam velhos até ela voltar
+            for fila in self.filas.values():
+                fila.clear()
+            return
+        if self.saida_serial:
+            return              # ainda escrevendo; continua no EVENT_WRITE
+        for classe in CLASSES:
+            fila = self.filas[classe]
+            while fila:
+                cliente, comando, t_recebido = fila.popleft()
+                if self.protocolo == "binario":
+                    dados = codificar_quadro(TIPO_CMD, self.seq, comando.encode("ascii", errors="ignore"))
+                    self.seq = (self.seq + 1) & 0xFF
+                else:
+                    dados = (comando + "\n").encode("ascii", errors="ignore")
+                self.saida_serial += dados
+                self.em_transito.append([cliente, t_recebido, len(dados)])
+                if classe != CLASSES[0]:
+                    break
+        if self.saida_serial:
+            self._enviar_serial()
+
+    def _enviar_serial(self):
+        try:
+            enviado = os.write(self.ser.fileno(), self.saida_serial)
+        except (BlockingIOError, InterruptedError):
+            enviado = 0
+        except OSError as e:
+            self._fechar_serial(e)
+            return
+        del self.saida_serial[:enviado]
+
+        # Latência contada quando o último byte do comando foi aceito pela porta
+        agora = time.monotonic()
+        while enviado and self.em_transito:
+            item = self.em_transito[0]
+            parte = min(enviado, item[2])
+            item[2] -= parte
+            enviado -= parte
+            if item[2] == 0:
+                self.em_transito.popleft()
+                item[0].latencias_ms.append((agora - item[1]) * 1000)
+
+        # Só pede EVENT_WRITE na porta enquanto houver saída pendente
+        eventos = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.saida_serial else 0)
+        self.sel.modify(self.ser.fileno(), eventos, "serial")
+
+    # ---------- clientes ----------
+    def _aceitar(self, escuta):
+        sock, _ = escuta.accept()
+        sock.setblocking(False)
+        self.n_clientes_total += 1
+        cliente = ClienteConectado(sock, self.n_clientes_total)
+        self.clientes[sock] = cliente
+        self.sel.register(sock, selectors.EVENT_READ, "cliente")
+
+    def _desconectar(self, cliente):
+        logger.info(f"MUX: {cliente.nome} desconectou | {cliente.estatisticas()}")
+        self.sel.unregister(cliente.sock)
+        cliente.sock.close()
+        del self.clientes[cliente.sock]
+        for fila in self.filas.values():
+            pendentes = [item for item in fila if item[0] is not cliente]
+            fila.clear()
+            fila.extend(pendentes)
+
+    def _ler_cliente(self, cliente):
+        try:
+            dados = cliente.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            dados = b""
+        if not dados:
+            self._desconectar(cliente)
+            return
+
+        cliente.entrada += dados
+        *linhas, resto = cliente.entrada.split(b"\n")
+        cliente.entrada = bytearray(resto)
+        agora = time.monotonic()
+        for linha in linhas:
+            texto = linha.decode("utf-8", errors="ignore").strip()
+            if not texto:
+                continue
+            if texto.startswith("!"):
+                self._controle(cliente, texto)
+            else:
+                cliente.comandos += 1
+                self.filas[cliente.classe].append((cliente, texto, agora))
+
+    def _controle(self, cliente, texto):
+        partes = texto.split()
+        if partes[0] == "!HELLO" and len(partes) >= 2:
+            cliente.nome = partes[1]
+            if len(partes) >= 3 and partes[2] in CLASSES:
+                cliente.classe = partes[2]
+            cliente.telemetria = "sem_telemetria" not in partes[3:]
+            logger.info(f"MUX: {cliente.nome} conectado (classe {cliente.classe})")
+        elif partes[0] == "!STATS":
+            self._enfileirar_saida(cliente, f"MUX,{json.dumps(self.estatisticas())}\n".encode("utf-8"), 1)
+
+    def _enfileirar_saida(self, cliente, bloco, n_linhas):
+        if len(cliente.saida) + len(bloco) > SAIDA_MAX_BYTES:
+            cliente.linhas_descartadas += n_linhas
+            return
+        vazia = not cliente.saida
+        cliente.saida += bloco
+        cliente.linhas_enviadas += n_linhas
+        if vazia:
+            self._enviar_cliente(cliente)
+
+    def _difundir(self, bloco):
+        n_linhas = bloco.count(b"\n")
+        for cliente in list(self.clientes.values()):
+            if cliente.telemetria:
+                self._enfileirar_saida(cliente, bloco, n_linhas)
+
+    def _enviar_cliente(self, cliente):
+        try:
+            enviado = cliente.sock.send(cliente.saida)
+        except (BlockingIOError, InterruptedError):
+            enviado = 0
+        except OSError:
+            self._desconectar(cliente)
+            return
+        del cliente.saida[:enviado]
+        # Só pede EVENT_WRITE enquanto houver saída pendente
+        eventos = selectors.EVENT_READ | (selectors.EVENT_WRITE if cliente.saida else 0)
+        self.sel.modify(cliente.sock, eventos, "cliente")
+
+    # ---------- loop ----------
+    def estatisticas(self):
+        return {
+            "porta": self.porta,
+            "serial_aberta": self.ser is not None,
+            "saida_serial_pendente": len(self.saida_serial),
+            "erros_serial": self.erros_serial,
+            "clientes": {c.nome: c.estatisticas() for c in self.clientes.values()},
+            "fila": {classe: len(fila) for classe, fila in self.filas.items()},
+        }
+
+    def executar(self):
+        if os.path.exists(self.caminho_socket):
+            os.unlink(self.caminho_socket)
+        escuta = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        escuta.bind(self.caminho_socket)
+        os.chmod(self.caminho_socket, 0o660)
+        escuta.listen()
+        escuta.setblocking(False)
+        self.sel.register(escuta, selectors.EVENT_READ, "escuta")
+        logger.info(f"MUX: escutando em {self.caminho_socket}")
+
+        t_stats = time.monotonic()
+        try:
+            while True:
+                if self.ser is None and time.monotonic() >= self.t_proxima_abertura:
+                    self._abrir_serial()
+
+                # Com saída pendente na porta, espera o EVENT_WRITE em vez de girar
+                ha_fila = any(self.filas.values()) and not self.saida_serial
+                for chave, eventos in self.sel.select(timeout=0 if ha_fila else REABRIR_S):
+                    if chave.data == "serial":
+                        if eventos & selectors.EVENT_READ and self.ser is not None:
+                            self._ler_serial()
+                        if eventos & selectors.EVENT_WRITE and self.ser is not None:
+                            self._enviar_serial()
+                    elif chave.data == "escuta":
+                        self._aceitar(escuta)
+                    else:
+                        cliente = self.clientes.get(chave.fileobj)
+                        if cliente is None:
+                            continue
+                        if eventos & selectors.EVENT_READ:
+                            self._ler_cliente(cliente)
+                        if eventos & selectors.EVENT_WRITE and cliente.sock in self.clientes:
+                            self._enviar_cliente(cliente)
+
+                self._escrever_comandos()
+
+                if time.monotonic() - t_stats >= LOG_STATS_S:
+                    t_stats = time.monotonic()
+                    logger.info(f"MUX: {self.estatisticas()}")
+        finally:
+            logger.info(f"MUX: encerrado | {self.estatisticas()}")
+            escuta.close()
+            os.unlink(self.caminho_socket)
+            if self.ser is not None:
+                self.ser.close()
+
+
+class ClienteMux:
+    """
+    Cliente do mux com a interface usada de serial.Serial (write, read,
+    in_waiting, is_open, flush, close): entra no lugar da porta em
+    serial_comm.py e a serial do StmSerialBridge no dataColector.
+    """
+    def __init__(self, caminho=SOCKET_PATH, nome="cliente", classe="ui", telemetria=True, timeout=0.2):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(caminho)
+        extra = "" if telemetria else " sem_telemetria"
+        self.sock.sendall(f"!HELLO {nome} {classe}{extra}\n".encode("utf-8"))
+        self.sock.settimeout(timeout)
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        buf = struct.pack("i", 0)
+        return struct.unpack("i", fcntl.ioctl(self.sock, termios.FIONREAD, buf))[0]
+
+    def write(self, dados):
+        self.sock.sendall(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def read(self, n=1):
+        try:
+            dados = self.sock.recv(n)
+        except socket.timeout:
+            return b""
+        if not dados:
+            self.is_open = False
+            raise ConnectionError("serial_mux encerrou a conexão")
+        return dados
+
+    def close(self):
+        self.is_open = False
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multiplexador da serial do STM32 (socket Unix)")
+    parser.add_argument("--porta", default=SERIAL_PORT)
+    parser.add_argument("--baud", type=int, default=BAUD_RATE)
+    parser.add_argument("--protocolo", choices=("ascii", "binario"), default=PROTOCOLO)
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # systemd stop: remove o socket
+
+    mux = SerialMux(args.porta, args.baud, args.protocolo, args.socket)
+    try:
+        mux.executar()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# stm_emulador.py
+# Emulador local do STM32 em um pseudo-terminal (pty), para testar o link
+# serial sem hardware.
+#
+# Uso:
+#   python3 stm_emulador.py --protocolo binario --taxa 200
+#   -> imprime o caminho do pty (ex.: /dev/pts/5)
+#
+#   Controller:   SERIAL_PORT=/dev/pts/5 em serial_comm.py (SIMULATION_MODE = False)
+#   dataColector: STM_PORT=/dev/pts/5 STM_PROTOCOLO=binario uvicorn ...
+#
+# Comandos aceitos (ASCII por linha ou quadros TIPO_CMD):
+#   ON / OFF      -> liga/desliga o motor, responde "OK ON" / "OK OFF"
+#   STATUS        -> responde como o firmware (stm32f411/Core/Src/main.c):
+#                    "EN=1 | FIXED_CCR=499 | ARR=999 CCR1=499 CCR2=499"
+#   F S D L R l r -> comandos de navegação (apenas contabilizados)
+# A telemetria STAT é emitida continuamente a --taxa Hz.
+
+import argparse
+import logging
+import os
+import select
+import sys
+import termios
+import time
+import tty
+
+from stm_protocolo import (
+    DecodificadorQuadros, codificar_quadro, codificar_stat,
+    TIPO_CMD, TIPO_LOG, TIPO_RESP
+)
+
+logger = logging.getLogger("stm_emulador")
+
+
+class EmuladorSTM:
+    """Estado mínimo do firmware: motor ligado/desligado, ARR/CCR do PWM e contadores."""
+    def __init__(self, fd, protocolo="ascii", taxa_hz=10.0):
+        self.fd = fd
+        self.protocolo = protocolo
+        self.periodo_s = 1.0 / taxa_hz if taxa_hz > 0 else None
+
+        self.en = 0
+        self.arr = 999
+        self.ccr = 0
+        self.seq = 0
+        self.t0 = time.monotonic()
+        self.comandos = {}
+
+        self.decodificador = DecodificadorQuadros()
+        self.linha = bytearray()
+
+    def _ms(self):
+        return int((time.monotonic() - self.t0) * 1000)
+
+    def _enviar(self, tipo, texto=None, seq_cmd=None):
+        if self.protocolo == "binario":
+            if tipo == TIPO_RESP and seq_cmd is not None:
+                # Resposta ecoa o SEQ do comando (não avança a sequência própria)
+                dados = codificar_quadro(tipo, seq_cmd, texto.encode("ascii"))
+            else:
+                if texto is None:
+                    dados = codificar_stat(self.seq, self._ms(), self.en, self.arr, self.ccr)
+                else:
+                    dados = codificar_quadro(tipo, self.seq, texto.encode("ascii"))
+                self.seq = (self.seq + 1) & 0xFF
+        else:
+            if texto is None:
+                texto = f"STAT,ms={self._ms()},en={self.en},arr={self.arr},ccr={self.ccr}"
+            dados = (texto + "\n").encode("ascii")
+
+        try:
+            os.write(self.fd, dados)
+        except BlockingIOError:
+            pass  # Ninguém lendo o pty: descarta como uma UART sem receptor
+
+    def enviar_stat(self):
+        self._enviar(None)
+
+    def tratar_comando(self, cmd, seq=None):
+        cmd = cmd.strip()
+        if not cmd:
+            return
+        self.comandos[cmd] = self.comandos.get(cmd, 0) + 1
+
+        if cmd == "ON":
+            self.en, self.ccr = 1, self.arr // 2
+            self._enviar(TIPO_RESP, "OK ON", seq)
+        elif cmd == "OFF":
+            self.en, self.ccr = 0, 0
+            self._enviar(TIPO_RESP, "OK OFF", seq)
+        elif cmd == "STATUS":
+            self._enviar(TIPO_RESP, f"EN={self.en} | FIXED_CCR={self.arr // 2} | ARR={self.arr} "
+                                    f"CCR1={self.ccr} CCR2={self.ccr}", seq)
+        elif cmd in ("F", "S", "D", "L", "R", "l", "r"):
+            if cmd == "S":
+                self.ccr = 0
+        else:
+            self._enviar(TIPO_LOG, f"LOG,ms={self._ms()},lvl=W,msg=cmd_desconhecido:{cmd}")
+
+    def receber(self, dados):
+        if self.protocolo == "binario":
+            for tipo, seq, payload in self.decodificador.alimentar(dados):
+                if tipo == TIPO_CMD:
+                    self.tratar_comando(payload.decode("ascii", errors="ignore"), seq)
+            return
+
+        self.linha += dados
+        *linhas, resto = self.linha.split(b"\n")
+        self.linha = bytearray(resto)
+        for linha in linhas:
+            self.tratar_comando(linha.decode("ascii", errors="ignore"))
+
+    def executar(self):
+        proximo = time.monotonic()
+        while True:
+            timeout = max(proximo - time.monotonic(), 0) if self.periodo_s else None
+            prontos, _, _ = select.select([self.fd], [], [], timeout)
+            if prontos:
+                try:
+                    self.receber(os.read(self.fd, 4096))
+                except OSError:
+                    time.sleep(0.05)  # Lado escravo ainda não foi aberto
+
+            if self.periodo_s and time.monotonic() >= proximo:
+                self.enviar_stat()
+                proximo += self.periodo_s
+                # Se atrasou muito (processo parado), não tenta "recuperar" o atraso
+                if time.monotonic() - proximo > 1.0:
+                    proximo = time.monotonic() + self.periodo_s
+
+
+def abrir_pty():
+    """Cria o par pty em modo raw; retorna (fd_mestre, caminho_escravo)."""
+    mestre, escravo = os.openpty()
+    tty.setraw(escravo)
+    attrs = termios.tcgetattr(escravo)
+    attrs[3] &= ~termios.ECHO
+    termios.tcsetattr(escravo, termios.TCSANOW, attrs)
+    os.set_blocking(mestre, False)
+    return mestre, escravo, os.ttyname(escravo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulador do STM32 em pseudo-terminal")
+    parser.add_argument("--protocolo", choices=("ascii", "binario"), default="ascii")
+    parser.add_argument("--taxa", type=float, default=10.0, help="telemetria STAT por segundo")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+
+    mestre, escravo, caminho = abrir_pty()
+    print(caminho, flush=True)
+    logger.info(f"STM_EMULADOR: pty {caminho} | protocolo={args.protocolo} | STAT a {args.taxa} Hz")
+
+    emulador = EmuladorSTM(mestre, protocolo=args.protocolo, taxa_hz=args.taxa)
+    try:
+        emulador.executar()
+    except KeyboardInterrupt:
+        logger.info(f"STM_EMULADOR: encerrado | comandos recebidos={emulador.comandos}")
+    finally:
+        os.close(mestre)
+        os.close(escravo)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# stm_protocolo.py
+# Protocolo binário (opcional) do link Raspberry Pi <-> STM32.
+#
+# Quadro:
+#   0xA5 0x5A | LEN (u8) | SEQ (u8) | TIPO (u8) | PAYLOAD (LEN bytes) | CRC16 (u16 LE)
+# O CRC é o CRC-16/CCITT (binascii.crc_hqx, valor inicial 0xFFFF) calculado
+# sobre LEN, SEQ, TIPO e PAYLOAD. A telemetria STAT tem layout fixo
+# (STAT_STRUCT), então não há split/int() por campo como no modo ASCII.
+#
+# dataColector/main.py decodifica o mesmo formato (seção "Protocolo binário");
+# qualquer mudança aqui precisa ser refletida lá e no firmware.
+
+import binascii
+import struct
+
+import numpy as np
+
+SYNC = b"\xA5\x5A"
+CABECALHO = struct.Struct("<BBB")       # LEN, SEQ, TIPO
+CRC = struct.Struct("<H")
+TAM_MIN_QUADRO = len(SYNC) + CABECALHO.size + CRC.size
+TAM_MAX_PAYLOAD = 255
+
+# Tipos de quadro
+TIPO_CMD = 0x01         # Pi -> STM: comando ASCII curto ("F", "S", "ON", "STATUS", ...)
+TIPO_STAT = 0x02        # STM -> Pi: telemetria de layout fixo (STAT_STRUCT)
+TIPO_LOG = 0x03         # STM -> Pi: texto livre de log
+TIPO_RESP = 0x04        # STM -> Pi: resposta a um comando ("OK ON", ...); SEQ = SEQ do TIPO_CMD
+
+# Telemetria STAT: ms (u32), en (u8), arr (u16), ccr (u16)
+STAT_STRUCT = struct.Struct("<IBHH")
+STAT_DTYPE = np.dtype([("ms", "<u4"), ("en", "u1"), ("arr", "<u2"), ("ccr", "<u2")])
+STAT_CAMPOS = STAT_DTYPE.names
+
+
+def crc16(dados: bytes) -> int:
+    return binascii.crc_hqx(dados, 0xFFFF)
+
+
+def codificar_quadro(tipo: int, seq: int, payload: bytes = b"") -> bytes:
+    """Monta um quadro completo (sync + cabeçalho + payload + CRC)."""
+    if len(payload) > TAM_MAX_PAYLOAD:
+        raise ValueError(f"payload de {len(payload)} bytes excede {TAM_MAX_PAYLOAD}")
+    corpo = CABECALHO.pack(len(payload), seq & 0xFF, tipo) + payload
+    return SYNC + corpo + CRC.pack(crc16(corpo))
+
+
+def codificar_stat(seq: int, ms: int, en: int, arr: int, ccr: int) -> bytes:
+    return codificar_quadro(TIPO_STAT, seq, STAT_STRUCT.pack(ms & 0xFFFFFFFF, en, arr, ccr))
+
+
+def decodificar_stats(payloads) -> np.ndarray:
+    """Decodifica vários payloads STAT de uma vez em um array estruturado (STAT_DTYPE)."""
+    if not payloads:
+        return np.empty(0, dtype=STAT_DTYPE)
+    return np.frombuffer(b"".join(payloads), dtype=STAT_DTYPE)
+
+
+def stat_para_texto(stat) -> str:
+    """Linha equivalente ao modo ASCII (STAT,ms=...,en=...,arr=...,ccr=...)."""
+    return "STAT," + ",".join(f"{campo}={int(stat[campo])}" for campo in STAT_CAMPOS)
+
+
+class DecodificadorQuadros:
+    """
+    Decodificador incremental: recebe blocos de bytes em qualquer tamanho e
+    devolve os quadros completos e válidos. Bytes corrompidos são descartados
+    até o próximo SYNC (ressincronização).
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.quadros_ok = 0
+        self.erros_crc = 0
+        self.bytes_descartados = 0
+        self.seq_perdidas = 0
+        self._ultima_seq = None
+
+    def alimentar(self, dados: bytes):
+        """Adiciona bytes e retorna a lista de (tipo, seq, payload) completos."""
+        self.buffer += dados
+        quadros = []
+        buf = self.buffer
+
+        while True:
+            inicio = buf.find(SYNC)
+            if inicio < 0:
+                # Mantém um possível primeiro byte de SYNC no fim do buffer
+                manter = 1 if buf[-1:] == SYNC[:1] else 0
+                self.bytes_descartados += len(buf) - manter
+                del buf[:len(buf) - manter]
+                break
+            if inicio > 0:
+                self.bytes_descartados += inicio
+                del buf[:inicio]
+
+            if len(buf) < TAM_MIN_QUADRO:
+                break
+            tamanho, seq, tipo = CABECALHO.unpack_from(buf, len(SYNC))
+            fim = len(SYNC) + CABECALHO.size + tamanho
+            if len(buf) < fim + CRC.size:
+                break
+
+            (crc_recebido,) = CRC.unpack_from(buf, fim)
+            if crc16(bytes(buf[len(SYNC):fim])) != crc_recebido:
+                # Quadro inválido: descarta o SYNC e procura o próximo
+                self.erros_crc += 1
+                self.bytes_descartados += len(SYNC)
+                del buf[:len(SYNC)]
+                continue
+
+            payload = bytes(buf[len(SYNC) + CABECALHO.size:fim])
+            del buf[:fim + CRC.size]
+
+            # TIPO_RESP usa o SEQ do comando respondido, fora da sequência do STM
+            if tipo != TIPO_RESP:
+                if self._ultima_seq is not None:
+                    self.seq_perdidas += (seq - self._ultima_seq - 1) & 0xFF
+                self._ultima_seq = seq
+            self.quadros_ok += 1
+            quadros.append((tipo, seq, payload))
+
+        return quadros
@@ -0,0 +1,155 @@
+# bench_serial_reader.py
+# Vazão e latência do leitor serial do StmSerialBridge, sem hardware.
+#
+# Um pseudo-terminal (pty) faz o papel do STM32: este script escreve linhas
+# STAT no lado mestre e o bridge lê o lado escravo como se fosse a porta real.
+# Cada linha leva o instante de envio (t=<monotonic_ns>), ignorado pelo parse
+# do STAT; um cliente SSE conectado ao hub (event loop em outra thread) mede a
+# latência fim a fim (escrita no pty -> evento SSE gerado para o navegador).
+#
+# Uso:
+#   python3 bench_serial_reader.py --linhas 50000 --taxa 2000
+#
+# Compara o leitor atual (leitura em bloco) com o antigo (readline por linha).
+# Fora do Raspberry Pi, defina CONE_BASE_DIR para um diretório gravável
+# (o padrão aqui é um diretório temporário).
+
+import argparse
+import asyncio
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+os.environ.setdefault("CONE_BASE_DIR", tempfile.mkdtemp(prefix="cone_bench_"))
+
+import main  # noqa: E402
+
+
+class BridgeReadline(main.StmSerialBridge):
+    """Leitor antigo: um readline() e uma publicação no hub por linha."""
+    def _reader_loop(self):
+        while not self.stop_evt.is_set():
+            try:
+                raw = self.ser.readline()
+                if not raw:
+                    continue
+                line = raw.decode("utf-8", errors="ignore").strip()
+                if line:
+                    self._push_log(line)
+            except Exception:
+                time.sleep(0.5)
+
+
+def abrir_pty():
+    mestre, escravo = os.openpty()
+    tty.setraw(escravo)
+    return mestre, escravo, os.ttyname(escravo)
+
+
+def linha_stat(i):
+    return f"STAT,ms={i},en=1,arr=999,ccr={i % 1000},t={time.monotonic_ns()}\n".encode("ascii")
+
+
+def escritor(fd, n, taxa, lote):
+    """Escreve n linhas; taxa=None escreve o mais rápido possível (lotes de 'lote' linhas)."""
+    periodo = lote / taxa if taxa else 0.0
+    proximo = time.monotonic()
+    i = 0
+    while i < n:
+        k = min(lote, n - i)
+        os.write(fd, b"".join(linha_stat(i + j) for j in range(k)))
+        i += k
+        if periodo:
+            proximo += periodo
+            espera = proximo - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+
+
+async def consumir(hub, n, latencias, t_fim):
+    """Cliente SSE: lê os eventos do hub até receber n linhas (ou 2 s sem nada)."""
+    cliente = hub.conectar()
+    eventos = hub.eventos(cliente).__aiter__()
+    try:
+        while len(latencias) < n:
+            try:
+                corpo = await asyncio.wait_for(eventos.__anext__(), 2.0)
+            except asyncio.TimeoutError:
+                break  # Linhas perdidas (não deveria acontecer)
+            agora = time.monotonic_ns()
+            t_fim[0] = time.monotonic()
+            for evento in corpo.split("\n\n"):
+                if evento.startswith("data: "):
+                    latencias.append((agora - int(evento.rsplit("t=", 1)[1])) / 1e6)
+    finally:
+        await eventos.aclose()
+
+
+def medir(classe, n, taxa, lote):
+    """Roda uma fase; retorna (linhas recebidas, duração s, latências ms ordenadas, status final)."""
+    mestre, escravo, caminho = abrir_pty()
+    bridge = classe(caminho, 115200, hub=main.HubSSE(fila_max=n + 1))
+    bridge.open()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    latencias, t_fim = [], [0.0]
+    consumidor = asyncio.run_coroutine_threadsafe(consumir(bridge.hub, n, latencias, t_fim), loop)
+    time.sleep(0.1)
+
+    t_escrita = threading.Thread(target=escritor, args=(mestre, n, taxa, lote), daemon=True)
+    t0 = time.monotonic()
+    t_escrita.start()
+    consumidor.result()
+
+    t_escrita.join()
+    loop.call_soon_threadsafe(loop.stop)
+    bridge.close()
+    bridge.thread.join(timeout=1.0)
+    os.close(mestre)
+    os.close(escravo)
+    latencias.sort()
+    return len(latencias), t_fim[0] - t0, latencias, dict(bridge.last_status)
+
+
+def percentil(valores, p):
+    if not valores:
+        return float("nan")
+    return valores[min(int(len(valores) * p / 100), len(valores) - 1)]
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmark do leitor serial do StmSerialBridge (pty)")
+    parser.add_argument("--linhas", type=int, default=50000, help="linhas na fase de vazão")
+    parser.add_argument("--taxa", type=float, default=2000.0, help="linhas/s na fase de latência")
+    parser.add_argument("--duracao", type=float, default=3.0, help="duração da fase de latência (s)")
+    parser.add_argument("--lote", type=int, default=64, help="linhas por write() na fase de vazão")
+    args = parser.parse_args()
+
+    print(f"Plataforma: {platform.machine()} | Python {platform.python_version()}")
+    n_lat = max(int(args.taxa * args.duracao), 1)
+    leitores = (("bloco", main.StmSerialBridge), ("readline", BridgeReadline))
+
+    print(f"Vazão ({args.linhas} linhas, escritas o mais rápido possível):")
+    print(f"{'leitor':>9} {'recebidas':>10} {'linhas/s':>10}")
+    for nome, classe in leitores:
+        n, dur, _lat, status = medir(classe, args.linhas, None, args.lote)
+        print(f"{nome:>9} {n:>10} {n / dur if dur else 0:>10.0f}")
+        if status["ccr"] != (args.linhas - 1) % 1000:
+            print(f"  aviso: último STAT não refletido no status ({status['raw']})")
+
+    print(f"Latência fim a fim ({n_lat} linhas a {args.taxa:.0f} linhas/s, 1 por write()):")
+    print(f"{'leitor':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for nome, classe in leitores:
+        n, _dur, lat, _status = medir(classe, n_lat, args.taxa, 1)
+        print(f"{nome:>9} {percentil(lat, 50):>8.3f} {percentil(lat, 95):>8.3f} "
+              f"{percentil(lat, 99):>8.3f} {lat[-1] if lat else float('nan'):>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
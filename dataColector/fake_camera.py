@@ -0,0 +1,89 @@
+# fake_camera.py
+# Câmera falsa para testar o dataColector sem rpicam-* (CAMERA_BACKEND=fake).
+#
+#   python3 fake_camera.py --fps 15           -> JPEGs concatenados no stdout
+#                                              (como "rpicam-vid --codec mjpeg -o -")
+#   python3 fake_camera.py --fps 30 -o X.h264 -> grava até receber SIGTERM
+#                                              (conteúdo MJPEG, não H.264 de verdade)
+#   python3 fake_camera.py --fps 30 -o X_%04d.h264 --segmento 5000
+#                                           -> troca de arquivo a cada 5 s
+#                                              (como "rpicam-vid --segment 5000")
+#
+# Cada quadro é um JPEG 16x16 fixo com um segmento de comentário (COM) contendo
+# o número do quadro e o instante de geração; ao inspecionar as fotos salvas
+# (ex.: strings foto.jpg | grep fake) dá para conferir a ordem e o intervalo real entre
+# elas. Sem dependências além da biblioteca padrão.
+
+import argparse
+import base64
+import signal
+import sys
+import time
+
+JPEG_BASE = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9"
+    "PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhC"
+    "Y2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAAR"
+    "CAAQABADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAA"
+    "AgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkK"
+    "FhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWG"
+    "h4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl"
+    "5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREA"
+    "AgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYk"
+    "NOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOE"
+    "hYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk"
+    "5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDOorEorj+qeZ5/1L+9+B//2Q=="
+)
+
+
+def quadro(n: int) -> bytes:
+    """JPEG base com um segmento COM (FF FE) logo após o SOI."""
+    texto = f"fake n={n} t={time.monotonic():.6f}".encode("ascii")
+    com = b"\xff\xfe" + (len(texto) + 2).to_bytes(2, "big") + texto
+    return JPEG_BASE[:2] + com + JPEG_BASE[2:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Câmera falsa (MJPEG)")
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("-o", "--saida", default="-", help="arquivo de saída ou - (stdout)")
+    parser.add_argument("--segmento", type=int, default=0,
+                        help="ms por arquivo; a saída é um padrão com %%04d (0 = arquivo único)")
+    parser.add_argument("--falhar", action="store_true", help="escreve no stderr e sai com erro")
+    args = parser.parse_args()
+
+    if args.falhar:
+        print("ERROR: fake camera: no cameras available", file=sys.stderr, flush=True)
+        return 1
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    segmento = 0
+    caminho = args.saida % segmento if args.segmento else args.saida
+    saida = sys.stdout.buffer if args.saida == "-" else open(caminho, "wb")
+    print(f"fake camera: {args.fps} fps -> {args.saida}", file=sys.stderr, flush=True)
+
+    periodo = 1.0 / args.fps
+    proximo = t_segmento = time.monotonic()
+    n = 0
+    try:
+        while True:
+            if args.segmento and time.monotonic() - t_segmento >= args.segmento / 1000:
+                saida.close()
+                segmento += 1
+                saida = open(args.saida % segmento, "wb")
+                t_segmento += args.segmento / 1000
+            saida.write(quadro(n))
+            saida.flush()
+            n += 1
+            proximo += periodo
+            time.sleep(max(proximo - time.monotonic(), 0))
+    except BrokenPipeError:
+        pass
+    finally:
+        if saida is not sys.stdout.buffer:
+            saida.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,57 @@
 import os
+import sys
+import importlib
 import subprocess
 import logging
 import zipfile
 import time
 import asyncio
 from glob import glob
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Comunicacao Serial
 import threading
-from collections import deque
+import concurrent.futures
+import json
+import hashlib
+import mimetypes
+import re
+import bisect
+import sqlite3
+from collections import deque, OrderedDict
+import numpy as np
 import serial
 
 # servidor HTTP + rotas
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query, Header
 from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.responses import StreamingResponse
-import queue
 from fastapi.templating import Jinja2Templates
 
+# Código compartilhado com o controller (protocolo do STM32, cliente do
+# serial_mux): fonte única em controller/, importada só quando usada (protocolo
+# binário / STM_MUX), então o serviço sobe sem controller/ no modo ASCII direto.
+# Padrão: ../controller ao lado deste arquivo; no Pi, CONE_CONTROLLER_DIR
+# aponta para onde o controller estiver (ver cone.service).
+CONTROLLER_DIR = os.environ.get(
+    "CONE_CONTROLLER_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "controller")
+)
+
+
+def importar_controller(modulo: str):
+    """Importa um módulo de CONTROLLER_DIR (ImportError se o controller não estiver instalado)."""
+    if CONTROLLER_DIR not in sys.path:
+        sys.path.append(CONTROLLER_DIR)
+    return importlib.import_module(modulo)
+
+
 # --- Configurações de diretórios ---
-BASE_DIR = "/home/cone/cone_interface"
+BASE_DIR = os.environ.get("CONE_BASE_DIR", "/home/cone/cone_interface")
 REC_DIR = os.path.join(BASE_DIR, "recordings")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 LOG_FILE = os.path.join(LOG_DIR, "system.log")
+TELEM_DIR = os.path.join(BASE_DIR, "telemetry")
 
 # Garantir que pastas existam para evitar erro
 os.makedirs(REC_DIR, exist_ok=True)
@@ -42,16 +70,411 @@ app = FastAPI(title="Cone Backend")
 # Jinja2 para renderizar HTML (index.html) com lista de arquivos
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "app/templates"))# ajustar diretorio
 
+# --- Câmera ---
+# Um pipeline "quente": um único processo de captura fica rodando e entrega
+# JPEGs contínuos (MJPEG no stdout); foto é só salvar o próximo quadro, sem
+# abrir o sensor nem esperar o auto-exposure a cada clique. Sequências usam o
+# intervalo real entre quadros. O processo para sozinho após CAMERA_OCIOSO_S
+# sem uso e é liberado durante a gravação quando a câmera não aceita dois
+# processos (rpicam: OV5647 em um processo por vez).
+#
+# CAMERA_BACKEND=fake troca rpicam-* por fake_camera.py (testes sem câmera).
+CAMERA_BACKEND = os.environ.get("CAMERA_BACKEND", "rpicam")
+CAMERA_LARGURA, CAMERA_ALTURA = 1296, 972
+CAMERA_FPS = float(os.environ.get("CAMERA_FPS", "15"))      # fps do pipeline de fotos
+CAMERA_QUALIDADE = 90           # qualidade JPEG do MJPEG
+CAMERA_OCIOSO_S = 120.0         # sem fotos por este tempo -> libera a câmera
+CAMERA_PARTIDA_S = 5.0          # espera máxima pelo primeiro quadro
+SEQUENCIA_INTERVALO_S = 0.5     # intervalo padrão entre fotos da sequência
+
+# Gravação segmentada: o rpicam-vid troca de arquivo a cada segmento (sempre
+# em um I-frame) e cada segmento fechado é remuxado para .mp4 em background
+# enquanto a gravação continua. O rpicam-vid só segmenta por tempo; o limite
+# em MB vira tempo pelo bitrate fixo. Opcional: com GRAVACAO_SEGMENTO_S e
+# GRAVACAO_SEGMENTO_MB em 0 (padrão) grava um .h264 único, como antes.
+GRAVACAO_SEGMENTO_S = float(os.environ.get("GRAVACAO_SEGMENTO_S", "0"))     # ex.: 60
+GRAVACAO_SEGMENTO_MB = float(os.environ.get("GRAVACAO_SEGMENTO_MB", "0"))   # 0 = sem limite
+GRAVACAO_BITRATE = 10_000_000   # bps, usado quando há limite em MB
+GRAVACAO_VARREDURA_S = 1.0      # período da verificação de segmentos fechados
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+
+class BackendRpicam:
+    """Comandos rpicam-* do Raspberry Pi."""
+    nome = "rpicam"
+    foto_durante_gravacao = False
+
+    def cmd_mjpeg(self, fps: float):
+        return [
+            "rpicam-vid",
+            "-t", "0",
+            "--codec", "mjpeg", "-q", str(CAMERA_QUALIDADE),
+            "--width", str(CAMERA_LARGURA), "--height", str(CAMERA_ALTURA),
+            "--framerate", str(fps),
+            "-o", "-",                      # JPEGs concatenados no stdout
+            "--nopreview"
+        ]
+
+    def cmd_video(self, h264_path: str, segmento_ms: int = 0, bitrate: int = 0):
+        cmd = [
+            "rpicam-vid",
+            "-t", "0",                      # 0 ms => roda sem timeout (até parar)
+            "--width", str(CAMERA_LARGURA), "--height", str(CAMERA_ALTURA),
+            "--framerate", "30",
+            "-o", h264_path,                # saída do vídeo (H.264 bruto; com %04d se segmentado)
+            "--nopreview"
+        ]
+        if segmento_ms:
+            # --inline: SPS/PPS em todo I-frame, cada segmento decodifica sozinho
+            # --intra 30: um I-frame por segundo (o corte só acontece em I-frame)
+            # --flush: falta de energia perde no máximo o último quadro
+            cmd += ["--segment", str(segmento_ms), "--inline", "--intra", "30", "--flush"]
+        if bitrate:
+            cmd += ["--bitrate", str(bitrate)]
+        return cmd
+
+
+class BackendFake:
+    """fake_camera.py no lugar do rpicam-* (mesma interface de processo)."""
+    nome = "fake"
+    foto_durante_gravacao = True
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_camera.py")
+
+    def cmd_mjpeg(self, fps: float):
+        return [sys.executable, self.script, "--fps", str(fps)]
+
+    def cmd_video(self, h264_path: str, segmento_ms: int = 0, bitrate: int = 0):
+        return [sys.executable, self.script, "--fps", "30", "-o", h264_path,
+                "--segmento", str(segmento_ms)]
+
+
+BACKENDS_CAMERA = {"rpicam": BackendRpicam, "fake": BackendFake}
+
+
+class PipelineJPEG:
+    """
+    Processo de captura contínua (backend.cmd_mjpeg) como subprocesso asyncio:
+    uma task separa os JPEGs do stdout e guarda o mais recente (seq, instante,
+    bytes); outra guarda as últimas linhas do stderr. Nada aqui bloqueia o
+    event loop. Todos os métodos rodam no loop do servidor.
+    """
+    def __init__(self, backend, fps: float = CAMERA_FPS, ocioso_s: float = CAMERA_OCIOSO_S):
+        self.backend = backend
+        self.fps = fps
+        self.ocioso_s = ocioso_s
+        self.proc = None
+        self.cond = None                    # asyncio.Condition (criada no loop)
+        self.partida = None                 # asyncio.Lock: uma partida por vez
+        self.seq = 0
+        self.t_quadro = 0.0
+        self.jpeg = None
+        self.ultimo_uso = 0.0
+        self.stderr = deque(maxlen=50)      # últimas linhas do processo (diagnóstico)
+
+    def ativo(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def iniciar(self):
+        """Sobe o processo (se parado) e espera o primeiro quadro."""
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+            self.partida = asyncio.Lock()
+        self.ultimo_uso = time.monotonic()
+        async with self.partida:
+            if self.ativo():
+                return
+            cmd = self.backend.cmd_mjpeg(self.fps)
+            self.stderr.clear()
+            logger.info(f"Pipeline de fotos: iniciando {' '.join(cmd)}")
+            self.proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            seq_inicial = self.seq
+            asyncio.create_task(self._ler_quadros(self.proc))
+            asyncio.create_task(self._ler_stderr(self.proc))
+
+            try:
+                async with self.cond:
+                    await asyncio.wait_for(self.cond.wait_for(
+                        lambda: self.seq > seq_inicial or not self.ativo()), CAMERA_PARTIDA_S)
+            except asyncio.TimeoutError:
+                pass
+            if self.seq == seq_inicial:
+                await asyncio.sleep(0.05)   # deixa o stderr de quem morreu chegar
+                erro = " | ".join(list(self.stderr)[-3:]) or "sem saída"
+                await self.parar()
+                raise RuntimeError(f"Câmera não entregou quadros: {erro}")
+
+    async def parar(self):
+        proc, self.proc = self.proc, None
+        if proc and proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), 2)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+            logger.info("Pipeline de fotos: parado")
+
+    async def quadro(self, depois_de: int = None, timeout: float = 2.0):
+        """
+        (seq, t, jpeg) do primeiro quadro com seq > depois_de (padrão: o próximo
+        quadro, capturado depois desta chamada).
+        """
+        await self.iniciar()
+        self.ultimo_uso = time.monotonic()
+        alvo = self.seq if depois_de is None else depois_de
+        try:
+            async with self.cond:
+                await asyncio.wait_for(self.cond.wait_for(
+                    lambda: self.seq > alvo or not self.ativo()), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.seq <= alvo:
+            raise RuntimeError("Câmera parou de entregar quadros")
+        return self.seq, self.t_quadro, self.jpeg
+
+    async def _ler_quadros(self, proc):
+        buf = bytearray()
+        while True:
+            dados = await proc.stdout.read(65536)
+            if not dados:
+                break
+            buf += dados
+            novos = False
+            while True:
+                ini = buf.find(JPEG_SOI)
+                if ini < 0:
+                    del buf[:max(len(buf) - 1, 0)]
+                    break
+                fim = buf.find(JPEG_EOI, ini + 2)
+                if fim < 0:
+                    del buf[:ini]
+                    break
+                self.seq += 1
+                self.t_quadro = time.monotonic()
+                self.jpeg = bytes(buf[ini:fim + 2])
+                del buf[:fim + 2]
+                novos = True
+            if novos:
+                async with self.cond:
+                    self.cond.notify_all()
+
+            if time.monotonic() - self.ultimo_uso > self.ocioso_s and self.proc is proc:
+                logger.info(f"Pipeline de fotos: {self.ocioso_s:.0f} s sem uso, liberando a câmera")
+                await self.parar()
+                break
+        await proc.wait()
+        async with self.cond:
+            self.cond.notify_all()
+
+    async def _ler_stderr(self, proc):
+        async for linha in proc.stderr:
+            self.stderr.append(linha.decode("utf-8", errors="ignore").rstrip())
+
+
+def salvar_jpeg(jpeg: bytes, filepath: str):
+    # Escrita atômica: a listagem nunca mostra uma foto pela metade
+    with open(filepath + ".part", "wb") as f:
+        f.write(jpeg)
+    os.replace(filepath + ".part", filepath)
+    catalogo.registrar(filepath)
+    miniaturas.agendar(filepath)
+    hashes.agendar(filepath)
+
+
+def duracao_segmento_s() -> float:
+    """Duração do segmento (GRAVACAO_SEGMENTO_S e/ou GRAVACAO_SEGMENTO_MB); 0 = sem segmentar."""
+    duracao = GRAVACAO_SEGMENTO_S
+    if GRAVACAO_SEGMENTO_MB > 0:
+        por_mb = GRAVACAO_SEGMENTO_MB * 8e6 / GRAVACAO_BITRATE
+        duracao = min(duracao, por_mb) if duracao else por_mb
+    return duracao
+
+
+class SessaoGravacao:
+    """
+    Gravação segmentada: {base}_0000.h264, {base}_0001.h264, ... e o manifesto
+    {base}.manifest.json com o estado de cada segmento:
+    gravando -> fechado (na fila de conversão) -> mp4 | erro.
+    Uma thread verifica os segmentos: quando o próximo aparece, o anterior
+    está fechado e vai para a fila de conversão.
+    """
+    def __init__(self, base: str, segmento_s: float, dados: dict = None):
+        self.base = base
+        self.padrao = os.path.join(REC_DIR, f"{base}_%04d.h264")
+        self.manifesto = os.path.join(REC_DIR, f"{base}.manifest.json")
+        self.segmento_s = segmento_s
+        self.inicio = time.time()
+        self.fim = None
+        self.interrompida = False
+        self.segmentos = []             # dicts na ordem do índice
+        if dados:
+            self.segmento_s = dados["segmento_s"]
+            self.inicio = dados["inicio"]
+            self.fim = dados["fim"]
+            self.interrompida = dados.get("interrompida", False)
+            self.segmentos = dados["segmentos"]
+        self.lock = threading.Lock()
+        self.stop_evt = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def carregar(cls, manifesto: str):
+        with open(manifesto) as f:
+            dados = json.load(f)
+        return cls(dados["sessao"], dados["segmento_s"], dados)
+
+    def iniciar(self):
+        self._escrever()
+        self.thread = threading.Thread(target=self._vigiar, name=f"sessao-{self.base}", daemon=True)
+        self.thread.start()
+
+    def finalizar(self, interrompida: bool = False):
+        """Depois do fim do processo de gravação: fecha e converte o último segmento."""
+        self.stop_evt.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        with self.lock:
+            self.fim = time.time()
+            self.interrompida = interrompida
+        self.varrer(final=True)
+        logger.info(f"Sessão {self.base}: {len(self.segmentos)} segmento(s)"
+                    + (" (interrompida)" if interrompida else ""))
+
+    def retomar(self):
+        """
+        Recuperação na partida do servidor: sessão sem fim (queda de energia ou
+        processo morto) é finalizada; segmentos fechados cuja conversão não
+        terminou voltam para a fila.
+        """
+        if self.fim is None:
+            self.finalizar(interrompida=True)
+        for seg in list(self.segmentos):
+            if seg["estado"] != "fechado":
+                continue
+            h264 = os.path.join(REC_DIR, seg["h264"])
+            if os.path.exists(h264):
+                conversor.enfileirar(h264, segmento=True, ao_terminar=self._convertido)
+            elif os.path.exists(os.path.join(REC_DIR, seg["mp4"])):
+                self._marcar(seg["h264"], "mp4")
+
+    def _vigiar(self):
+        while not self.stop_evt.wait(GRAVACAO_VARREDURA_S):
+            try:
+                self.varrer()
+            except Exception as e:
+                logger.error(f"Sessão {self.base}: erro na varredura: {e}")
+
+    def varrer(self, final: bool = False):
+        """Registra segmentos novos e enfileira os fechados (todos, se final)."""
+        prefixo = os.path.join(REC_DIR, f"{self.base}_")
+        if self.segmentos:
+            # Segmentos são sequenciais: basta procurar os próximos índices
+            # (sem listar um diretório com milhares de fotos a cada segundo)
+            i = self.segmentos[-1]["indice"] + 1
+            indices = [seg["indice"] for seg in self.segmentos
+                       if os.path.exists(os.path.join(REC_DIR, seg["h264"]))]
+            while os.path.exists(self.padrao % i):
+                indices.append(i)
+                i += 1
+        else:
+            indices = sorted(
+                int(f[len(prefixo):-len(".h264")])
+                for f in glob(self.padrao.replace("%04d", "[0-9]" * 4))
+            )
+        fechados = []
+        with self.lock:
+            conhecidos = {seg["indice"] for seg in self.segmentos}
+            novos = [i for i in indices if i not in conhecidos]
+            for i in novos:
+                self.segmentos.append({
+                    "indice": i,
+                    "h264": os.path.basename(self.padrao % i),
+                    "mp4": os.path.basename(self.padrao % i)[:-len(".h264")] + ".mp4",
+                    "estado": "gravando",
+                    "bytes": None,
+                    "fechado_em": None,
+                    "erro": None,
+                })
+            self.segmentos.sort(key=lambda seg: seg["indice"])
+
+            abertos = [seg for seg in self.segmentos if seg["estado"] == "gravando"]
+            ultimo = max(indices, default=None)
+            for seg in abertos:
+                if final or seg["indice"] != ultimo:
+                    h264 = os.path.join(REC_DIR, seg["h264"])
+                    seg["estado"] = "fechado"
+                    seg["fechado_em"] = time.time()
+                    seg["bytes"] = os.path.getsize(h264) if os.path.exists(h264) else 0
+                    fechados.append(seg)
+            if novos or fechados or final:
+                self._escrever()
+
+        for seg in fechados:
+            if seg["bytes"]:
+                conversor.enfileirar(os.path.join(REC_DIR, seg["h264"]), segmento=True,
+                                     ao_terminar=self._convertido)
+            else:
+                self._marcar(seg["h264"], "erro", "segmento vazio")
+
+    def _convertido(self, job):
+        self._marcar(os.path.basename(job.h264),
+                     "mp4" if job.estado == "concluido" else "erro", job.erro)
+
+    def _marcar(self, h264: str, estado: str, erro: str = None):
+        with self.lock:
+            for seg in self.segmentos:
+                if seg["h264"] == h264:
+                    seg["estado"], seg["erro"] = estado, erro
+            self._escrever()
+
+    def resumo(self) -> dict:
+        return {
+            "sessao": self.base,
+            "inicio": self.inicio,
+            "fim": self.fim,
+            "interrompida": self.interrompida,
+            "segmento_s": self.segmento_s,
+            "segmentos": self.segmentos,
+        }
+
+    def _escrever(self):
+        # Chamado com self.lock adquirido (ou antes da thread existir)
+        try:
+            with open(self.manifesto + ".part", "w") as f:
+                json.dump(self.resumo(), f, indent=1)
+            os.replace(self.manifesto + ".part", self.manifesto)
+        except OSError as e:
+            logger.error(f"Sessão {self.base}: falha ao salvar manifesto: {e}")
+
+
+def recuperar_sessoes():
+    """Retoma sessões segmentadas deixadas pela metade (ver SessaoGravacao.retomar)."""
+    for manifesto in glob(os.path.join(REC_DIR, "*.manifest.json")):
+        try:
+            sessao = SessaoGravacao.carregar(manifesto)
+            if sessao.fim is None or any(seg["estado"] == "fechado" for seg in sessao.segmentos):
+                sessao.retomar()
+        except Exception as e:
+            logger.error(f"Falha ao retomar {manifesto}: {e}")
+
+
 # --- Estado do Sistema ---
 class CameraManager:
     """
     Abstrai o controle da câmera via subprocess.
-    Mantém estado (idle / recording / photo_sequence) e o handle do processo.
+    Mantém estado (idle / recording / photo_sequence), o handle do processo de
+    gravação e o pipeline contínuo de fotos.
     """
-    def __init__(self):
+    def __init__(self, backend=None):
+        self.backend = backend or BACKENDS_CAMERA[CAMERA_BACKEND]()
+        self.fotos = PipelineJPEG(self.backend)
         self.process = None              # subprocess.Popen do rpicam-vid (quando gravando)
         self.mode = "idle"               # estado atual
         self.current_filename = None     # base do nome do arquivo atual (sem extensão)
+        self.sessao = None               # SessaoGravacao da gravação segmentada (atual ou última)
 
     def set_mode(self, new_mode: str):
         # Apenas troca o estado e registra no log
@@ -74,33 +497,53 @@ class CameraManager:
                     self.process.kill()
             self.process = None
 
+        # Processo encerrado: o último segmento está fechado
+        if self.sessao and self.sessao.fim is None:
+            self.sessao.finalizar()
+
         # Sempre volta para idle e limpa nome atual
         self.set_mode("idle")
         self.current_filename = None
 
+    def aquecer(self):
+        """Sobe o pipeline de fotos em background (ex.: ao abrir a página)."""
+        if self.mode == "idle" and not self.fotos.ativo():
+            asyncio.create_task(self._aquecer())
+
+    async def _aquecer(self):
+        try:
+            await self.fotos.iniciar()
+        except Exception as e:
+            logger.warning(f"Pipeline de fotos não iniciou: {e}")
+
     def start_recording(self, filename_base):
         """
         Inicia gravação contínua com rpicam-vid.
         - Só permite se estiver idle
         - Usa "-t 0" => grava “indefinidamente” até você parar o processo
+        - Segmentada (duracao_segmento_s() > 0): {base}_NNNN.h264 + manifesto
         """
         if self.mode != "idle":
             raise Exception("Câmera ocupada!")
 
-        h264_path = os.path.join(REC_DIR, f"{filename_base}.h264")
-        logger.info(f"Iniciando gravação: {h264_path}")
-
-        cmd = [
-            "rpicam-vid",
-            "-t", "0",                      # 0 ms => roda sem timeout (até parar)
-            "--width", "1296", "--height", "972",
-            "--framerate", "30",
-            "-o", h264_path,                # saída do vídeo (H.264 bruto)
-            "--nopreview"
-        ]
+        segmento_s = duracao_segmento_s()
+        if segmento_s:
+            sessao = SessaoGravacao(filename_base, segmento_s)
+            h264_path = sessao.padrao
+            cmd = self.backend.cmd_video(h264_path, int(segmento_s * 1000),
+                                         GRAVACAO_BITRATE if GRAVACAO_SEGMENTO_MB > 0 else 0)
+        else:
+            sessao = None
+            h264_path = os.path.join(REC_DIR, f"{filename_base}.h264")
+            cmd = self.backend.cmd_video(h264_path)
+        logger.info(f"Iniciando gravação: {h264_path}"
+                    + (f" (segmentos de {segmento_s:.0f} s)" if sessao else ""))
 
         # Popen: inicia processo e retorna imediatamente (não bloqueia)
         self.process = subprocess.Popen(cmd)
+        self.sessao = sessao
+        if sessao:
+            sessao.iniciar()
         self.current_filename = filename_base
         self.set_mode("recording")
 
@@ -116,28 +559,29 @@ class CameraManager:
             return last_file
         return None
 
-    def take_photo(self):
+    def _pode_fotografar(self):
+        if self.mode == "idle":
+            return
+        if self.mode == "recording" and self.backend.foto_durante_gravacao:
+            return
+        if self.mode == "recording":
+            raise Exception("Foto indisponível durante a gravação nesta câmera")
+        raise Exception("Câmera ocupada")
+
+    async def take_photo(self):
         """
-        Tira uma foto única com rpicam-still.
-        IMPORTANTE: subprocess.run(..., check=True) BLOQUEIA até terminar.
+        Tira uma foto única: o próximo quadro do pipeline contínuo (depois do
+        pedido), sem reiniciar o sensor.
         """
-        if self.mode != "idle":
-            raise Exception("Câmera ocupada")
+        self._pode_fotografar()
 
-        filename = datetime.now().strftime("IMG_%Y%m%d_%H%M%S.jpg")
+        # Com fotos instantâneas cabem várias por segundo: milissegundos no nome
+        agora = datetime.now()
+        filename = agora.strftime("IMG_%Y%m%d_%H%M%S_") + f"{agora.microsecond // 1000:03d}.jpg"
         filepath = os.path.join(REC_DIR, filename)
 
-        logger.info(f"Capturando foto: {filepath}")
-
-        cmd = [
-            "rpicam-still",
-            "-t", "50",                      # timeout (ms) antes de capturar; aqui ~50ms
-            "-o", filepath,
-            "--width", "1296", "--height", "972",
-            "--nopreview"
-        ]
-
-        subprocess.run(cmd, check=True)      # se falhar, levanta CalledProcessError
+        _seq, _t, jpeg = await self.fotos.quadro()
+        await asyncio.to_thread(salvar_jpeg, jpeg, filepath)
         logger.info(f"Foto salva: {filepath}")
         return filename
 
@@ -145,29 +589,530 @@ class CameraManager:
 # Instância global (única) do gerenciador
 cam = CameraManager()
 
+
+# --- Jobs de captura (sequências de fotos) ---
+CAPTURA_JOBS_MAX = 20           # jobs terminados guardados para consulta
+
+
+class CapturaJob:
+    """Uma sequência de fotos: progresso, arquivos, erro e stderr da câmera."""
+    def __init__(self, job_id: str, count: int, intervalo_s: float):
+        self.id = job_id
+        self.count = count
+        self.intervalo_s = intervalo_s
+        self.estado = "pendente"        # pendente | executando | concluido | cancelado | erro
+        self.arquivos = []              # {"file", "offset_ms"}
+        self.erro = None
+        self.stderr = []
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.fim_em = None
+        self.task = None
+
+    def terminado(self) -> bool:
+        return self.estado in ("concluido", "cancelado", "erro")
+
+    def resumo(self) -> dict:
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "count": self.count,
+            "interval_ms": round(self.intervalo_s * 1000),
+            "feitas": len(self.arquivos),
+            "progresso": round(len(self.arquivos) / self.count, 3),
+            "arquivos": self.arquivos,
+            "erro": self.erro,
+            "stderr": self.stderr,
+            "criado_em": self.criado_em,
+            "iniciado_em": self.iniciado_em,
+            "fim_em": self.fim_em,
+        }
+
+
+class MotorCaptura:
+    """
+    Executa as sequências como tasks asyncio sobre o pipeline de fotos: o loop
+    continua atendendo /api/status, SSE e a página durante a captura. Uma
+    sequência por vez; cancelar interrompe entre duas fotos.
+    """
+    def __init__(self, camera: CameraManager):
+        self.cam = camera
+        self.jobs = {}                  # id -> CapturaJob (ordem de criação)
+        self.atual = None
+        self.n = 0
+
+    def iniciar(self, count: int, intervalo_s: float) -> CapturaJob:
+        if self.atual is not None and not self.atual.terminado():
+            raise Exception(f"Sequência {self.atual.id} em andamento")
+        self.cam._pode_fotografar()
+
+        self.n += 1
+        job = CapturaJob(f"{datetime.now():%H%M%S}-{self.n}", count, intervalo_s)
+        self.jobs[job.id] = job
+        self.atual = job
+        job.task = asyncio.create_task(self._executar(job))
+
+        terminados = [j for j in self.jobs.values() if j.terminado()]
+        for antigo in terminados[:max(len(self.jobs) - CAPTURA_JOBS_MAX, 0)]:
+            del self.jobs[antigo.id]
+        return job
+
+    def cancelar(self, job_id: str) -> CapturaJob:
+        job = self.jobs[job_id]
+        if not job.terminado():
+            job.task.cancel()
+        return job
+
+    async def _executar(self, job: CapturaJob):
+        fotos = self.cam.fotos
+        gravando = self.cam.mode == "recording"
+        if not gravando:
+            self.cam.set_mode("photo_sequence")
+        job.estado = "executando"
+        job.iniciado_em = time.time()
+
+        agora = datetime.now()
+        stamp = agora.strftime("%Y%m%d_%H%M%S_") + f"{agora.microsecond // 1000:03d}"
+        tolerancia = 0.5 / fotos.fps
+        try:
+            seq, t0, jpeg = await fotos.quadro()
+            t = t0
+            for i in range(job.count):
+                if i > 0:
+                    # Primeiro quadro a partir do instante alvo (relógio dos quadros)
+                    alvo = t0 + i * job.intervalo_s - tolerancia
+                    seq, t, jpeg = await fotos.quadro(depois_de=seq)
+                    while t < alvo:
+                        seq, t, jpeg = await fotos.quadro(depois_de=seq)
+                filename = f"SEQ_{i+1}_{stamp}.jpg"
+                await asyncio.to_thread(salvar_jpeg, jpeg, os.path.join(REC_DIR, filename))
+                job.arquivos.append({"file": filename, "offset_ms": round((t - t0) * 1000, 1)})
+            job.estado = "concluido"
+            logger.info(f"Sequência {job.id}: {job.count} fotos (alvo {job.intervalo_s * 1000:.0f} ms): "
+                        f"{[a['offset_ms'] for a in job.arquivos]} ms")
+        except asyncio.CancelledError:
+            job.estado = "cancelado"
+            logger.info(f"Sequência {job.id} cancelada após {len(job.arquivos)} fotos")
+        except Exception as e:
+            job.estado = "erro"
+            job.erro = str(e)
+            job.stderr = list(fotos.stderr)[-10:]
+            logger.error(f"Sequência {job.id} falhou: {e} | stderr: {job.stderr}")
+        finally:
+            job.fim_em = time.time()
+            if not gravando:
+                self.cam.set_mode("idle")
+
+
+capturas = MotorCaptura(cam)
+
 SERIAL_PORT = os.environ.get("STM_PORT", "usb-FTDI_FT232R_USB_UART_A9YD53RF-if00-port0")#comando citado  nas configuracoes gerais
 SERIAL_BAUD = int(os.environ.get("STM_BAUD", "115200"))
+SERIAL_PROTOCOLO = os.environ.get("STM_PROTOCOLO", "ascii")  # "ascii" ou "binario"
+# Socket do controller/serial_mux.py: com o mux rodando ele é o dono da porta
+# (compartilhada com o controller) e a ponte fala texto com ele.
+SERIAL_MUX = os.environ.get("STM_MUX")
+
+# --- Protocolo binário (opcional) ---
+# Formato dos quadros, codificação e decodificador: controller/stm_protocolo.py
+# (importado no open() só no modo binário; mesmo código do controller e do serial_mux).
+# STAT tem layout fixo (STAT_STRUCT): decodificado com struct, sem split/int()
+# por campo. TIPO_RESP ecoa o SEQ do TIPO_CMD respondido.
+
+# --- Leitura ASCII em bloco ---
+# O leitor puxa tudo que estiver disponível na porta de uma vez e separa as
+# linhas completas de um buffer reaproveitado; o resto (linha incompleta)
+# fica para a próxima leitura. Uma linha sem "\n" maior que isto é lixo
+# (baud errado, ruído) e é descartada.
+SERIAL_MAX_LINHA = 4096
+
+# --- Comandos com resposta ---
+# Resposta esperada de cada comando (prefixo da linha). Vários pedidos podem
+# estar em voo ao mesmo tempo: no modo ASCII a resposta resolve o pedido mais
+# antigo com o mesmo prefixo. No modo binário o firmware ecoa no quadro
+# TIPO_RESP o SEQ do comando respondido e só o pedido com esse SEQ é resolvido,
+# mesmo se um comando se perder.
+# STATUS é respondido com "EN=... | FIXED_CCR=... | ARR=... CCR1=... CCR2=..."
+# (firmware em stm32f411/). A telemetria STAT periódica não conta como
+# resposta: o rtt_ms é o da ida e volta do pedido.
+# Um prefixo pode ser uma tupla de alternativas.
+STM_RESPOSTAS = {"ON": "OK ON", "OFF": "OK OFF", "STATUS": "EN="}
+STM_TIMEOUT_S = 1.0
+
+
+# --- SSE (telemetria do STM para os navegadores) ---
+# Hub asyncio: cada cliente tem uma fila limitada no event loop, sem thread
+# presa por conexão. O leitor serial publica lotes de linhas (uma chamada
+# thread-safe por lote) e cada cliente recebe tudo o que acumulou em um único
+# envio. Cliente lento (fila cheia):
+#   "descartar_antigos": perde as linhas mais antigas e continua conectado
+#   "desconectar":       é desconectado (o EventSource do navegador reconecta)
+SSE_FILA_MAX = int(os.environ.get("SSE_FILA_MAX", "500"))               # linhas por cliente
+SSE_POLITICA = os.environ.get("SSE_POLITICA", "descartar_antigos")
+SSE_KEEPALIVE_S = 15.0          # comentário ": ping" para detectar conexão morta
+SSE_JANELA_LAG = 500            # amostras de atraso guardadas para estatística
+
+
+class ClienteSSE:
+    __slots__ = ("fila", "evento", "fechado", "descartados", "entregues", "conectado_em")
+
+    def __init__(self):
+        self.fila = deque()             # (t_publicado, linha)
+        self.evento = asyncio.Event()
+        self.fechado = False
+        self.descartados = 0
+        self.entregues = 0
+        self.conectado_em = time.time()
+
+
+class HubSSE:
+    """
+    Difusão das linhas do STM para os clientes SSE.
+
+    publicar() pode ser chamado de qualquer thread; todo o resto roda no event
+    loop do servidor (preso na primeira conexão).
+    """
+    def __init__(self, fila_max: int = SSE_FILA_MAX, politica: str = SSE_POLITICA):
+        if politica not in ("descartar_antigos", "desconectar"):
+            raise ValueError(f"política SSE inválida: {politica}")
+        self.fila_max = fila_max
+        self.politica = politica
+        self.loop = None
+        self.clientes = set()
+
+        # Contadores
+        self.conexoes_total = 0
+        self.linhas_publicadas = 0
+        self.linhas_descartadas = 0
+        self.desconectados_lentos = 0
+        self.lag_ms = deque(maxlen=SSE_JANELA_LAG)
+
+    def conectar(self) -> ClienteSSE:
+        """Registra um cliente (chamar de dentro do event loop)."""
+        self.loop = asyncio.get_running_loop()
+        cliente = ClienteSSE()
+        self.clientes.add(cliente)
+        self.conexoes_total += 1
+        return cliente
+
+    def desconectar(self, cliente: ClienteSSE):
+        cliente.fechado = True
+        self.clientes.discard(cliente)
+
+    def publicar(self, lines):
+        """Entrega um lote de linhas a todos os clientes (thread-safe, não bloqueia)."""
+        if self.loop is None or not self.clientes:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._distribuir, lines, time.monotonic())
+        except RuntimeError:
+            pass  # Event loop encerrado (desligando o servidor)
+
+    def _distribuir(self, lines, t_publicado):
+        self.linhas_publicadas += len(lines)
+        for cliente in list(self.clientes):
+            fila = cliente.fila
+            excesso = len(fila) + len(lines) - self.fila_max
+            if excesso > 0:
+                if self.politica == "desconectar":
+                    self.desconectados_lentos += 1
+                    self.desconectar(cliente)
+                    cliente.evento.set()
+                    continue
+                # Descarta as mais antigas: primeiro da fila, depois do começo do lote
+                cliente.descartados += excesso
+                self.linhas_descartadas += excesso
+                da_fila = min(excesso, len(fila))
+                for _ in range(da_fila):
+                    fila.popleft()
+                lote = lines[excesso - da_fila:]
+            else:
+                lote = lines
+            fila.extend((t_publicado, line) for line in lote)
+            cliente.evento.set()
+
+    async def eventos(self, cliente: ClienteSSE, backlog=()):
+        """Gerador do corpo text/event-stream de um cliente."""
+        try:
+            if backlog:
+                yield "".join(f"data: {line}\n\n" for line in backlog)
+            while not cliente.fechado:
+                try:
+                    await asyncio.wait_for(cliente.evento.wait(), SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                cliente.evento.clear()
+                if not cliente.fila:
+                    continue
+
+                itens = list(cliente.fila)
+                cliente.fila.clear()
+                cliente.entregues += len(itens)
+                self.lag_ms.append((time.monotonic() - itens[0][0]) * 1000)
+                yield "".join(f"data: {line}\n\n" for _t, line in itens)
+
+            yield "event: desconectado\ndata: cliente_lento\n\n"
+        finally:
+            self.desconectar(cliente)
+
+    def estatisticas(self) -> dict:
+        lag = sorted(self.lag_ms)
+        clientes = list(self.clientes)
+        stats = {
+            "clientes": len(clientes),
+            "politica": self.politica,
+            "fila_max": self.fila_max,
+            "conexoes_total": self.conexoes_total,
+            "linhas_publicadas": self.linhas_publicadas,
+            "linhas_descartadas": self.linhas_descartadas,
+            "desconectados_lentos": self.desconectados_lentos,
+            "fila_maior": max((len(c.fila) for c in clientes), default=0),
+        }
+        if lag:
+            n = len(lag)
+            stats["lag_p50_ms"] = round(lag[n // 2], 3)
+            stats["lag_p95_ms"] = round(lag[min(int(n * 0.95), n - 1)], 3)
+            stats["lag_max_ms"] = round(lag[-1], 3)
+        return stats
+
+
+# --- Telemetria STAT (série temporal) ---
+# Cada STAT recebido vira um registro em um ring buffer colunar (um array
+# numpy por campo) de tamanho fixo na memória. A cada TELEMETRIA_PERSISTIR_S
+# os registros novos são copiados para arquivos append-only mapeados em
+# memória (um por campo, em TELEM_DIR), então horas de histórico podem ser
+# consultadas sem texto nem parse por requisição. Para um campo novo no STAT,
+# basta incluí-lo em TELEMETRIA_CAMPOS: a coluna é criada zerada para os
+# registros antigos. "t" é o horário de recepção (epoch, s).
+TELEMETRIA_CAMPOS = {"t": "<f8", "ms": "<u4", "en": "u1", "arr": "<u2", "ccr": "<u2"}
+TELEMETRIA_RING = 36000         # registros na memória (1 h a 10 Hz)
+TELEMETRIA_BLOCO = 1 << 16      # crescimento dos arquivos, em registros
+TELEMETRIA_PERSISTIR_S = 5.0
+HISTORICO_MAX_PONTOS = 5000
+
+
+class TelemetriaSTAT:
+    """Ring buffer colunar + arquivo colunar mapeado em memória (opcional)."""
+    def __init__(self, diretorio: str = None, ring: int = TELEMETRIA_RING):
+        self.campos = {c: np.dtype(d) for c, d in TELEMETRIA_CAMPOS.items()}
+        self.tam_ring = ring
+        self.ring = {c: np.zeros(ring, dtype=d) for c, d in self.campos.items()}
+        self.n = 0                  # registros recebidos (índice global do próximo)
+        self.n_inicio = 0           # índice global do primeiro registro desta execução
+        self.n_arquivo = 0          # registros já copiados para o disco
+        self.lock = threading.Lock()
+
+        self.diretorio = diretorio
+        self.colunas = {}           # campo -> np.memmap (capacidade, não tamanho)
+        self.capacidade = 0
+        self._t_persistido = time.monotonic()
+        if diretorio:
+            try:
+                self._abrir_arquivos()
+            except OSError as e:
+                logger.error(f"TELEMETRIA: sem persistência em {diretorio}: {e}")
+                self.diretorio = None
+                self.colunas = {}
+
+    # ---------- arquivo ----------
+    def _caminho(self, campo):
+        return os.path.join(self.diretorio, f"{campo}.bin")
+
+    def _abrir_arquivos(self):
+        os.makedirs(self.diretorio, exist_ok=True)
+        try:
+            with open(os.path.join(self.diretorio, "meta.json")) as f:
+                self.n_arquivo = int(json.load(f)["n"])
+        except (OSError, ValueError, KeyError):
+            self.n_arquivo = 0
+        self.n = self.n_inicio = self.n_arquivo
+        self._mapear(max(self.n_arquivo, 1))
+
+    def _mapear(self, minimo):
+        """(Re)mapeia as colunas com capacidade >= minimo registros."""
+        cap = -(-minimo // TELEMETRIA_BLOCO) * TELEMETRIA_BLOCO
+        self.colunas = {}
+        for campo, dtype in self.campos.items():
+            caminho = self._caminho(campo)
+            with open(caminho, "ab") as f:
+                if f.tell() < cap * dtype.itemsize:
+                    f.truncate(cap * dtype.itemsize)     # estende com zeros
+            self.colunas[campo] = np.memmap(caminho, dtype=dtype, mode="r+", shape=(cap,))
+        self.capacidade = cap
+
+    def _salvar_meta(self):
+        meta = os.path.join(self.diretorio, "meta.json")
+        with open(meta + ".tmp", "w") as f:
+            json.dump({"n": self.n_arquivo, "campos": TELEMETRIA_CAMPOS}, f)
+        os.replace(meta + ".tmp", meta)
+
+    def persistir(self):
+        """Copia os registros pendentes do ring para o disco."""
+        with self.lock:
+            self._persistir()
+
+    def _persistir(self):
+        self._t_persistido = time.monotonic()
+        if not self.colunas or self.n == self.n_arquivo:
+            return
+        if self.n > self.capacidade:
+            for coluna in self.colunas.values():
+                coluna.flush()
+            self._mapear(self.n)
+
+        ini, fim = self.n_arquivo, self.n
+        for campo, coluna in self.colunas.items():
+            coluna[ini:fim] = self._do_ring(campo, ini, fim)
+            coluna.flush()
+        self.n_arquivo = fim
+        self._salvar_meta()
+
+    # ---------- ring ----------
+    def _do_ring(self, campo, ini, fim):
+        """Registros globais [ini, fim) de um campo (devem estar no ring)."""
+        r = self.ring[campo]
+        a, b = ini % self.tam_ring, fim % self.tam_ring
+        if fim - ini == 0:
+            return r[:0].copy()
+        if a < b:
+            return r[a:b].copy()
+        return np.concatenate((r[a:], r[:b]))
+
+    def adicionar_lote(self, registros):
+        """registros: lista de dicts campo -> valor (campos ausentes ficam 0)."""
+        if not registros:
+            return
+        t = time.time()
+        with self.lock:
+            # Se o lote não couber sem sobrescrever registros ainda não persistidos
+            if self.colunas and self.n + len(registros) - self.n_arquivo > self.tam_ring:
+                self._persistir()
+            registros = registros[-self.tam_ring:]
+            k = len(registros)
+            i = self.n % self.tam_ring
+            partes = ((i, 0, min(k, self.tam_ring - i)), (0, self.tam_ring - i, k))
+            for campo, r in self.ring.items():
+                if campo == "t":
+                    coluna = np.full(k, t)
+                else:
+                    coluna = np.fromiter((reg.get(campo, 0) for reg in registros), dtype=r.dtype, count=k)
+                for destino, ini, fim in partes:
+                    if fim > ini:
+                        r[destino:destino + fim - ini] = coluna[ini:fim]
+            self.n += k
+            if time.monotonic() - self._t_persistido >= TELEMETRIA_PERSISTIR_S:
+                self._persistir()
+
+    # ---------- consulta ----------
+    def _janela(self, de, ate, campos):
+        """Colunas (cópias) dos registros com de <= t <= ate."""
+        nomes = ("t",) + campos
+        with self.lock:
+            ini_ring = max(self.n - self.tam_ring, self.n_inicio)
+            n, n_arquivo = self.n, self.n_arquivo
+            na_memoria = n > ini_ring and self.ring["t"][ini_ring % self.tam_ring] <= de
+            if na_memoria or not self.colunas:
+                dados = {c: self._do_ring(c, ini_ring, n) for c in nomes}
+            else:
+                # Disco: t é crescente (o relógio só pula para frente no boot,
+                # fake-hwclock -> NTP), então a busca binária delimita o trecho
+                t_arquivo = self.colunas["t"][:n_arquivo]
+                i0 = int(np.searchsorted(t_arquivo, de, side="left"))
+                i1 = int(np.searchsorted(t_arquivo, ate, side="right"))
+                dados = {c: np.concatenate((self.colunas[c][i0:i1], self._do_ring(c, n_arquivo, n)))
+                         for c in nomes}
+        sel = (dados["t"] >= de) & (dados["t"] <= ate)
+        return {c: v[sel] for c, v in dados.items()}
+
+    def historico(self, de: float, ate: float, max_pontos: int, campos=None) -> dict:
+        """
+        Série entre de e ate (epoch, s), reduzida a no máximo max_pontos
+        intervalos de tempo iguais com min/max/média por campo.
+        """
+        campos = tuple(c for c in (campos or self.campos) if c != "t")
+        dados = self._janela(de, ate, campos)
+        t = dados["t"]
+        resposta = {"de": de, "ate": ate, "registros": int(t.size), "reduzido": False}
+        if t.size <= max_pontos:
+            resposta["t"] = t.tolist()
+            resposta["campos"] = {c: dados[c].tolist() for c in campos}
+            return resposta
+
+        # Intervalo de cada registro; ordena por intervalo (o relógio pode voltar no NTP)
+        balde = np.minimum(((t - de) / (ate - de) * max_pontos).astype(np.int64), max_pontos - 1)
+        if np.any(balde[1:] < balde[:-1]):
+            ordem = np.argsort(balde, kind="stable")
+            balde, dados = balde[ordem], {c: v[ordem] for c, v in dados.items()}
+        inicios = np.flatnonzero(np.r_[True, balde[1:] != balde[:-1]])
+        contagem = np.diff(np.r_[inicios, balde.size])
+
+        resposta["reduzido"] = True
+        resposta["t"] = np.round(np.add.reduceat(dados["t"], inicios) / contagem, 3).tolist()
+        resposta["n"] = contagem.tolist()
+        resposta["campos"] = {}
+        for c in campos:
+            v = dados[c].astype(np.float64)
+            resposta["campos"][c] = {
+                "min": np.minimum.reduceat(v, inicios).tolist(),
+                "max": np.maximum.reduceat(v, inicios).tolist(),
+                "media": np.round(np.add.reduceat(v, inicios) / contagem, 3).tolist(),
+            }
+        return resposta
+
+
+class PedidoSTM:
+    __slots__ = ("cmd", "prefixo", "seq", "futuro", "t_envio")
+
+    def __init__(self, cmd: str, prefixo):
+        self.cmd = cmd
+        self.prefixo = prefixo
+        self.seq = None
+        self.futuro = concurrent.futures.Future()
+        self.t_envio = None
+
 
 class StmSerialBridge:
-    def __init__(self, port: str, baud: int):
+    def __init__(self, port: str, baud: int, protocolo: str = "ascii", hub: HubSSE = None,
+                 telemetria: TelemetriaSTAT = None, mux: str = None):
         self.port = port
         self.baud = baud
+        self.mux = mux
+        # Pelo mux a conversa é sempre texto; o protocolo da porta fica com ele
+        self.protocolo = "ascii" if mux else protocolo
         self.ser = None
+        self.seq = 0
+        self.proto = None               # controller/stm_protocolo.py, só no modo binário
+        self.decodificador = None
         self.lock = threading.Lock()
         self.thread = None
         self.stop_evt = threading.Event()
 
+        # Pedidos aguardando resposta (resolvidos pela thread leitora)
+        self.pendentes = []
+        self.pendentes_lock = threading.Lock()
+        self.pedidos_timeout = 0
+
         self.last_status = {"en": None, "arr": None, "ccr": None, "raw": None}
         self.logs = deque(maxlen=300)  # buffer circular
 
-        # SSE: cada cliente terá sua própria fila
-        self.sse_clients = set()
-        self.sse_lock = threading.Lock()
+        # SSE: difusão assíncrona para os navegadores
+        self.hub = hub or HubSSE()
+
+        # STAT como série temporal (sem disco se não for passada)
+        self.telemetria = telemetria or TelemetriaSTAT()
 
     def open(self):
         if self.ser and self.ser.is_open:
             return
-        self.ser = serial.Serial(self.port, self.baud, timeout=0.2, write_timeout=0.5)
+        if self.protocolo == "binario" and self.proto is None:
+            self.proto = importar_controller("stm_protocolo")
+            self.decodificador = self.proto.DecodificadorQuadros()
+        if self.mux:
+            ClienteMux = importar_controller("serial_mux").ClienteMux
+            self.ser = ClienteMux(self.mux, nome="dataColector")
+        else:
+            self.ser = serial.Serial(self.port, self.baud, timeout=0.2, write_timeout=0.5)
         self.stop_evt.clear()
         self.thread = threading.Thread(target=self._reader_loop, daemon=True)
         self.thread.start()
@@ -180,145 +1125,1092 @@ class StmSerialBridge:
         except Exception:
             pass
         self.ser = None
+        self._falhar_pendentes(RuntimeError("Serial fechada"))
+        self.telemetria.persistir()
 
-    def send(self, cmd: str):
+    def send(self, cmd: str, pedido: PedidoSTM = None):
         if not self.ser or not self.ser.is_open:
             raise RuntimeError("Serial não está aberta")
-        line = (cmd.strip() + "\n").encode("ascii", errors="ignore")
         with self.lock:
-            self.ser.write(line)
+            if self.protocolo == "binario":
+                data = self.proto.codificar_quadro(self.proto.TIPO_CMD, self.seq,
+                                                   cmd.strip().encode("ascii", errors="ignore"))
+                seq, self.seq = self.seq, (self.seq + 1) & 0xFF
+            else:
+                data = (cmd.strip() + "\n").encode("ascii", errors="ignore")
+                seq = None
+            if pedido is not None:
+                # Registrado antes da escrita: a resposta pode chegar antes do write() voltar
+                pedido.seq = seq
+                pedido.t_envio = time.perf_counter()
+                with self.pendentes_lock:
+                    self.pendentes.append(pedido)
+            self.ser.write(data)
             self.ser.flush()
 
-    def _broadcast_sse(self, line: str):
-        with self.sse_lock:
-            dead = []
-            for q in self.sse_clients:
+    def pedido(self, cmd: str, prefixo=None) -> concurrent.futures.Future:
+        """
+        Envia cmd e devolve um Future resolvido pela thread leitora com
+        {"resposta": linha, "rtt_ms": ...} quando chegar a linha que começa
+        com prefixo (padrão: STM_RESPOSTAS[cmd]).
+        """
+        cmd = cmd.strip()
+        prefixo = prefixo or STM_RESPOSTAS.get(cmd)
+        if not prefixo:
+            raise ValueError(f"comando sem resposta conhecida: {cmd}")
+        pedido = PedidoSTM(cmd, prefixo)
+        try:
+            self.send(cmd, pedido)
+        except Exception:
+            self._descartar_pedido(pedido)
+            raise
+        return pedido.futuro
+
+    async def comando(self, cmd: str, prefixo=None, timeout: float = STM_TIMEOUT_S) -> dict:
+        """Versão async de pedido(): espera a resposta até timeout (TimeoutError)."""
+        loop = asyncio.get_running_loop()
+        futuro = await loop.run_in_executor(None, self.pedido, cmd, prefixo)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout)
+        except asyncio.TimeoutError:
+            self.pedidos_timeout += 1
+            logger.warning(f"STM: sem resposta a {cmd} em {timeout:.1f} s (timeouts={self.pedidos_timeout})")
+            with self.pendentes_lock:
+                self.pendentes = [p for p in self.pendentes if p.futuro is not futuro]
+            raise TimeoutError(f"STM não respondeu a {cmd} em {timeout:.1f} s")
+
+    def _descartar_pedido(self, pedido: PedidoSTM):
+        with self.pendentes_lock:
+            if pedido in self.pendentes:
+                self.pendentes.remove(pedido)
+
+    def _resolver(self, line: str, seq: int = None):
+        """Casa uma linha recebida com o pedido pendente (SEQ exato, se houver; senão o mais antigo com o prefixo)."""
+        with self.pendentes_lock:
+            if seq is not None:
+                # TIPO_RESP: resposta de um comando específico (SEQ de outro pedido não casa)
+                alvo = next((p for p in self.pendentes if p.seq == seq and line.startswith(p.prefixo)), None)
+            else:
+                alvo = next((p for p in self.pendentes if line.startswith(p.prefixo)), None)
+            if alvo is None:
+                return
+            self.pendentes.remove(alvo)
+        try:
+            alvo.futuro.set_result({
+                "resposta": line,
+                "rtt_ms": round((time.perf_counter() - alvo.t_envio) * 1000, 3),
+            })
+        except concurrent.futures.InvalidStateError:
+            pass  # Já cancelado por timeout
+
+    def _falhar_pendentes(self, erro: Exception):
+        with self.pendentes_lock:
+            pendentes, self.pendentes = self.pendentes, []
+        for p in pendentes:
+            if not p.futuro.done():
+                p.futuro.set_exception(erro)
+
+    def _broadcast_sse(self, lines):
+        # Um lote por chamada; a política de cliente lento fica no hub
+        self.hub.publicar(lines)
+
+    @staticmethod
+    def _parse_stat(line: str) -> dict:
+        # exemplo: STAT,ms=...,en=1,arr=...,ccr=...
+        reg = {}
+        for p in line.split(",")[1:]:
+            chave, _, valor = p.partition("=")
+            if chave in TELEMETRIA_CAMPOS:
                 try:
-                    q.put_nowait(line)
-                except Exception:
-                    dead.append(q)
-            for q in dead:
-                self.sse_clients.discard(q)
+                    reg[chave] = int(valor)
+                except ValueError:
+                    pass
+        return reg
+
+    @staticmethod
+    def _parse_status(line: str) -> dict:
+        """Campos chave=valor de uma resposta de STATUS (EN=1 | FIXED_CCR=499 | ARR=999 ...)."""
+        campos = {}
+        for p in line.replace("|", " ").replace(",", " ").split():
+            chave, sep, valor = p.partition("=")
+            if sep:
+                try:
+                    campos[chave.lower()] = int(valor)
+                except ValueError:
+                    pass
+        return campos
+
+    def _atualizar_status(self, registros, stat_line):
+        self.telemetria.adicionar_lote(registros)
+        ultimo = registros[-1]
+        self.last_status.update({c: ultimo.get(c) for c in ("en", "arr", "ccr")})
+        self.last_status["raw"] = stat_line
+
+    def _push_lines(self, lines):
+        """Entrega um lote de linhas: buffer circular, SSE e telemetria."""
+        if not lines:
+            return
+        self.logs.extend(lines)
+        self._broadcast_sse(lines)
+
+        stats = [line for line in lines if line.startswith("STAT,")]
+        if stats:
+            self._atualizar_status([self._parse_stat(line) for line in stats], stats[-1])
+
+        if self.pendentes:
+            for line in lines:
+                self._resolver(line)
 
     def _push_log(self, line: str):
-        self.logs.append(line)
-        self._broadcast_sse(line)
-
-        # parse simples do STAT
-        if line.startswith("STAT,"):
-            self.last_status["raw"] = line
-            # exemplo: STAT,ms=...,en=1,arr=...,ccr=...
-            parts = line.split(",")
-            for p in parts:
-                if p.startswith("en="):
-                    self.last_status["en"] = int(p.split("=", 1)[1])
-                elif p.startswith("arr="):
-                    self.last_status["arr"] = int(p.split("=", 1)[1])
-                elif p.startswith("ccr="):
-                    self.last_status["ccr"] = int(p.split("=", 1)[1])
+        self._push_lines([line])
+
+    def _read_frames(self):
+        raw = self.ser.read(self.ser.in_waiting or 1)
+        if not raw:
+            return
+        # STAT já decodificado (modo binário): vai para a telemetria sem parse de texto
+        p = self.proto
+        lines, registros, stat_line, respostas = [], [], None, []
+        for tipo, seq, payload in self.decodificador.alimentar(raw):
+            if tipo == p.TIPO_STAT and len(payload) == p.STAT_STRUCT.size:
+                ms, en, arr, ccr = p.STAT_STRUCT.unpack(payload)
+                registros.append({"ms": ms, "en": en, "arr": arr, "ccr": ccr})
+                stat_line = f"STAT,ms={ms},en={en},arr={arr},ccr={ccr}"
+                lines.append(stat_line)
+                respostas.append((stat_line, None))
+            else:
+                line = payload.decode("utf-8", errors="ignore").strip()
+                if line:
+                    lines.append(line)
+                    respostas.append((line, seq if tipo == p.TIPO_RESP else None))
+        if not lines:
+            return
+        self.logs.extend(lines)
+        self._broadcast_sse(lines)
+        if registros:
+            self._atualizar_status(registros, stat_line)
+        if self.pendentes:
+            for line, seq in respostas:
+                self._resolver(line, seq)
+
+    def _read_lines(self, buf: bytearray):
+        """
+        Lê em bloco tudo o que estiver disponível (no mínimo 1 byte, esperando
+        até o timeout da porta) e entrega as linhas completas que estão em buf.
+        """
+        raw = self.ser.read(self.ser.in_waiting or 1)
+        if not raw:
+            return
+        buf += raw
+        fim = buf.rfind(b"\n")
+        if fim < 0:
+            if len(buf) > SERIAL_MAX_LINHA:
+                del buf[:]
+            return
+        texto = buf[:fim].decode("utf-8", errors="ignore")
+        del buf[:fim + 1]
+        lines = [line.strip() for line in texto.split("\n")]
+        self._push_lines([line for line in lines if line])
 
     def _reader_loop(self):
+        buf = bytearray()
         while not self.stop_evt.is_set():
             try:
-                raw = self.ser.readline()
-                if not raw:
-                    continue
-                line = raw.decode("utf-8", errors="ignore").strip()
-                if line:
-                    self._push_log(line)
+                if self.protocolo == "binario":
+                    self._read_frames()
+                else:
+                    self._read_lines(buf)
             except Exception as e:
                 self._push_log(f"LOG,ms={int(time.time()*1000)},lvl=E,msg=serial_read_error:{e}")
                 time.sleep(0.5)
 
-stm = StmSerialBridge(SERIAL_PORT, SERIAL_BAUD)
+stm = StmSerialBridge(SERIAL_PORT, SERIAL_BAUD, SERIAL_PROTOCOLO,
+                      telemetria=TelemetriaSTAT(TELEM_DIR), mux=SERIAL_MUX)
+
+# --- Catálogo de recordings/ ---
+# Lista de arquivos em memória (ordenada por mtime) com cópia em SQLite: a
+# página, o ZIP, a conversão e a limpeza consultam o catálogo em vez de
+# glob + stat a cada requisição. O próprio serviço registra o que escreve
+# (fotos, .mp4 convertidos, remoções); o resto (gravação, cópias manuais) é
+# percebido pela thread de varredura, que relê o diretório só quando o mtime
+# dele muda (entrada criada/apagada/renomeada) e faz uma revisão completa
+# (tamanhos) a cada CATALOGO_REVISAO_S. Arquivos .part não entram.
+CATALOGO_DB = os.path.join(BASE_DIR, "catalogo.db")
+CATALOGO_VARREDURA_S = 2.0
+CATALOGO_REVISAO_S = 300.0
+CATALOGO_PAGINA_MAX = 500
+
+
+class CatalogoArquivos:
+    def __init__(self, diretorio: str = REC_DIR, db: str = CATALOGO_DB):
+        self.diretorio = diretorio
+        self.lock = threading.Lock()
+        self.arquivos = {}              # nome -> (tamanho, mtime)
+        self.ordem = []                 # (mtime, nome), crescente
+        self.mtime_dir = None
+        self.stop_evt = threading.Event()
+        self.thread = None
+
+        self.db = sqlite3.connect(db, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS arquivos ("
+                        "nome TEXT PRIMARY KEY, tamanho INTEGER NOT NULL, mtime REAL NOT NULL)")
+        for nome, tamanho, mtime in self.db.execute("SELECT nome, tamanho, mtime FROM arquivos"):
+            self.arquivos[nome] = (tamanho, mtime)
+            self.ordem.append((mtime, nome))
+        self.ordem.sort()
+
+    # Alterações (com self.lock adquirido)
+    def _inserir(self, nome: str, tamanho: int, mtime: float) -> bool:
+        antigo = self.arquivos.get(nome)
+        if antigo == (tamanho, mtime):
+            return False
+        if antigo:
+            del self.ordem[bisect.bisect_left(self.ordem, (antigo[1], nome))]
+        self.arquivos[nome] = (tamanho, mtime)
+        bisect.insort(self.ordem, (mtime, nome))
+        return True
+
+    def _tirar(self, nome: str) -> bool:
+        antigo = self.arquivos.pop(nome, None)
+        if antigo is None:
+            return False
+        del self.ordem[bisect.bisect_left(self.ordem, (antigo[1], nome))]
+        return True
+
+    def _gravar(self, inseridos, removidos):
+        if inseridos:
+            self.db.executemany("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?)", inseridos)
+        if removidos:
+            self.db.executemany("DELETE FROM arquivos WHERE nome = ?", [(n,) for n in removidos])
+        if inseridos or removidos:
+            self.db.commit()
+
+    def registrar(self, caminho: str):
+        """Arquivo escrito pelo serviço (chamar depois do nome final existir)."""
+        try:
+            st = os.stat(caminho)
+        except FileNotFoundError:
+            return
+        nome = os.path.basename(caminho)
+        with self.lock:
+            if self._inserir(nome, st.st_size, st.st_mtime):
+                self._gravar([(nome, st.st_size, st.st_mtime)], [])
+
+    def remover(self, caminho: str):
+        nome = os.path.basename(caminho)
+        with self.lock:
+            if self._tirar(nome):
+                self._gravar([], [nome])
 
-# --- Funções auxiliares ---
-async def run_burst_sequence(count: int):
+    def sincronizar(self, completo: bool = False):
+        """Confere o diretório: entradas novas/sumidas; completo relê o stat de todas."""
+        try:
+            mtime_dir = os.stat(self.diretorio).st_mtime_ns
+        except OSError:
+            return
+        if not completo and mtime_dir == self.mtime_dir:
+            return
+        self.mtime_dir = mtime_dir
+
+        encontrados = {}
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                if entrada.name.endswith(".part"):
+                    continue
+                try:
+                    if not entrada.is_file():
+                        continue
+                    if completo or entrada.name not in self.arquivos:
+                        st = entrada.stat()
+                        encontrados[entrada.name] = (st.st_size, st.st_mtime)
+                    else:
+                        encontrados[entrada.name] = None     # já conhecido
+                except FileNotFoundError:
+                    continue
+
+        with self.lock:
+            inseridos = []
+            for nome, dados in encontrados.items():
+                if dados and self._inserir(nome, *dados):
+                    inseridos.append((nome, *dados))
+            removidos = [n for n in list(self.arquivos) if n not in encontrados and self._tirar(n)]
+            self._gravar(inseridos, removidos)
+        if inseridos or removidos:
+            logger.debug(f"Catálogo: +{len(inseridos)} -{len(removidos)} (total {len(self.arquivos)})")
+
+    def iniciar(self):
+        self.thread = threading.Thread(target=self._vigiar, name="catalogo", daemon=True)
+        self.thread.start()
+
+    def parar(self):
+        self.stop_evt.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _vigiar(self):
+        ultima_revisao = 0.0
+        while True:
+            completo = time.monotonic() - ultima_revisao >= CATALOGO_REVISAO_S
+            try:
+                self.sincronizar(completo)
+                if completo:
+                    ultima_revisao = time.monotonic()
+            except Exception as e:
+                logger.error(f"Catálogo: erro na varredura: {e}")
+            if self.stop_evt.wait(CATALOGO_VARREDURA_S):
+                return
+
+    def listar(self, extensoes=None, de: float = None, ate: float = None, busca: str = None,
+               offset: int = 0, limite: int = None, recentes_primeiro: bool = True):
+        """(total, página) com dicts {file, size, mtime, type}; de/ate filtram o mtime ([de, ate))."""
+        with self.lock:
+            ini = bisect.bisect_left(self.ordem, (de, "")) if de is not None else 0
+            fim = bisect.bisect_left(self.ordem, (ate, "")) if ate is not None else len(self.ordem)
+            janela = self.ordem[ini:fim]
+            if recentes_primeiro:
+                janela.reverse()
+            nomes = [n for _m, n in janela
+                     if (not extensoes or n.endswith(extensoes)) and (not busca or busca in n)]
+            pagina = nomes[offset:offset + limite if limite else None]
+            itens = [{"file": n, "size": self.arquivos[n][0], "mtime": self.arquivos[n][1],
+                      "type": os.path.splitext(n)[1].lstrip(".")} for n in pagina]
+        return len(nomes), itens
+
+    def caminhos(self, extensoes=None, de: float = None, ate: float = None, recentes_primeiro: bool = False):
+        """Caminhos completos (mais antigo primeiro, por padrão)."""
+        _total, itens = self.listar(extensoes, de, ate, recentes_primeiro=recentes_primeiro)
+        return [os.path.join(self.diretorio, i["file"]) for i in itens]
+
+
+catalogo = CatalogoArquivos()
+
+
+# --- Fila de conversão (.h264 -> .mp4) ---
+# Pool fixo de workers (threads) consumindo uma fila única: no Pi o gargalo é
+# o cartão SD, não a CPU (o ffmpeg só remuxa, -c copy). Um .h264 nunca entra
+# duas vezes enquanto pendente/em execução. Os jobs ficam em CONVERSAO_ARQUIVO
+# (JSON) e sobrevivem a reinícios: o que estava rodando volta para a fila.
+# Durante a gravação só segmentos fechados da gravação segmentada (pequenos)
+# começam; o resto espera. O ffmpeg roda sempre com nice/ionice "idle" para
+# não disputar o SD com o encoder.
+CONVERSAO_ARQUIVO = os.path.join(BASE_DIR, "conversoes.json")
+CONVERSAO_WORKERS = int(os.environ.get("CONVERSAO_WORKERS", "1"))
+CONVERSAO_HISTORICO = 200       # jobs terminados guardados no JSON
+CONVERSAO_ESPERA_S = 1.0        # reavaliação da pausa durante a gravação
+
+
+class ConversaoJob:
+    def __init__(self, job_id: int, h264: str, estado: str = "pendente", erro: str = None,
+                 criado_em: float = None, iniciado_em: float = None, fim_em: float = None,
+                 segmento: bool = False):
+        self.id = job_id
+        self.h264 = h264
+        self.segmento = segmento        # segmento de gravação segmentada: roda durante a gravação
+        self.estado = estado            # pendente | executando | concluido | erro
+        self.erro = erro
+        self.criado_em = criado_em or time.time()
+        self.iniciado_em = iniciado_em
+        self.fim_em = fim_em
+
+    def terminado(self) -> bool:
+        return self.estado in ("concluido", "erro")
+
+    def resumo(self) -> dict:
+        return {
+            "id": self.id,
+            "file": os.path.basename(self.h264),
+            "h264": self.h264,
+            "segmento": self.segmento,
+            "estado": self.estado,
+            "erro": self.erro,
+            "criado_em": self.criado_em,
+            "iniciado_em": self.iniciado_em,
+            "fim_em": self.fim_em,
+        }
+
+
+class ConversorH264:
     """
-    Sequência de fotos (burst) em background.
-    - Define modo photo_sequence
-    - Tira N fotos com rpicam-still
-    - Espera 0.5s entre cada foto
+    Agendador das conversões. pausar() -> True segura os workers antes de
+    iniciar um job (ex.: câmera gravando), exceto jobs de segmento.
     """
+    def __init__(self, arquivo: str = CONVERSAO_ARQUIVO, workers: int = CONVERSAO_WORKERS,
+                 pausar=None):
+        self.arquivo = arquivo
+        self.n_workers = max(workers, 1)
+        self.pausar = pausar or (lambda: False)
+        self.cond = threading.Condition()
+        self.jobs = {}                  # id -> ConversaoJob (ordem de criação)
+        self.fila = deque()             # ids pendentes
+        self.processos = {}             # id -> Popen do ffmpeg em execução
+        self.callbacks = {}             # id -> ao_terminar(job) (não persiste)
+        self.proximo_id = 1
+        self.ativo = False
+        self.threads = []
+        self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.arquivo) as f:
+                dados = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Conversão: {self.arquivo} ilegível, começando vazio ({e})")
+            return
+
+        for d in dados.get("jobs", []):
+            job = ConversaoJob(d["id"], d["h264"], d["estado"], d.get("erro"),
+                               d.get("criado_em"), d.get("iniciado_em"), d.get("fim_em"),
+                               d.get("segmento", False))
+            if not job.terminado():
+                # Interrompido por reinício: refaz do zero se o .h264 ainda existe
+                if os.path.exists(job.h264):
+                    job.estado, job.iniciado_em = "pendente", None
+                    self.fila.append(job.id)
+                else:
+                    job.estado, job.erro, job.fim_em = "erro", "arquivo sumiu", time.time()
+            self.jobs[job.id] = job
+        self.proximo_id = max(self.jobs, default=0) + 1
+        if self.fila:
+            logger.info(f"Conversão: {len(self.fila)} job(s) pendente(s) retomado(s)")
+
+    def _salvar(self):
+        # Chamado com self.cond adquirido
+        terminados = [j for j in self.jobs.values() if j.terminado()]
+        for antigo in terminados[:max(len(terminados) - CONVERSAO_HISTORICO, 0)]:
+            del self.jobs[antigo.id]
+        try:
+            with open(self.arquivo + ".part", "w") as f:
+                json.dump({"jobs": [j.resumo() for j in self.jobs.values()]}, f)
+            os.replace(self.arquivo + ".part", self.arquivo)
+        except OSError as e:
+            logger.error(f"Conversão: falha ao salvar {self.arquivo}: {e}")
+
+    def iniciar(self):
+        with self.cond:
+            if self.ativo:
+                return
+            self.ativo = True
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"conversao-{i}", daemon=True)
+            for i in range(self.n_workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def parar(self):
+        """Para os workers; conversões em andamento são abortadas e voltam para a fila."""
+        with self.cond:
+            self.ativo = False
+            for proc in self.processos.values():
+                proc.terminate()
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join(timeout=5)
+        self.threads = []
+
+    def enfileirar(self, h264: str, segmento: bool = False, ao_terminar=None):
+        """
+        Agenda a conversão; devolve (job, novo). Se o arquivo já está na fila,
+        devolve o job existente. ao_terminar(job) é chamado pelo worker no fim.
+        """
+        h264 = os.path.abspath(h264)
+        with self.cond:
+            for job in self.jobs.values():
+                if job.h264 == h264 and not job.terminado():
+                    if ao_terminar:
+                        self.callbacks[job.id] = ao_terminar
+                    return job, False
+            job = ConversaoJob(self.proximo_id, h264, segmento=segmento)
+            self.proximo_id += 1
+            if ao_terminar:
+                self.callbacks[job.id] = ao_terminar
+            self.jobs[job.id] = job
+            self.fila.append(job.id)
+            self._salvar()
+            self.cond.notify()
+        logger.info(f"Conversão: job {job.id} na fila ({os.path.basename(h264)})")
+        return job, True
+
+    def estado(self) -> dict:
+        with self.cond:
+            jobs = [j.resumo() for j in reversed(list(self.jobs.values()))]
+            contagem = {}
+            for j in jobs:
+                contagem[j["estado"]] = contagem.get(j["estado"], 0) + 1
+            return {
+                "workers": self.n_workers,
+                "pausado": self.pausar(),
+                "fila": len(self.fila),
+                "contagem": contagem,
+                "jobs": jobs,
+            }
+
+    def _proximo(self):
+        with self.cond:
+            while self.ativo:
+                pausado = self.pausar()
+                job_id = next((i for i in self.fila if not pausado or self.jobs[i].segmento), None)
+                if job_id is not None:
+                    self.fila.remove(job_id)
+                    job = self.jobs[job_id]
+                    job.estado, job.iniciado_em = "executando", time.time()
+                    self._salvar()
+                    return job
+                # Sem trabalho: acorda no enfileirar; pausado: reavalia periodicamente
+                self.cond.wait(CONVERSAO_ESPERA_S if self.fila else None)
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._proximo()
+            if job is None:
+                return
+            erro = self._converter(job)
+            ao_terminar = None
+            with self.cond:
+                self.processos.pop(job.id, None)
+                if erro == "interrompido":
+                    job.estado, job.iniciado_em = "pendente", None
+                    self.fila.appendleft(job.id)
+                else:
+                    job.estado = "erro" if erro else "concluido"
+                    job.erro = erro
+                    job.fim_em = time.time()
+                    ao_terminar = self.callbacks.pop(job.id, None)
+                self._salvar()
+            if ao_terminar:
+                try:
+                    ao_terminar(job)
+                except Exception as e:
+                    logger.error(f"Conversão: erro no retorno do job {job.id}: {e}")
+
+    def _converter(self, job: ConversaoJob):
+        """
+        Converte um .h264 para .mp4 via ffmpeg, depois apaga o .h264.
+        Retorna None (ok) ou a mensagem de erro.
+        """
+        h264_file = job.h264
+        mp4_file = h264_file[:-len(".h264")] + ".mp4"
+        parcial = mp4_file + ".part"     # a listagem nunca mostra um .mp4 incompleto
+        if not os.path.exists(h264_file):
+            return "arquivo sumiu"
+
+        logger.info(f"Iniciando conversão: {h264_file} → {mp4_file}")
+        # -c copy: remuxa sem recodificar (rápido). Pode falhar se o stream não estiver “compatível”.
+        cmd = ["nice", "-n", "19", "ionice", "-c", "3",
+               "ffmpeg", "-y", "-loglevel", "error", "-framerate", "30", "-i", h264_file,
+               "-c", "copy", "-f", "mp4", parcial]
+        try:
+            with self.cond:
+                if not self.ativo:
+                    return "interrompido"
+                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                self.processos[job.id] = proc
+            _out, err = proc.communicate()
+        except Exception as e:
+            logger.error(f"Erro conversão {h264_file}: {e}")
+            return str(e)
+
+        if proc.returncode != 0:
+            if os.path.exists(parcial):
+                os.remove(parcial)
+            if not self.ativo:
+                return "interrompido"
+            detalhe = err.decode("utf-8", errors="ignore").strip().splitlines()[-3:]
+            logger.error(f"ffmpeg erro {proc.returncode} ao converter {h264_file}: {detalhe}")
+            return f"ffmpeg {proc.returncode}: {' | '.join(detalhe)}"
+
+        os.replace(parcial, mp4_file)
+        os.remove(h264_file)
+        catalogo.registrar(mp4_file)
+        catalogo.remover(h264_file)
+        miniaturas.agendar(mp4_file)
+        hashes.agendar(mp4_file)
+        logger.info(f"Conversão concluída: {mp4_file}")
+        return None
+
+
+conversor = ConversorH264(pausar=lambda: cam.mode == "recording")
+
+# --- ZIP em streaming ---
+# O ZIP é montado enquanto é enviado: nenhum arquivo temporário no SD e o
+# primeiro byte sai logo. Membros "stored" (MP4/JPEG já são comprimidos);
+# como a saída não é seekable, o zipfile usa data descriptors após cada membro.
+ZIP_BLOCO = 1024 * 1024         # leitura por bloco (bytes)
+ZIP_EXTENSOES = (".mp4", ".jpg")
+
+
+class _SaidaZip:
+    """Destino do zipfile: só acumula o que foi escrito até o próximo yield."""
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self) -> bytes:
+        dados = b"".join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def zip_streaming(caminhos):
+    """Gerador com os bytes do ZIP dos arquivos (arquivo sumido no meio é pulado)."""
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for caminho in caminhos:
+            try:
+                f = open(caminho, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                info = zipfile.ZipInfo(os.path.basename(caminho), time.localtime(st.st_mtime)[:6])
+                with zf.open(info, "w", force_zip64=st.st_size >= zipfile.ZIP64_LIMIT) as membro:
+                    yield saida.esvaziar()      # cabeçalho local já vai para o cliente
+                    while bloco := f.read(ZIP_BLOCO):
+                        membro.write(bloco)
+                        yield saida.esvaziar()
+        yield saida.esvaziar()
+    yield saida.esvaziar()                      # diretório central
+
+
+def _instante(valor: str, fim: bool = False) -> float:
+    """Epoch (s) ou data ISO ("2025-06-01", "2025-06-01T14:30"); data sem hora no fim inclui o dia todo."""
     try:
-        cam.set_mode("photo_sequence")
-        for i in range(count):
-            filename = datetime.now().strftime(f"SEQ_{i+1}_%Y%m%d_%H%M%S.jpg")
-            filepath = os.path.join(REC_DIR, filename)
-            logger.info(f"Capturando foto sequência {i+1}/{count}: {filepath}")
-
-            # Aqui você suprime stdout/stderr; bom para “não poluir”
-            # Mas ruim para debugar: se falhar, você perde o motivo.
-            subprocess.run(
-                ["rpicam-still", "-t", "1", "-o", filepath, "--nopreview"],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
+        return float(valor)
+    except ValueError:
+        pass
+    try:
+        instante = datetime.fromisoformat(valor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"data inválida: {valor}")
+    if fim and len(valor) == 10:
+        instante += timedelta(days=1)
+    return instante.timestamp()
+
 
-            await asyncio.sleep(0.5)
-    finally:
-        cam.set_mode("idle")
+# --- Sincronização incremental (manifesto + Range) ---
+# /api/files/manifest lista os arquivos de recordings/ com tamanho, mtime e
+# SHA-256. O hash de cada arquivo é calculado uma vez, em background (logo
+# após a foto/conversão), e fica em HASH_INDICE, válido enquanto tamanho e
+# mtime não mudarem. sync_dataset.py usa o manifesto para baixar só o que
+# falta ou mudou, retomando downloads com Range.
+HASH_INDICE = os.path.join(BASE_DIR, "hashes.json")
+SYNC_IGNORAR = (".h264", ".part")   # ainda sendo gravados/convertidos
 
-def convert_single_h264(h264_file: str):
+
+class IndiceHashes:
     """
-    Converte um .h264 para .mp4 via ffmpeg, depois apaga o .h264.
+    Cache de SHA-256 dos arquivos de recordings/. O hash é calculado por uma
+    thread própria (agendado após cada foto/conversão e para o que o manifesto
+    encontrar sem cache), nunca dentro da requisição: o manifesto devolve só o
+    que já está no cache e marca o resto como pendente.
     """
-    try:
-        mp4_file = h264_file.replace(".h264", ".mp4")
-        logger.info(f"Iniciando conversão: {h264_file} → {mp4_file}")
+    def __init__(self, arquivo: str = HASH_INDICE):
+        self.arquivo = arquivo
+        self.cond = threading.Condition()
+        self.entradas = {}              # nome -> {"size", "mtime_ns", "sha256"}
+        self.fila = deque()             # nomes a calcular
+        self.na_fila = set()
+        self.ativo = False
+        self.thread = None
+        try:
+            with open(arquivo) as f:
+                self.entradas = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Hashes: {arquivo} ilegível, recalculando ({e})")
 
-        # -c copy: remuxa sem recodificar (rápido). Pode falhar se o stream não estiver “compatível”.
-        result = subprocess.run(
-            ["ffmpeg", "-y", "-framerate", "30", "-i", h264_file, "-c", "copy", mp4_file],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
+    def _valida(self, nome: str, st) -> dict:
+        entrada = self.entradas.get(nome)
+        if entrada and entrada["size"] == st.st_size and entrada["mtime_ns"] == st.st_mtime_ns:
+            return entrada
+        return None
 
-        if result.returncode != 0:
-            logger.error(f"ffmpeg erro {result.returncode} ao converter {h264_file}")
+    def agendar(self, caminho: str):
+        nome = os.path.basename(caminho)
+        if nome.endswith(SYNC_IGNORAR):
             return
+        with self.cond:
+            if nome not in self.na_fila:
+                self.na_fila.add(nome)
+                self.fila.append(nome)
+                self.cond.notify()
 
-        os.remove(h264_file)
-        logger.info(f"Conversão concluída: {mp4_file}")
+    def manifesto(self, desde: float = 0.0) -> list:
+        """
+        Arquivos de recordings/ (mtime >= desde) com tamanho, mtime e sha256.
+        Sem hash no cache: sha256 None e "pendente" (já agendado).
+        """
+        stats = {}
+        for caminho in catalogo.caminhos():
+            nome = os.path.basename(caminho)
+            if nome.endswith(SYNC_IGNORAR):
+                continue
+            try:
+                stats[nome] = os.stat(caminho)
+            except FileNotFoundError:
+                continue                    # convertido/apagado durante a listagem
+
+        arquivos, sem_hash = [], []
+        with self.cond:
+            for nome, st in stats.items():
+                entrada = self._valida(nome, st)
+                if entrada is None:
+                    sem_hash.append(nome)
+                if st.st_mtime < desde:
+                    continue
+                item = {"file": nome, "size": st.st_size, "mtime": st.st_mtime,
+                        "sha256": entrada["sha256"] if entrada else None}
+                if entrada is None:
+                    item["pendente"] = True
+                arquivos.append(item)
+            sumidos = set(self.entradas) - set(stats)
+            for nome in sumidos:
+                del self.entradas[nome]
+            copia = dict(self.entradas) if sumidos else None
+        for nome in sem_hash:
+            self.agendar(nome)
+        if copia is not None:
+            self._salvar(copia)
+        return arquivos
+
+    def iniciar(self):
+        with self.cond:
+            if self.ativo:
+                return
+            self.ativo = True
+        self.thread = threading.Thread(target=self._worker, name="hashes", daemon=True)
+        self.thread.start()
+        for caminho in catalogo.caminhos():
+            self.agendar(caminho)
+
+    def parar(self):
+        with self.cond:
+            self.ativo = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.fila or not self.ativo)
+                if not self.ativo:
+                    return
+                nome = self.fila.popleft()
+                self.na_fila.discard(nome)
+            try:
+                entrada = self._calcular(nome)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Hashes: falha em {nome}: {e}")
+                continue
+            with self.cond:
+                if entrada:
+                    self.entradas[nome] = entrada
+                # Salva quando a fila esvazia (não a cada arquivo de uma rajada)
+                copia = dict(self.entradas) if entrada and not self.fila else None
+            if copia is not None:
+                self._salvar(copia)
+
+    def _calcular(self, nome: str):
+        """Nova entrada do arquivo, ou None se o cache ainda vale (ou se parou no meio)."""
+        with open(os.path.join(REC_DIR, nome), "rb") as f:
+            # fstat do arquivo aberto: stat e hash do mesmo inode (os.replace no meio não confunde)
+            st = os.fstat(f.fileno())
+            with self.cond:
+                if self._valida(nome, st):
+                    return None
+            h = hashlib.sha256()
+            while bloco := f.read(ZIP_BLOCO):
+                if not self.ativo:
+                    return None
+                h.update(bloco)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+
+    def _salvar(self, entradas: dict):
+        try:
+            with open(self.arquivo + ".part", "w") as f:
+                json.dump(entradas, f)
+            os.replace(self.arquivo + ".part", self.arquivo)
+        except OSError as e:
+            logger.error(f"Hashes: falha ao salvar {self.arquivo}: {e}")
+
+
+hashes = IndiceHashes()
+
+
+def _ler_faixa(caminho: str, inicio: int, fim: int):
+    """Bytes [inicio, fim] do arquivo, em blocos de ZIP_BLOCO."""
+    with open(caminho, "rb") as f:
+        f.seek(inicio)
+        restante = fim - inicio + 1
+        while restante > 0:
+            bloco = f.read(min(ZIP_BLOCO, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
+
+
+# --- Miniaturas (galeria) ---
+# JPEG pequeno para cada foto e um quadro ("poster") para cada vídeo, gerados
+# pelo ffmpeg (já usado na conversão) em workers limitados: sob demanda pela
+# galeria e, com fila limitada, logo após cada foto/conversão. O cache em
+# disco (MINIATURA_DIR) tem limite de tamanho e descarta a menos usada (LRU;
+# a ordem sobrevive a reinícios pelo mtime da miniatura, tocado a cada uso).
+MINIATURA_DIR = os.path.join(BASE_DIR, "thumbs")
+MINIATURA_LARGURA = 320
+MINIATURA_CACHE_MB = float(os.environ.get("MINIATURA_CACHE_MB", "200"))
+MINIATURA_WORKERS = 1
+MINIATURA_FILA_MAX = 200        # pré-geração além disso fica para a galeria pedir
+MINIATURA_POSTER_S = 1.0        # instante do quadro do vídeo
+MINIATURA_ESPERA_S = 10.0       # espera máxima da requisição pela geração
+MINIATURA_TOQUE_S = 3600.0      # atualiza o mtime (ordem LRU) no máximo 1x por hora
+MINIATURA_EXTENSOES = (".jpg", ".mp4")
+MINIATURA_CACHE_CONTROL = "public, max-age=604800"
+
+
+class CacheMiniaturas:
+    def __init__(self, diretorio: str = MINIATURA_DIR, limite_mb: float = MINIATURA_CACHE_MB,
+                 workers: int = MINIATURA_WORKERS):
+        self.diretorio = diretorio
+        self.limite = int(limite_mb * 1024 * 1024)
+        self.n_workers = workers
+        self.cond = threading.Condition()
+        self.lru = OrderedDict()        # nome da origem -> bytes da miniatura (menos usada primeiro)
+        self.total = 0
+        self.fila = deque()             # nomes a gerar
+        self.futuros = {}               # nome -> concurrent.futures.Future(caminho)
+        self.erros = {}                 # nome -> (mtime_ns da origem, erro): não tenta de novo
+        self.ativo = False
+        self.threads = []
+        self.stats = {"geradas": 0, "falhas": 0, "acertos": 0, "descartadas": 0}
+
+        os.makedirs(diretorio, exist_ok=True)
+        existentes = []
+        with os.scandir(diretorio) as entradas:
+            for entrada in entradas:
+                if entrada.name.endswith(".part"):
+                    os.remove(entrada.path)
+                elif entrada.is_file():
+                    st = entrada.stat()
+                    existentes.append((st.st_mtime, entrada.name[:-len(".jpg")], st.st_size))
+        for _mtime, nome, tamanho in sorted(existentes):
+            self.lru[nome] = tamanho
+            self.total += tamanho
+
+    def caminho(self, nome: str) -> str:
+        return os.path.join(self.diretorio, nome + ".jpg")
+
+    def valida(self, nome: str):
+        """Caminho da miniatura se existe e não é mais velha que a origem; senão None."""
+        try:
+            origem = os.stat(os.path.join(REC_DIR, nome))
+            miniatura = os.stat(self.caminho(nome))
+        except FileNotFoundError:
+            return None
+        return self.caminho(nome) if miniatura.st_mtime >= origem.st_mtime else None
+
+    def usar(self, nome: str):
+        with self.cond:
+            if nome in self.lru:
+                self.lru.move_to_end(nome)
+            self.stats["acertos"] += 1
+        caminho = self.caminho(nome)
+        try:
+            if time.time() - os.path.getmtime(caminho) > MINIATURA_TOQUE_S:
+                os.utime(caminho)
+        except FileNotFoundError:
+            pass
+
+    def agendar(self, origem: str, urgente: bool = False):
+        """
+        Pede a miniatura de um arquivo de recordings/. Devolve o Future do
+        caminho (o mesmo para pedidos repetidos) ou None (tipo sem miniatura,
+        ou fila cheia em pedido não urgente).
+        """
+        nome = os.path.basename(origem)
+        if not nome.endswith(MINIATURA_EXTENSOES):
+            return None
+        with self.cond:
+            futuro = self.futuros.get(nome)
+            if futuro:
+                if urgente and nome in self.fila:
+                    self.fila.remove(nome)
+                    self.fila.appendleft(nome)
+                return futuro
+            if not urgente and len(self.fila) >= MINIATURA_FILA_MAX:
+                return None
+            futuro = concurrent.futures.Future()
+            self.futuros[nome] = futuro
+            if urgente:
+                self.fila.appendleft(nome)
+            else:
+                self.fila.append(nome)
+            self.cond.notify()
+            return futuro
+
+    def remover(self, nome: str):
+        self.erros.pop(nome, None)
+        with self.cond:
+            tamanho = self.lru.pop(nome, None)
+            if tamanho is not None:
+                self.total -= tamanho
+        try:
+            os.remove(self.caminho(nome))
+        except FileNotFoundError:
+            pass
+
+    def estatisticas(self) -> dict:
+        with self.cond:
+            return dict(self.stats, arquivos=len(self.lru), bytes=self.total,
+                        limite_bytes=self.limite, fila=len(self.fila))
+
+    def iniciar(self):
+        with self.cond:
+            if self.ativo:
+                return
+            self.ativo = True
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"miniaturas-{i}", daemon=True)
+            for i in range(self.n_workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def parar(self):
+        with self.cond:
+            self.ativo = False
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join(timeout=5)
+        self.threads = []
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.fila or not self.ativo)
+                if not self.ativo:
+                    return
+                nome = self.fila.popleft()
+                futuro = self.futuros[nome]
+            try:
+                resultado, erro = self._gerar(nome), None
+            except Exception as e:
+                resultado, erro = None, e
+            with self.cond:
+                self.futuros.pop(nome, None)
+                self.stats["falhas" if erro else "geradas"] += 1
+            if futuro.done():
+                continue
+            if erro:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+    def _gerar(self, nome: str) -> str:
+        pronta = self.valida(nome)
+        if pronta:
+            return pronta
+        origem = os.path.join(REC_DIR, nome)
+        mtime_ns = os.stat(origem).st_mtime_ns
+        anterior = self.erros.get(nome)
+        if anterior and anterior[0] == mtime_ns:
+            raise RuntimeError(anterior[1])
+
+        destino = self.caminho(nome)
+        parcial = destino + ".part"
+        saida = ["-frames:v", "1", "-vf", f"scale={MINIATURA_LARGURA}:-2", "-q:v", "5",
+                 "-f", "mjpeg", parcial]
+        tentativas = [["-i", origem]]
+        if nome.endswith(".mp4"):
+            # Poster um pouco depois do início (o 1º quadro costuma estar escuro);
+            # vídeo mais curto que isso: primeiro quadro
+            tentativas.insert(0, ["-ss", str(MINIATURA_POSTER_S), "-i", origem])
+        for entrada in tentativas:
+            result = subprocess.run(
+                ["nice", "-n", "10", "ffmpeg", "-y", "-loglevel", "error", *entrada, *saida],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=30)
+            if result.returncode == 0 and os.path.exists(parcial) and os.path.getsize(parcial):
+                break
+        else:
+            if os.path.exists(parcial):
+                os.remove(parcial)
+            detalhe = result.stderr.decode("utf-8", errors="ignore").strip().splitlines()[-1:]
+            erro = f"ffmpeg {result.returncode}: {' '.join(detalhe)}"
+            self.erros[nome] = (mtime_ns, erro)
+            raise RuntimeError(erro)
+
+        os.replace(parcial, destino)
+        self._adicionar(nome, os.path.getsize(destino))
+        return destino
+
+    def _adicionar(self, nome: str, tamanho: int):
+        descartar = []
+        with self.cond:
+            self.total += tamanho - self.lru.pop(nome, 0)
+            self.lru[nome] = tamanho
+            while self.total > self.limite and len(self.lru) > 1:
+                velho, t = self.lru.popitem(last=False)
+                self.total -= t
+                self.stats["descartadas"] += 1
+                descartar.append(velho)
+        for velho in descartar:
+            try:
+                os.remove(self.caminho(velho))
+            except FileNotFoundError:
+                pass
+
+
+miniaturas = CacheMiniaturas()
 
-    except Exception as e:
-        logger.error(f"Erro conversão {h264_file}: {e}")
 
 # --- Rotas principais ---
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """
-    Renderiza o index.html listando arquivos mais recentes (mp4/jpg) em recordings/.
+    Renderiza o index.html. A galeria (mp4/jpg mais recentes) é carregada
+    pela página em /api/files, por páginas.
     """
-    all_files = sorted(
-        glob(os.path.join(REC_DIR, "*")),
-        key=os.path.getmtime,
-        reverse=True
-    )
-
-    # Filtra apenas mp4/jpg
-    files = [
-        os.path.basename(f)
-        for f in all_files
-        if f.endswith((".mp4", ".jpg"))
-    ]
+    # Página aberta: deixa o pipeline de fotos pronto para o primeiro clique
+    cam.aquecer()
 
-    return templates.TemplateResponse("index.html", {"request": request, "files": files})
+    return templates.TemplateResponse("index.html", {"request": request})
 
 @app.get("/api/status")
 def get_status():
     """
-    Retorna o estado atual da câmera (idle/recording/photo_sequence).
+    Retorna o estado atual da câmera (idle/recording/photo_sequence) e o
+    progresso da sequência em andamento (ou da última).
     """
-    return {"mode": cam.mode}
+    job = capturas.atual
+    return {"mode": cam.mode, "captura": job.resumo() if job else None}
 
 @app.get("/api/record/start")
-def start_record():
+async def start_record():
     """
     Inicia gravação.
     OBS: rota GET com efeito colateral (iniciar gravação) — normalmente seria POST.
     """
     try:
+        if cam.mode != "idle":
+            raise Exception("Câmera ocupada!")
+        if not cam.backend.foto_durante_gravacao:
+            await cam.fotos.parar()  # O sensor é um só: libera para o rpicam-vid
         filename = datetime.now().strftime("VID_%Y%m%d_%H%M%S")
         cam.start_recording(filename)
         return {"status": "recording", "file": filename}
@@ -328,82 +2220,270 @@ def start_record():
 @app.get("/api/record/stop")
 def stop_record():
     """
-    Para gravação se estava gravando.
+    Para gravação se estava gravando e agenda a conversão do .h264.
     """
     filename = cam.stop_recording()
     if filename:
-        return {"status": "stopped", "file": filename}
+        sessao = cam.sessao
+        if sessao and sessao.base == filename:
+            # Segmentada: os segmentos já estão na fila (o último, desde agora)
+            return {"status": "stopped", "file": filename,
+                    "manifest": os.path.basename(sessao.manifesto),
+                    "segments": len(sessao.segmentos)}
+        job, _novo = conversor.enfileirar(os.path.join(REC_DIR, f"{filename}.h264"))
+        return {"status": "stopped", "file": filename, "job": job.id}
     return {"status": "ignored"}
 
 @app.get("/api/photo/single")
-def take_single_photo():
+async def take_single_photo():
     """
     Tira foto única.
     """
     try:
-        cam.take_photo()
-        return {"status": "captured"}
+        filename = await cam.take_photo()
+        return {"status": "captured", "file": filename}
     except Exception as e:
         raise HTTPException(status_code=409, detail=str(e))
 
 @app.get("/api/photo/sequence")
-async def take_sequence(background_tasks: BackgroundTasks):
+async def take_sequence(
+    count: int = Query(5, ge=1, le=100),
+    interval_ms: int = Query(int(SEQUENCIA_INTERVALO_S * 1000), ge=0, le=60000),
+):
     """
-    Dispara sequência de 5 fotos em background.
+    Dispara sequência de count fotos (padrão 5) espaçadas de interval_ms.
+    interval_ms=0 pega quadros consecutivos (CAMERA_FPS). Retorna o id do job;
+    o progresso fica em /api/photo/jobs/{id} (e em /api/status).
     """
-    if cam.mode != "idle":
-        raise HTTPException(status_code=409, detail="Ocupado")
+    try:
+        job = capturas.iniciar(count, interval_ms / 1000)
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "job": job.id, "count": count, "interval_ms": interval_ms}
 
-    background_tasks.add_task(run_burst_sequence, 5)
-    return {"status": "started"}
+@app.get("/api/photo/jobs")
+def list_photo_jobs():
+    """
+    Sequências recentes (mais nova primeiro).
+    """
+    return [job.resumo() for job in reversed(list(capturas.jobs.values()))]
+
+def _job_captura(job_id: str) -> CapturaJob:
+    job = capturas.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+@app.get("/api/photo/jobs/{job_id}")
+def get_photo_job(job_id: str):
+    return _job_captura(job_id).resumo()
+
+@app.get("/api/photo/jobs/{job_id}/cancel")
+async def cancel_photo_job(job_id: str):
+    """
+    Cancela a sequência (as fotos já salvas ficam). Espera a task encerrar.
+    """
+    job = capturas.cancelar(_job_captura(job_id).id)
+    if job.task:
+        await asyncio.wait([job.task])
+    return job.resumo()
 
 # --- Conversão manual ---
 @app.get("/api/convert_all")
-def convert_all(background_tasks: BackgroundTasks):
+def convert_all():
     """
-    Procura todos os .h264 e agenda conversão em background.
+    Procura todos os .h264 (menos o que está sendo gravado) e agenda a
+    conversão na fila. Arquivos já na fila não são agendados de novo.
     """
-    h264_files = glob(os.path.join(REC_DIR, "*.h264"))
+    h264_files = catalogo.caminhos((".h264",))
+    if cam.mode == "recording" and cam.current_filename:
+        # Arquivo (ou segmentos) da gravação atual: os fechados já estão na fila
+        h264_files = [f for f in h264_files
+                      if not os.path.basename(f).startswith(cam.current_filename)]
 
     if not h264_files:
         return {"status": "no_files"}
 
-    for f in h264_files:
-        background_tasks.add_task(convert_single_h264, f)
+    novos = sum(conversor.enfileirar(f)[1] for f in h264_files)
+    return {"status": "conversion_started", "count": novos,
+            "already_queued": len(h264_files) - novos}
 
-    return {"status": "conversion_started", "count": len(h264_files)}
+@app.get("/api/jobs")
+def conversion_jobs():
+    """
+    Jobs de conversão (mais novo primeiro), contagem por estado e se a fila
+    está pausada pela gravação.
+    """
+    return conversor.estado()
 
 # --- Manipulação de arquivos ---
+@app.get("/api/files")
+def list_files(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=CATALOGO_PAGINA_MAX),
+    tipos: str = Query(None, alias="type"),
+    de: str = Query(None, alias="from"),
+    ate: str = Query(None, alias="to"),
+    q: str = None,
+):
+    """
+    Página do catálogo de recordings/ (mais recentes primeiro).
+    type: extensões separadas por vírgula (ex.: "mp4,jpg"); from/to: mtime
+    (epoch ou data ISO); q: trecho do nome.
+    """
+    extensoes = tuple(f".{t.strip().lstrip('.')}" for t in tipos.split(",") if t.strip()) if tipos else None
+    total, itens = catalogo.listar(
+        extensoes,
+        _instante(de) if de else None,
+        _instante(ate, fim=True) if ate else None,
+        q,
+        offset,
+        limit,
+    )
+    return {"total": total, "offset": offset, "limit": limit, "arquivos": itens}
+
+@app.get("/api/files/thumb/{filename}")
+async def file_thumb(filename: str, etag_cliente: str = Header(None, alias="if-none-match")):
+    """
+    Miniatura JPEG (MINIATURA_LARGURA px) de uma foto ou poster de um vídeo.
+    Gerada na hora se não está no cache (espera até MINIATURA_ESPERA_S).
+    ETag = tamanho/mtime da origem: o navegador revalida com 304.
+    """
+    nome = os.path.basename(filename)
+    origem = os.path.join(REC_DIR, nome)
+    try:
+        st = os.stat(origem)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    if not nome.endswith(MINIATURA_EXTENSOES):
+        raise HTTPException(status_code=404, detail="Sem miniatura para este tipo")
+
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    cabecalhos = {"ETag": etag, "Cache-Control": MINIATURA_CACHE_CONTROL}
+    if etag_cliente == etag:
+        return Response(status_code=304, headers=cabecalhos)
+
+    caminho = miniaturas.valida(nome)
+    if caminho:
+        miniaturas.usar(nome)
+    else:
+        futuro = asyncio.wrap_future(miniaturas.agendar(origem, urgente=True))
+        # asyncio.wait não cancela o futuro no timeout (outra requisição pode esperar o mesmo)
+        feitos, _ = await asyncio.wait({futuro}, timeout=MINIATURA_ESPERA_S)
+        if not feitos:
+            raise HTTPException(status_code=503, detail="Miniatura em geração",
+                                headers={"Retry-After": "2"})
+        try:
+            caminho = futuro.result()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Falha ao gerar miniatura: {e}")
+    return FileResponse(caminho, media_type="image/jpeg", headers=cabecalhos)
+
+@app.get("/api/files/thumbs/stats")
+def thumbs_stats():
+    return miniaturas.estatisticas()
+
+@app.get("/api/files/manifest")
+def files_manifest(since: float = 0.0):
+    """
+    Arquivos de recordings/ (menos .h264/.part) com size, mtime e sha256.
+    since (epoch): só arquivos modificados a partir desse instante.
+    Arquivos ainda sem hash vêm com sha256 null e "pendente": true; o hash é
+    calculado em background e aparece num manifesto seguinte.
+    """
+    arquivos = hashes.manifesto(since)
+    pendentes = sum(1 for a in arquivos if a.get("pendente"))
+    return {"algoritmo": "sha256", "gerado_em": time.time(), "pendentes": pendentes,
+            "arquivos": arquivos}
+
 @app.get("/api/files/download/{filename}")
-def download_file(filename: str):
+def download_file(filename: str, faixa: str = Header(None, alias="range")):
     """
-    Baixa um arquivo de recordings/.
-    ALERTA: sem sanitização, pode existir risco de path traversal (ex: ../).
+    Baixa um arquivo de recordings/ (só o nome; caminhos são ignorados).
+    Aceita "Range: bytes=inicio-[fim]" (uma faixa) para retomar downloads.
     """
-    return FileResponse(os.path.join(REC_DIR, filename))
+    caminho = os.path.join(REC_DIR, os.path.basename(filename))
+    if not os.path.isfile(caminho):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", faixa.strip()) if faixa else None
+    if not m or m.groups() == ("", ""):
+        # Sem Range (ou Range que não suportamos): arquivo inteiro
+        return FileResponse(caminho, headers={"Accept-Ranges": "bytes"})
+
+    tamanho = os.path.getsize(caminho)
+    if m.group(1):
+        inicio = int(m.group(1))
+        fim = min(int(m.group(2)), tamanho - 1) if m.group(2) else tamanho - 1
+    else:
+        inicio = max(tamanho - int(m.group(2)), 0)   # "bytes=-N": últimos N bytes
+        fim = tamanho - 1
+    if inicio >= tamanho or inicio > fim:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{tamanho}"})
+
+    return StreamingResponse(
+        _ler_faixa(caminho, inicio, fim),
+        status_code=206,
+        media_type=mimetypes.guess_type(caminho)[0] or "application/octet-stream",
+        headers={
+            "Content-Range": f"bytes {inicio}-{fim}/{tamanho}",
+            "Content-Length": str(fim - inicio + 1),
+            "Accept-Ranges": "bytes",
+        },
+    )
 
 @app.get("/api/files/delete_all")
 def delete_all():
     """
-    Apaga tudo em recordings/.
-    ALERTA: sem try/except e sem checar se é arquivo (pode falhar se houver subpastas).
+    Apaga tudo em recordings/. Varre o diretório (e não o catálogo), para
+    pegar também arquivos criados depois da última sincronização do catálogo.
+    Arquivos .part (conversões/escritas em andamento) ficam.
     """
-    for f in glob(os.path.join(REC_DIR, "*")):
-        os.remove(f)
+    with os.scandir(REC_DIR) as entradas:
+        for entrada in entradas:
+            if entrada.name.endswith(".part") or not entrada.is_file():
+                continue
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+            miniaturas.remover(entrada.name)
+    catalogo.sincronizar(completo=True)
     return {"status": "deleted"}
 
 @app.get("/api/files/zip")
-def download_zip():
+def download_zip(
+    de: str = Query(None, alias="from"),
+    ate: str = Query(None, alias="to"),
+    files: str = None,
+):
     """
-    Cria um ZIP com mp4/jpg e retorna para download.
-    OBS: escreve em BASE_DIR/media.zip (fixo) — chamadas concorrentes podem colidir.
+    ZIP (stored, em streaming) dos mp4/jpg de recordings/.
+    from/to: intervalo pela data de modificação (epoch ou data ISO).
+    files: lista de nomes separada por vírgula (qualquer arquivo de recordings/).
+    Downloads simultâneos são independentes (nada é escrito em disco).
     """
-    zip_path = os.path.join(BASE_DIR, "media.zip")
-    with zipfile.ZipFile(zip_path, "w") as zipf:
-        for f in glob(os.path.join(REC_DIR, "*")):
-            if f.endswith((".mp4", ".jpg")):
-                zipf.write(f, os.path.basename(f))
-    return FileResponse(zip_path, filename="media.zip")
+    if files:
+        nomes = list(dict.fromkeys(os.path.basename(n.strip()) for n in files.split(",") if n.strip()))
+        caminhos = [os.path.join(REC_DIR, n) for n in nomes]
+        faltando = [n for n, c in zip(nomes, caminhos) if not os.path.isfile(c)]
+        if faltando:
+            raise HTTPException(status_code=404, detail=f"arquivos não encontrados: {faltando}")
+    else:
+        caminhos = catalogo.caminhos(ZIP_EXTENSOES,
+                                     _instante(de) if de else None,
+                                     _instante(ate, fim=True) if ate else None)
+
+    if not caminhos:
+        raise HTTPException(status_code=404, detail="Nenhum arquivo para o ZIP")
+
+    nome = datetime.now().strftime("media_%Y%m%d_%H%M%S.zip")
+    logger.info(f"ZIP: {len(caminhos)} arquivo(s) -> {nome}")
+    return StreamingResponse(
+        zip_streaming(caminhos),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nome}"'},
+    )
 
 # --- Logs ---
 @app.get("/api/logs/app")
@@ -497,58 +2577,108 @@ def enable_tailscale():
         logger.error(f"Erro ao ativar tailscale: {e}")
         return {"error": str(e)}
 
+async def _comando_motor(cmd: str) -> dict:
+    """Envia cmd ao STM e espera a resposta; devolve a linha e o tempo de ida e volta."""
+    try:
+        r = await stm.comando(cmd)
+    except TimeoutError as e:
+        # Antes do OSError: TimeoutError é subclasse dele
+        raise HTTPException(status_code=504, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except (serial.SerialException, OSError) as e:
+        # write() falhou (USB desconectado, mux encerrado): porta indisponível
+        raise HTTPException(status_code=503, detail=f"Falha na serial: {e}")
+    return {"ok": True, "resposta": r["resposta"], "rtt_ms": r["rtt_ms"]}
+
 @app.get("/api/motor/on")
-def motor_on():
-    stm.send("ON")
-    return {"ok": True}
+async def motor_on():
+    return await _comando_motor("ON")
 
 @app.get("/api/motor/off")
-def motor_off():
-    stm.send("OFF")
-    return {"ok": True}
+async def motor_off():
+    return await _comando_motor("OFF")
 
 @app.get("/api/motor/status")
-def motor_status():
-    # dispara STATUS no STM e devolve o último status conhecido também
-    stm.send("STATUS")
-    return {"ok": True, "last": stm.last_status}
+async def motor_status():
+    # dispara STATUS no STM e devolve a resposta (EN=... | FIXED_CCR=... | ARR=...)
+    r = await _comando_motor("STATUS")
+    r["status"] = StmSerialBridge._parse_status(r["resposta"])
+    r["last"] = stm.last_status
+    if stm.decodificador is not None:
+        d = stm.decodificador
+        r["link"] = {"quadros_ok": d.quadros_ok, "erros_crc": d.erros_crc,
+                     "seq_perdidas": d.seq_perdidas, "bytes_descartados": d.bytes_descartados}
+    return r
+
+@app.get("/api/motor/history")
+def motor_history(
+    de: float = Query(None, alias="from"),
+    ate: float = Query(None, alias="to"),
+    max_points: int = Query(500, ge=1, le=HISTORICO_MAX_PONTOS),
+    fields: str = None,
+):
+    """
+    Telemetria STAT entre from e to (epoch, s; padrão: última hora), com no
+    máximo max_points pontos (min/max/média por intervalo quando reduzida).
+    fields: lista separada por vírgula (ex.: "en,ccr"); padrão todos.
+    """
+    ate = time.time() if ate is None else ate
+    de = ate - 3600 if de is None else de
+    if de >= ate:
+        raise HTTPException(status_code=400, detail="from deve ser menor que to")
+    campos = None
+    if fields:
+        campos = [c.strip() for c in fields.split(",") if c.strip()]
+        invalidos = [c for c in campos if c not in TELEMETRIA_CAMPOS]
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"campos desconhecidos: {invalidos}")
+    return stm.telemetria.historico(de, ate, max_points, campos)
 
 @app.get("/api/motor/stream")
-def motor_stream():
-    q = queue.Queue(maxsize=200)
-
-    # registra cliente SSE
-    with stm.sse_lock:
-        stm.sse_clients.add(q)
-
-    def gen():
-        # opcional: manda backlog imediato
-        for line in list(stm.logs)[-50:]:
-            yield f"data: {line}\n\n"
-
-        try:
-            while True:
-                line = q.get()
-                yield f"data: {line}\n\n"
-        finally:
-            with stm.sse_lock:
-                stm.sse_clients.discard(q)
+async def motor_stream():
+    # Roda no event loop: nenhum worker do threadpool fica preso por cliente
+    cliente = stm.hub.conectar()
+    backlog = list(stm.logs)[-50:]  # manda backlog imediato
+    return StreamingResponse(
+        stm.hub.eventos(cliente, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
-    return StreamingResponse(gen(), media_type="text/event-stream")
+@app.get("/api/motor/stream/stats")
+async def motor_stream_stats():
+    return stm.hub.estatisticas()
 
 @app.on_event("startup")
 def _startup():
+    catalogo.sincronizar()
+    catalogo.iniciar()
+    miniaturas.iniciar()
+    hashes.iniciar()
+    recuperar_sessoes()
+    conversor.iniciar()
     try:
         stm.open()
-        logger.info(f"STM serial aberta em {stm.port} @ {stm.baud}")
+        if stm.mux:
+            logger.info(f"STM via serial_mux em {stm.mux}")
+        else:
+            logger.info(f"STM serial aberta em {stm.port} @ {stm.baud}")
     except Exception as e:
         logger.error(f"Falha ao abrir serial STM: {e}")
 
 # --- Shutdown ---
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     """
     Quando o servidor desliga, garante que processo da câmera não fique órfão.
     """
-    cam.stop_process()
+    if capturas.atual and not capturas.atual.terminado():
+        capturas.cancelar(capturas.atual.id)
+    await asyncio.to_thread(cam.stop_process)
+    await cam.fotos.parar()
+    await asyncio.to_thread(conversor.parar)
+    catalogo.parar()
+    await asyncio.to_thread(miniaturas.parar)
+    await asyncio.to_thread(hashes.parar)
     stm.close()
@@ -0,0 +1,186 @@
+# sync_dataset.py
+# Cliente de sincronização do dataset: roda no notebook, conectado ao AP do robô.
+#
+# Baixa de /api/files/manifest a lista de arquivos (tamanho, mtime, SHA-256) e
+# transfere só o que falta ou mudou. Downloads interrompidos ficam em
+# <arquivo>.part e continuam de onde pararam (HTTP Range) na próxima tentativa;
+# cada arquivo é conferido pelo SHA-256 antes de ganhar o nome final.
+#
+# Uso:
+#   python3 sync_dataset.py --url http://10.0.0.1:8000 --destino ./dataset
+#   python3 sync_dataset.py --url http://10.0.0.1:8000 --destino ./dataset --desde 2025-06-01
+#
+# O índice local (<destino>/.sync_index.json) guarda o hash dos arquivos já
+# baixados; arquivos locais não são relidos a cada execução. Arquivos que o
+# robô ainda não terminou de hashear vêm como "pendente" no manifesto: o cliente
+# baixa o resto e volta a pedir o manifesto por até --esperar-hash segundos.
+# Só biblioteca padrão.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+BLOCO = 256 * 1024
+INDICE = ".sync_index.json"
+ESPERA_HASH_S = 5.0     # intervalo entre manifestos enquanto há hashes pendentes no robô
+
+
+def carregar_indice(destino):
+    try:
+        with open(os.path.join(destino, INDICE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def salvar_indice(destino, indice):
+    caminho = os.path.join(destino, INDICE)
+    with open(caminho + ".tmp", "w") as f:
+        json.dump(indice, f)
+    os.replace(caminho + ".tmp", caminho)
+
+
+def hash_local(caminho):
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        while bloco := f.read(BLOCO):
+            h.update(bloco)
+    return h
+
+
+def atualizado(destino, indice, arq):
+    """True se o arquivo local já é o do manifesto (pelo índice, sem reler o arquivo)."""
+    caminho = os.path.join(destino, arq["file"])
+    entrada = indice.get(arq["file"])
+    if not entrada or entrada["sha256"] != arq["sha256"]:
+        return False
+    try:
+        st = os.stat(caminho)
+    except FileNotFoundError:
+        return False
+    return st.st_size == entrada["size"] and st.st_mtime_ns == entrada["mtime_ns"]
+
+
+def baixar(url, destino, arq, timeout):
+    """
+    Baixa (ou continua) um arquivo para <nome>.part e confere o SHA-256.
+    Retorna os bytes transferidos nesta chamada. Erros de rede sobem para o chamador.
+    """
+    final = os.path.join(destino, arq["file"])
+    parcial = final + ".part"
+    ja_tem = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+    if ja_tem > arq["size"]:
+        os.remove(parcial)
+        ja_tem = 0
+
+    h = hash_local(parcial) if ja_tem else hashlib.sha256()
+    recebidos = 0
+    if ja_tem < arq["size"]:
+        pedido = urllib.request.Request(
+            f"{url}/api/files/download/{urllib.parse.quote(arq['file'])}")
+        if ja_tem:
+            pedido.add_header("Range", f"bytes={ja_tem}-")
+        with urllib.request.urlopen(pedido, timeout=timeout) as resp:
+            if ja_tem and resp.status != 206:
+                # Servidor ignorou o Range: recomeça do zero
+                h, ja_tem = hashlib.sha256(), 0
+            with open(parcial, "ab" if ja_tem else "wb") as f:
+                while bloco := resp.read(BLOCO):
+                    f.write(bloco)
+                    h.update(bloco)
+                    recebidos += len(bloco)
+
+    if h.hexdigest() != arq["sha256"]:
+        os.remove(parcial)
+        raise ValueError("SHA-256 não confere (arquivo mudou no robô ou veio corrompido)")
+    os.replace(parcial, final)
+    os.utime(final, (arq["mtime"], arq["mtime"]))
+    return recebidos
+
+
+def ler_manifesto(url, consulta, timeout):
+    with urllib.request.urlopen(f"{url}/api/files/manifest{consulta}", timeout=timeout) as resp:
+        return json.load(resp)
+
+
+def instante(valor):
+    try:
+        return float(valor)
+    except ValueError:
+        return datetime.fromisoformat(valor).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincroniza recordings/ do robô (incremental, com retomada)")
+    parser.add_argument("--url", default="http://10.0.0.1:8000", help="endereço do dataColector")
+    parser.add_argument("--destino", default="dataset", help="pasta local")
+    parser.add_argument("--desde", help="só arquivos modificados a partir de (epoch ou data ISO)")
+    parser.add_argument("--tentativas", type=int, default=5, help="tentativas por arquivo (Wi-Fi instável)")
+    parser.add_argument("--timeout", type=float, default=20.0, help="timeout de rede (s)")
+    parser.add_argument("--esperar-hash", type=float, default=60.0,
+                        help="espera máxima (s) por arquivos ainda sem hash no robô")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/")
+    os.makedirs(args.destino, exist_ok=True)
+    consulta = f"?since={instante(args.desde)}" if args.desde else ""
+    indice = carregar_indice(args.destino)
+
+    t0 = time.monotonic()
+    limite_espera = None
+    transferidos, falhas = 0, []
+    while True:
+        manifesto = ler_manifesto(url, consulta, args.timeout)
+        sem_hash = [a["file"] for a in manifesto["arquivos"] if a.get("sha256") is None]
+        pendentes = [a for a in manifesto["arquivos"]
+                     if a.get("sha256") and a["file"] not in falhas
+                     and not atualizado(args.destino, indice, a)]
+        total = sum(a["size"] for a in pendentes)
+        print(f"{len(manifesto['arquivos'])} arquivo(s) no robô, {len(pendentes)} a baixar "
+              f"({total / 1e6:.1f} MB)" + (f", {len(sem_hash)} sem hash ainda" if sem_hash else ""))
+
+        for i, arq in enumerate(pendentes, 1):
+            for tentativa in range(1, args.tentativas + 1):
+                try:
+                    transferidos += baixar(url, args.destino, arq, args.timeout)
+                    st = os.stat(os.path.join(args.destino, arq["file"]))
+                    indice[arq["file"]] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                           "sha256": arq["sha256"]}
+                    salvar_indice(args.destino, indice)
+                    print(f"[{i}/{len(pendentes)}] {arq['file']} ok")
+                    break
+                except (OSError, urllib.error.URLError, ValueError) as e:
+                    # .part continua no disco: a próxima tentativa retoma com Range
+                    print(f"[{i}/{len(pendentes)}] {arq['file']}: {e} (tentativa {tentativa})")
+                    time.sleep(min(2 ** tentativa, 30))
+            else:
+                falhas.append(arq["file"])
+
+        if not sem_hash:
+            break
+        if pendentes:
+            continue        # baixou algo nesta volta: os hashes podem já ter ficado prontos
+        if limite_espera is None:
+            limite_espera = time.monotonic() + args.esperar_hash
+        if time.monotonic() >= limite_espera:
+            print(f"Ainda sem hash no robô (rode de novo depois): {sem_hash}")
+            falhas.extend(sem_hash)
+            break
+        # O robô calcula os hashes em background: pede o manifesto de novo
+        time.sleep(ESPERA_HASH_S)
+
+    dur = time.monotonic() - t0
+    print(f"Transferido: {transferidos / 1e6:.1f} MB em {dur:.1f} s"
+          + (f" | falharam: {falhas}" if falhas else ""))
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())